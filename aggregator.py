@@ -0,0 +1,210 @@
+"""Streaming aggregation of probe samples pushed to dvel."""
+
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Optional, Set, Tuple
+
+
+class LaneStats(object):
+
+    """Sliding window statistics of a lane.
+
+    Every sample is added and evicted in amortized O(1): the mean is a running
+    sum, the min is kept in a monotonic deque and percentiles are read from a
+    log-scaled histogram of the samples that are in the window.
+    """
+
+    def __init__(
+        self,
+        window: float = 3.0,
+        alpha: float = 0.1,
+        resolution: float = 0.02,
+        max_rtt: float = 1.0e4,
+    ) -> None:
+        """Constructor of LaneStats.
+
+        :window: window length in seconds
+        :alpha: EWMA smoothing factor
+        :resolution: relative error of the percentile buckets
+        :max_rtt: rtts above it fall in the last bucket
+
+        """
+        self.window = window
+        self.alpha = alpha
+        self._log_base = math.log1p(resolution)
+        self._n_buckets = int(math.log(max_rtt) / self._log_base) + 2
+        self._hist = [0] * self._n_buckets
+        self._samples: Deque[Tuple[float, Optional[float]]] = deque()
+        self._mins: Deque[Tuple[float, float]] = deque()
+        self._sum = 0.0
+        self._count = 0
+        self._lost = 0
+        self.ewma: Optional[float] = None
+        self.jitter = 0.0
+        self.last_seen = 0.0
+        self._last_rtt: Optional[float] = None
+
+    def _bucket(self, rtt: float) -> int:
+        """Histogram bucket index of a rtt."""
+        if rtt <= 1.0:
+            return 0
+        return min(int(math.log(rtt) / self._log_base) + 1, self._n_buckets - 1)
+
+    def add(self, rtt: Optional[float], now: Optional[float] = None) -> None:
+        """Add a sample, a None rtt means the probe was lost.
+
+        :rtt: rtt in ms
+        :now: monotonic time of the sample
+
+        """
+        now = time.monotonic() if now is None else now
+        self.last_seen = now
+        self._samples.append((now, rtt))
+        if rtt is None:
+            self._lost += 1
+        else:
+            self._sum += rtt
+            self._count += 1
+            self._hist[self._bucket(rtt)] += 1
+            while self._mins and self._mins[-1][1] >= rtt:
+                self._mins.pop()
+            self._mins.append((now, rtt))
+            if self.ewma is None:
+                self.ewma = rtt
+            else:
+                self.ewma += self.alpha * (rtt - self.ewma)
+            # interarrival jitter estimator of RFC 3550
+            if self._last_rtt is not None:
+                self.jitter += (abs(rtt - self._last_rtt) - self.jitter) / 16.0
+            self._last_rtt = rtt
+        self.expire(now)
+
+    def expire(self, now: Optional[float] = None) -> None:
+        """Evict the samples that are older than the window."""
+        now = time.monotonic() if now is None else now
+        oldest = now - self.window
+        samples = self._samples
+        while samples and samples[0][0] < oldest:
+            _, rtt = samples.popleft()
+            if rtt is None:
+                self._lost -= 1
+            else:
+                self._sum -= rtt
+                self._count -= 1
+                self._hist[self._bucket(rtt)] -= 1
+        while self._mins and self._mins[0][0] < oldest:
+            self._mins.popleft()
+
+    @property
+    def count(self) -> int:
+        """Number of successful samples in the window."""
+        return self._count
+
+    @property
+    def mean(self) -> Optional[float]:
+        """Mean rtt of the successful samples in the window."""
+        if not self._count:
+            return None
+        return self._sum / self._count
+
+    @property
+    def min(self) -> Optional[float]:
+        """Min rtt in the window."""
+        return self._mins[0][1] if self._mins else None
+
+    @property
+    def loss_rate(self) -> float:
+        """Ratio of lost samples in the window."""
+        total = self._count + self._lost
+        return self._lost / total if total else 0.0
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Approximated q-th percentile (0-100) of the rtt in the window."""
+        if not self._count:
+            return None
+        rank = max(1, math.ceil(self._count * q / 100.0))
+        acc = 0
+        for i, n in enumerate(self._hist):
+            acc += n
+            if acc >= rank:
+                return math.exp(i * self._log_base) if i else 1.0
+        return None
+
+    def get(self, stat: str) -> Optional[float]:
+        """Get a statistic by name, either mean, ewma, min or pNN."""
+        if stat.startswith("p"):
+            return self.percentile(float(stat[1:]))
+        return getattr(self, stat)
+
+
+class StreamAggregator(object):
+
+    """Keep LaneStats of each probe that pushes samples to dvel.
+
+    The ingest format is one sample per line, ``<host> <rtt_ms>``, where a
+    ``-`` rtt means that the probe has been lost. A datagram or a request
+    body can carry several lines.
+    """
+
+    def __init__(self, window: float = 3.0, alpha: float = 0.1) -> None:
+        """Constructor of StreamAggregator."""
+        self.window = window
+        self.alpha = alpha
+        self.lanes: Dict[str, LaneStats] = {}
+        self.malformed = 0
+        self.dirty: Set[str] = set()
+        self._recent: "OrderedDict[str, float]" = OrderedDict()
+
+    def lane(self, host: str) -> LaneStats:
+        """Get or create the LaneStats of a host."""
+        stats = self.lanes.get(host)
+        if stats is None:
+            stats = LaneStats(window=self.window, alpha=self.alpha)
+            self.lanes[host] = stats
+        return stats
+
+    def add(self, host: str, rtt: Optional[float], now: Optional[float] = None) -> None:
+        """Add a sample of a host."""
+        now = time.monotonic() if now is None else now
+        self.lane(host).add(rtt, now)
+        self.dirty.add(host)
+        self._recent[host] = now
+        self._recent.move_to_end(host)
+
+    def pop_dirty(self, now: Optional[float] = None) -> Set[str]:
+        """Hosts that changed since the last call.
+
+        These are the hosts with new samples and the ones that haven't sent
+        any sample for a whole window, found in O(1) per host since hosts are
+        kept in the order they were last seen.
+        """
+        now = time.monotonic() if now is None else now
+        dirty, self.dirty = self.dirty, set()
+        oldest = now - self.window
+        while self._recent:
+            host, seen = next(iter(self._recent.items()))
+            if seen >= oldest:
+                break
+            del self._recent[host]
+            dirty.add(host)
+        return dirty
+
+    def ingest(self, payload: bytes) -> Set[str]:
+        """Parse and add the samples of a datagram or a request body.
+
+        It returns the hosts of the samples.
+        """
+        now = time.monotonic()
+        hosts = set()
+        for line in payload.decode(errors="ignore").splitlines():
+            try:
+                host, value = line.split()
+                rtt = None if value == "-" else float(value)
+            except ValueError:
+                self.malformed += 1
+                continue
+            self.add(host, rtt, now)
+            hosts.add(host)
+        return hosts
+
@@ -95,7 +95,12 @@ env = {
     host_d8: "10.0.0.8",
     "DB_SERVER": "172.17.0.1",
     "DB_NAME": "dvel",
-    "ENDPOINT": "echo"
+    "INGEST_SERVER": "172.17.0.1",
+    "INGEST_PORT": "8099",
+    "ENDPOINT": "echo",
+    "PROBE_MODE": "http",
+    "UDP_PORT": "8001",
+    "LOG_REQUESTS": "0",
 }
 
 controller_ip = "127.0.0.1"
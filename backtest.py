@@ -0,0 +1,273 @@
+"""Backtest of the lane forecasts over the probe history stored in InfluxDB.
+
+The rtt and loss series of the lanes of a pair, read from the rollups of
+the probes, are replayed through the lane selection twice, reacting to the
+window averages like the decision loop does and with settings.forecast, and
+the time spent on a degraded lane and the throughput lost on it are
+compared. Downsampled rollups cover longer ranges. From the directory that
+has the napps package:
+
+    python -m napps.viniarck.dvel.backtest d1-d2 --since 1d
+    python -m napps.viniarck.dvel.backtest d1-d2 --since 4w --step 60 \
+        --rp dvel_rollup
+"""
+
+import argparse
+import json
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import requests
+
+from napps.viniarck.dvel import settings
+from napps.viniarck.dvel.damping import SwitchDamper
+from napps.viniarck.dvel.forecast import Forecaster
+from napps.viniarck.dvel.retention import ROLLUP
+from napps.viniarck.dvel.scoring import (
+    LaneMetrics,
+    MaxThroughput,
+    Policy,
+    make_policy,
+    select_lane,
+)
+
+
+def query(url: str, db: str, q: str) -> List[list]:
+    """Rows of an InfluxDB query, with times in seconds."""
+    response = requests.get(
+        f"{url}/query", params={"db": db, "q": q, "epoch": "s"}, timeout=60
+    )
+    response.raise_for_status()
+    result = response.json()["results"][0]
+    if "error" in result:
+        raise ValueError(result["error"])
+    if not result.get("series"):
+        return []
+    return result["series"][0]["values"]
+
+
+def load(
+    url: str,
+    db: str,
+    probes: List[str],
+    since: str,
+    step: float,
+    rp: Optional[str] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """rtt and loss rate of each probe on a grid of step seconds.
+
+    rtt is NaN on the steps without a successful probe and loss is NaN on
+    the steps without probes.
+
+    :rp: retention policy of the rollups, the default one if None
+
+    """
+    source = f'"{rp}"."{ROLLUP}"' if rp else ROLLUP
+    series = []
+    for probe in probes:
+        where = f"where (\"host\" = '{probe}') and time > now() - {since}"
+        group = f"group by time({int(step * 1e3)}ms) fill(none)"
+        rows = query(
+            url,
+            db,
+            f'select mean("mean"), sum("lost"), sum("sent") from {source} '
+            f"{where} {group}",
+        )
+        series.append(
+            (
+                {t: mean for t, mean, _, _ in rows if mean is not None},
+                {t: lost / sent for t, _, lost, sent in rows if sent},
+            )
+        )
+    times = sorted({t for rtt, loss in series for t in list(rtt) + list(loss)})
+    if not times:
+        raise ValueError(f"no samples of {probes} in the last {since}")
+    grid = np.arange(times[0], times[-1] + step, step)
+    rtt = np.full((len(probes), len(grid)), np.nan)
+    loss = np.full((len(probes), len(grid)), np.nan)
+    for row, (lane_rtt, lane_loss) in enumerate(series):
+        for values, matrix in ((lane_rtt, rtt), (lane_loss, loss)):
+            for t, value in values.items():
+                matrix[row, int(round((t - times[0]) / step))] = value
+    return rtt, loss
+
+
+def ffill(series: np.ndarray) -> np.ndarray:
+    """Repeat the last value of each row over its NaNs."""
+    index = np.where(np.isnan(series), 0, np.arange(series.shape[1]))
+    np.maximum.accumulate(index, axis=1, out=index)
+    return series[np.arange(len(series))[:, None], index]
+
+
+def window_mean(series: np.ndarray, steps: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Mean and count of the values of each row over the last steps."""
+    valid = ~np.isnan(series)
+    total = np.cumsum(np.where(valid, series, 0.0), axis=1)
+    count = np.cumsum(valid, axis=1)
+    total[:, steps:] = total[:, steps:] - total[:, :-steps]
+    count[:, steps:] = count[:, steps:] - count[:, :-steps]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return total / count, count
+
+
+def lane_view(
+    rtt: np.ndarray, loss: np.ndarray, max_rtt: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """rtt and loss as the decision loop sees them.
+
+    Steps whose probes were all lost are down, at max_rtt, and steps
+    without probes keep the previous values.
+    """
+    rtt = np.where(np.isnan(rtt) & (loss >= 1.0), max_rtt, rtt)
+    rtt = ffill(rtt)
+    loss = ffill(loss)
+    return np.nan_to_num(rtt, nan=max_rtt), np.nan_to_num(loss, nan=0.0)
+
+
+def replay(
+    rtt: np.ndarray,
+    loss: np.ndarray,
+    bandwidth: List[float],
+    policy: Policy,
+    estimator: MaxThroughput,
+    step: float,
+    window: int,
+    forecaster: Optional[Forecaster] = None,
+) -> Dict[str, Any]:
+    """Select lanes over the series and score the selection.
+
+    A step is degraded when the selected lane costs more than the best lane
+    of that step by more than the hysteresis. Each run of degraded steps is
+    an event, whose duration is the time it took to move away from it.
+
+    :rtt: rtt of each lane per step, NaN without successful probes
+    :loss: loss rate of each lane per step, NaN without probes
+    :window: steps averaged by the decision loop
+
+    """
+    max_rtt = settings.max_rtt
+    true_rtt, true_loss = lane_view(rtt, loss, max_rtt)
+    mean_rtt, count = window_mean(rtt, window)
+    mean_loss, _ = window_mean(loss, window)
+    seen_rtt, seen_loss = lane_view(
+        np.where(count > 0, mean_rtt, np.nan), mean_loss, max_rtt
+    )
+    damper = SwitchDamper(**settings.damping)
+    lanes = range(len(rtt))
+    active = None
+    switches = 0
+    degraded = 0
+    events: List[float] = []
+    lost_mb = 0.0
+    for t in range(rtt.shape[1]):
+        now = t * step
+        seen = [
+            LaneMetrics(seen_rtt[i, t], seen_loss[i, t], 0.0, bandwidth[i])
+            for i in lanes
+        ]
+        if forecaster:
+            for i in lanes:
+                if seen[i].loss < 1.0:
+                    forecaster.add(str(i), now, seen[i].rtt, seen[i].loss)
+            for key, (f_rtt, f_loss) in forecaster.predict().items():
+                i = int(key)
+                if seen[i].loss < 1.0:
+                    seen[i] = seen[i]._replace(
+                        rtt=max(seen[i].rtt, f_rtt), loss=max(seen[i].loss, f_loss)
+                    )
+        costs = {i: policy.cost(seen[i]) for i in lanes}
+        best = select_lane(costs, active, margin=0.0)
+        if active is None:
+            active = best
+        elif best != active and damper.allow(
+            costs[active], costs[best], down=seen[active].loss >= 1.0, now=now
+        ):
+            damper.switched(now)
+            active = best
+            switches += 1
+
+        truth = [
+            LaneMetrics(true_rtt[i, t], true_loss[i, t], 0.0, bandwidth[i])
+            for i in lanes
+        ]
+        true_costs = [policy.cost(metrics) for metrics in truth]
+        ideal = min(lanes, key=true_costs.__getitem__)
+        if true_costs[active] > true_costs[ideal] * (1 + damper.hysteresis):
+            degraded += 1
+        elif degraded:
+            events.append(degraded * step)
+            degraded = 0
+        lost_mb += (
+            estimator.throughput(truth[ideal]) - estimator.throughput(truth[active])
+        ) * step
+    if degraded:
+        events.append(degraded * step)
+    return {
+        "switches": switches,
+        "degraded_events": len(events),
+        "degraded_seconds": sum(events),
+        "mean_switching_latency": sum(events) / len(events) if events else 0.0,
+        "lost_throughput_mb": lost_mb,
+    }
+
+
+def backtest(
+    rtt: np.ndarray,
+    loss: np.ndarray,
+    bandwidth: List[float],
+    step: float,
+    forecast: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """Replay series reacting to the window averages and with forecasts.
+
+    The saved numbers are the reactive ones minus the predictive ones.
+    """
+    policy = make_policy(settings.policy, **settings.policy_params)
+    estimator = MaxThroughput()
+    if settings.policy == MaxThroughput.name:
+        estimator = MaxThroughput(**settings.policy_params)
+    window = max(1, int(round(settings.window / step)))
+    reactive = replay(rtt, loss, bandwidth, policy, estimator, step, window)
+    params = dict(forecast if forecast is not None else settings.forecast or {})
+    params.setdefault("step", step)
+    predictive = replay(
+        rtt, loss, bandwidth, policy, estimator, step, window, Forecaster(**params)
+    )
+    saved = {
+        key: reactive[key] - predictive[key]
+        for key in (
+            "degraded_seconds",
+            "mean_switching_latency",
+            "lost_throughput_mb",
+        )
+    }
+    return {"reactive": reactive, "predictive": predictive, "saved": saved}
+
+
+def main() -> None:
+    """Backtest a pair of settings.pairs."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pair", help="pair of settings.pairs")
+    parser.add_argument("--since", default="1d", help="InfluxDB duration, e.g. 7d")
+    parser.add_argument("--step", type=float, default=1.0, help="seconds per step")
+    parser.add_argument(
+        "--url", default=f"http://{settings.db_server}:8086", help="InfluxDB URL"
+    )
+    parser.add_argument("--db", default=settings.db_name, help="InfluxDB database")
+    parser.add_argument("--forecast", type=json.loads, help="Forecaster params, JSON")
+    parser.add_argument("--rp", help="retention policy, e.g. dvel_rollup")
+    args = parser.parse_args()
+
+    lanes = settings.pairs[args.pair]["lanes"]
+    probes = [lane["probe"] for lane in lanes]
+    bandwidth = [lane.get("bandwidth") or math.inf for lane in lanes]
+    rtt, loss = load(args.url, args.db, probes, args.since, args.step, args.rp)
+    result = backtest(rtt, loss, bandwidth, args.step, args.forecast)
+    result["lanes"] = probes
+    result["steps"] = rtt.shape[1]
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,620 @@
+"""Benchmarks of the probes and the control pipeline of dvel.
+
+Everything runs on this box against local stand-ins: a fake flow_manager and
+a fake InfluxDB HTTP API served from threads, and the dvel/server.py echo
+server or UDP reflector and dvel/client.py as subprocesses. Results are
+written as JSON and can be checked against the ones of a previous release.
+From the directory that has the napps package:
+
+    python -m napps.viniarck.dvel.bench --output bench.json
+    python -m napps.viniarck.dvel.bench --baseline bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from napps.viniarck.dvel import settings
+from napps.viniarck.dvel.aggregator import StreamAggregator
+from napps.viniarck.dvel.flowpusher import FlowPusher
+from napps.viniarck.dvel.metrics import Histogram
+from napps.viniarck.dvel.model import Network
+from napps.viniarck.dvel.optimizer import LaneOptimizer
+from napps.viniarck.dvel.ratecontrol import ProbeRateController
+from napps.viniarck.dvel.scoring import make_policy
+
+# the probe modules use flat imports, as they're copied to the containers
+DVEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dvel")
+# the echo server always listens on this port
+HTTP_PORT = 8000
+# same layout as udpprobe.PROBE, sequence number and send time in ns
+PROBE = struct.Struct("!IQ")
+
+# metrics checked against a baseline, 1 when higher is better, -1 otherwise
+KEY_METRICS = {
+    "probe_http": {"samples_per_sec": 1, "cpu_per_sample_us": -1},
+    "probe_udp": {"samples_per_sec": 1, "cpu_per_sample_us": -1},
+    "reflector": {"replies_per_sec": 1},
+    "influx_write": {"points_per_sec": 1},
+    "decision_tick": {"latency_ms.p50": -1, "latency_ms.p99": -1},
+    "change_lane": {"latency_ms.p50": -1, "latency_ms.p99": -1},
+}
+
+
+class FakeServer(object):
+
+    """HTTP stand-in served from a thread, on a free local port."""
+
+    def __init__(self) -> None:
+        """Constructor of FakeServer."""
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def handle(self, method: str, path: str, body: bytes) -> Tuple[int, bytes]:
+        """Status and body of the reply to a request."""
+        raise NotImplementedError
+
+    @property
+    def port(self) -> int:
+        """Port the server listens on."""
+        return self._server.server_address[1]
+
+    def start(self) -> "FakeServer":
+        """Serve requests until stop is called."""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def _body(self) -> bytes:
+                if self.headers.get("Transfer-Encoding") != "chunked":
+                    return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().split(b";")[0], 16)
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+                    if not size:
+                        return b"".join(chunks)
+
+            def _serve(self) -> None:
+                body = self._body()
+                with fake._lock:
+                    fake.requests += 1
+                status, reply = fake.handle(self.command, self.path, body)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+
+            do_GET = do_POST = do_DELETE = _serve
+
+            def log_message(self, *args) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving."""
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeInfluxDB(FakeServer):
+
+    """InfluxDB HTTP API stand-in that counts the points of each measurement."""
+
+    def __init__(self) -> None:
+        """Constructor of FakeInfluxDB."""
+        super().__init__()
+        self.points: Counter = Counter()
+
+    def handle(self, method: str, path: str, body: bytes) -> Tuple[int, bytes]:
+        """Count written points and reply empty results to queries."""
+        if path.startswith("/write"):
+            counts = Counter(
+                line.split(b" ", 1)[0].split(b",", 1)[0].decode()
+                for line in body.splitlines()
+                if line
+            )
+            with self._lock:
+                self.points.update(counts)
+            return 204, b""
+        if path.startswith("/query"):
+            return 200, b'{"results":[{"statement_id":0}]}'
+        return 204, b""
+
+
+class FakeFlowManager(FakeServer):
+
+    """flow_manager stand-in that accepts every flow."""
+
+    def __init__(self) -> None:
+        """Constructor of FakeFlowManager."""
+        super().__init__()
+        self.flows = 0
+
+    def handle(self, method: str, path: str, body: bytes) -> Tuple[int, bytes]:
+        """Count the flows pushed to /flows/<dpid>."""
+        if "/flows/" not in path:
+            return 404, b'{"response":"not found"}'
+        flows = json.loads(body or b"{}").get("flows", [])
+        with self._lock:
+            self.flows += len(flows)
+        return 200, b'{"response":"FlowMod Messages Sent"}'
+
+
+class IngestCounter(object):
+
+    """dvel ingest endpoint stand-in, it counts samples and sets probe rates.
+
+    The first datagram of each probe is replied with a ``rate`` line, as the
+    NApp does, so the probes run at rate probes per second.
+    """
+
+    def __init__(self, rate: float) -> None:
+        """Constructor of IngestCounter."""
+        self.rate = rate
+        self.samples = 0
+        self.lost = 0
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(("127.0.0.1", 0))
+        self._sock.settimeout(0.2)
+        self._running = False
+        self._peers: set = set()
+
+    @property
+    def port(self) -> int:
+        """Port the endpoint listens on."""
+        return self._sock.getsockname()[1]
+
+    def start(self) -> "IngestCounter":
+        """Receive samples until stop is called."""
+        self._running = True
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def _run(self) -> None:
+        """Count the samples of each datagram."""
+        while self._running:
+            try:
+                data, addr = self._sock.recvfrom(65535)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            for line in data.decode(errors="ignore").splitlines():
+                host, _, value = line.partition(" ")
+                self.samples += 1
+                self.lost += value == "-"
+                if (addr, host) not in self._peers:
+                    self._peers.add((addr, host))
+                    self._sock.sendto(f"rate {host} {self.rate}\n".encode(), addr)
+
+    def stop(self) -> None:
+        """Stop receiving."""
+        self._running = False
+        self._sock.close()
+
+
+def free_port() -> int:
+    """A free local UDP port."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def spawn(script: str, env: Dict[str, str]) -> subprocess.Popen:
+    """Run a probe script of the dvel directory."""
+    return subprocess.Popen(
+        [sys.executable, script],
+        cwd=DVEL_DIR,
+        env=dict(os.environ, **env),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def stop(process: subprocess.Popen, timeout: float = 5.0) -> float:
+    """Interrupt a subprocess, it returns the CPU seconds it used."""
+    process.send_signal(signal.SIGINT)
+    deadline = time.monotonic() + timeout
+    while True:
+        pid, status, usage = os.wait4(process.pid, os.WNOHANG)
+        if pid:
+            break
+        if time.monotonic() > deadline:
+            process.kill()
+            pid, status, usage = os.wait4(process.pid, 0)
+            break
+        time.sleep(0.05)
+    process.returncode = status
+    return usage.ru_utime + usage.ru_stime
+
+
+def wait_until(ready: Callable[[], bool], process: subprocess.Popen, timeout: float):
+    """Wait for a subprocess to be ready."""
+    deadline = time.monotonic() + timeout
+    while not ready():
+        if process.poll() is not None:
+            raise RuntimeError(f"{process.args[-1]} exited with {process.returncode}")
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{process.args[-1]} wasn't ready in {timeout}s")
+        time.sleep(0.1)
+
+
+def http_ready(port: int) -> Callable[[], bool]:
+    """Whether a local TCP port accepts connections."""
+
+    def ready() -> bool:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return True
+        except OSError:
+            return False
+
+    return ready
+
+
+def start_server(mode: str, udp_port: int) -> subprocess.Popen:
+    """Start dvel/server.py and wait for it."""
+    server = spawn(
+        "server.py",
+        {"PROBE_MODE": mode, "UDP_PORT": str(udp_port), "LOG_REQUESTS": "0"},
+    )
+    if mode == "udp":
+        # the reflector doesn't reply to anything but probes
+        time.sleep(1.0)
+        if server.poll() is not None:
+            raise RuntimeError(f"server.py exited with {server.returncode}")
+    else:
+        wait_until(http_ready(HTTP_PORT), server, 10.0)
+    return server
+
+
+def bench_probe(
+    mode: str, duration: float = 10.0, rate: float = 5000.0, warmup: float = 2.0
+) -> Dict[str, Any]:
+    """Samples per second and CPU per sample of dvel/client.py.
+
+    :mode: probe mode, http or udp
+    :rate: probes per second requested to the client
+
+    """
+    udp_port = free_port()
+    influx = FakeInfluxDB().start()
+    ingest = IngestCounter(rate).start()
+    server = start_server(mode, udp_port)
+    client = spawn(
+        "client.py",
+        {
+            "HTTP_SERVER": "127.0.0.1",
+            "HTTP_PORT": str(HTTP_PORT),
+            "DB_SERVER": "127.0.0.1",
+            "DB_PORT": str(influx.port),
+            "DB_NAME": "bench",
+            "INGEST_SERVER": "127.0.0.1",
+            "INGEST_PORT": str(ingest.port),
+            "HOSTNAME": "bench",
+            "PROBE_MODE": mode,
+            "UDP_PORT": str(udp_port),
+        },
+    )
+    try:
+        time.sleep(warmup)
+        samples, points = ingest.samples, sum(influx.points.values())
+        time.sleep(duration)
+        samples = ingest.samples - samples
+        points = sum(influx.points.values()) - points
+    finally:
+        cpu = stop(client)
+        stop(server)
+        ingest.stop()
+        influx.stop()
+    if client.returncode and not ingest.samples:
+        raise RuntimeError(f"client.py exited with {client.returncode}")
+    return {
+        "requested_rate": rate,
+        "samples_per_sec": samples / duration,
+        "points_per_sec": points / duration,
+        "cpu_per_sample_us": cpu / ingest.samples * 1e6 if ingest.samples else None,
+        "cpu_percent": cpu / (duration + warmup) * 100,
+        "lost": ingest.lost,
+    }
+
+
+def bench_reflector(duration: float = 10.0, window: int = 64) -> Dict[str, Any]:
+    """Replies per second of the dvel/server.py UDP reflector.
+
+    window probes are kept in flight and every reply sends a new one.
+    """
+    udp_port = free_port()
+    server = start_server("udp", udp_port)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.connect(("127.0.0.1", udp_port))
+    sock.settimeout(0.2)
+    replies = timeouts = seq = 0
+    try:
+        start = time.perf_counter()
+        deadline = start + duration
+        for _ in range(window):
+            sock.send(PROBE.pack(seq, time.perf_counter_ns()))
+            seq += 1
+        while time.perf_counter() < deadline:
+            try:
+                sock.recv(64)
+            except socket.timeout:
+                timeouts += 1
+                for _ in range(window):
+                    sock.send(PROBE.pack(seq % 2 ** 32, time.perf_counter_ns()))
+                    seq += 1
+                continue
+            replies += 1
+            sock.send(PROBE.pack(seq % 2 ** 32, time.perf_counter_ns()))
+            seq += 1
+        elapsed = time.perf_counter() - start
+    finally:
+        sock.close()
+        cpu = stop(server)
+    return {
+        "replies_per_sec": replies / elapsed,
+        "timeouts": timeouts,
+        "cpu_per_reply_us": cpu / replies * 1e6 if replies else None,
+    }
+
+
+def bench_influx_write(
+    points: int = 200000, batch_size: int = 1000
+) -> Dict[str, Any]:
+    """Points per second written by the probes BufferedWriter."""
+    import uvloop
+    from aioinflux import InfluxDBClient
+
+    sys.path.insert(0, DVEL_DIR)
+    from writer import BufferedWriter
+
+    influx = FakeInfluxDB().start()
+
+    async def run() -> Tuple[float, Any]:
+        client = InfluxDBClient(host="127.0.0.1", port=influx.port, db="bench")
+        writer = BufferedWriter(client, batch_size, 0.1, points, "block")
+        flusher = asyncio.ensure_future(writer.run())
+        # let the flusher start, the writes below only yield when it's full
+        await asyncio.sleep(0)
+        timestamp = time.time_ns()
+        start = time.perf_counter()
+        for i in range(points):
+            await writer.write("rtt", {"host": "bench"}, {"value": 1.0}, timestamp + i)
+        await writer.close()
+        elapsed = time.perf_counter() - start
+        await flusher
+        await client.close()
+        return elapsed, writer
+
+    loop = uvloop.new_event_loop()
+    try:
+        elapsed, writer = loop.run_until_complete(run())
+    finally:
+        loop.close()
+        influx.stop()
+    return {
+        "points": points,
+        "batch_size": batch_size,
+        "points_per_sec": writer.written / elapsed,
+        "received": influx.points["rtt"],
+        "dropped": writer.dropped,
+    }
+
+
+def _dpid(n: int) -> str:
+    """A dpid made of a number."""
+    return ":".join(f"{b:02x}" for b in n.to_bytes(8, "big"))
+
+
+def bench_decision_tick(
+    pairs: int = 100, lanes: int = 3, ticks: int = 2000, samples: int = 5
+) -> Dict[str, Any]:
+    """Latency of a decision tick, reading the samples and deciding each pair.
+
+    :samples: samples of each lane per tick
+
+    """
+    network = Network(settings.vlan_range, settings.probe_port_start)
+    forecaster = None
+    if settings.forecast is not None:
+        from napps.viniarck.dvel.forecast import Forecaster
+
+        forecaster = Forecaster(**settings.forecast)
+    optimizer = LaneOptimizer(
+        network,
+        make_policy(settings.policy, **settings.policy_params),
+        settings.max_rtt,
+        settings.damping,
+        ProbeRateController(
+            settings.probe_budget, settings.probe_rate_min, settings.probe_rate_max
+        ),
+        forecaster,
+    )
+    for p in range(pairs):
+        edges = [
+            {"dpid": _dpid(2 * p + e + 1), "host_port": 1, "uplink_port": 2}
+            for e in range(2)
+        ]
+        lane_attrs = [{"probe": f"p{p}l{n}", "bandwidth": 1000.0} for n in range(lanes)]
+        optimizer.add_pair(network.add_pair(f"p{p}", edges, lane_attrs))
+    aggregator = StreamAggregator(settings.window, settings.ewma_alpha)
+    bases = {probe: 10.0 + n % 5 for n, probe in enumerate(network.lanes_by_probe)}
+    rng = random.Random(0)
+    latency = Histogram()
+    switches = 0
+    now = 0.0
+    for _ in range(ticks):
+        now += settings.frequency
+        for probe, base in bases.items():
+            for i in range(samples):
+                rtt = None if rng.random() < 0.01 else base * rng.uniform(0.8, 1.5)
+                aggregator.add(probe, rtt, now - settings.frequency * i / samples)
+        start = time.perf_counter()
+        for pair in optimizer.read_stream(aggregator, settings.rtt_stat, now):
+            optimizer.forecast()
+            path = optimizer.decide(pair, now)
+            if path is not None:
+                pair.active = path
+                switches += 1
+        latency.add((time.perf_counter() - start) * 1e3)
+    return {
+        "pairs": pairs,
+        "lanes": pairs * lanes,
+        "samples_per_tick": pairs * lanes * samples,
+        "switches": switches,
+        "latency_ms": latency.as_dict(),
+    }
+
+
+def bench_change_lane(changes: int = 200, hops: int = 4) -> Dict[str, Any]:
+    """Latency of a flow_manager lane change, as done by the NApp.
+
+    The pair has two lanes of hops backbone switches each, the host EVC flows
+    of the new lane are pushed to every dpid in parallel.
+    """
+    flow_manager = FakeFlowManager().start()
+    network = Network(settings.vlan_range, settings.probe_port_start)
+    edges = [
+        {"dpid": _dpid(n), "host_port": 1, "uplink_port": 2} for n in (1, 2)
+    ]
+    lanes = [
+        {
+            "probe": f"l{n}",
+            "hops": [[_dpid(16 * (n + 1) + h), 1, 2] for h in range(hops)],
+        }
+        for n in range(2)
+    ]
+    pair = network.add_pair("bench", edges, lanes)
+    network.precompute()
+    pusher = FlowPusher(f"http://127.0.0.1:{flow_manager.port}")
+    latency = Histogram()
+    try:
+        start = time.perf_counter()
+        for i in range(changes):
+            lane = pair.lanes[1 + (i + 1) % 2]
+            change_start = time.perf_counter()
+            responses = pusher.push_many(network.host_flows(lane, pair.host_prio))
+            for response in responses.values():
+                if response.status_code != 200:
+                    raise RuntimeError(f"flow_manager replied {response.text}")
+            pair.active = lane.index
+            latency.add((time.perf_counter() - change_start) * 1e3)
+        elapsed = time.perf_counter() - start
+    finally:
+        pusher.shutdown()
+        flow_manager.stop()
+    return {
+        "dpids": len(responses),
+        "flows": flow_manager.flows / changes,
+        "changes_per_sec": changes / elapsed,
+        "latency_ms": latency.as_dict(),
+    }
+
+
+BENCHMARKS: Dict[str, Callable[[argparse.Namespace], Dict[str, Any]]] = {
+    "probe_http": lambda args: bench_probe("http", args.duration, args.rate),
+    "probe_udp": lambda args: bench_probe("udp", args.duration, args.rate),
+    "reflector": lambda args: bench_reflector(args.duration),
+    "influx_write": lambda args: bench_influx_write(),
+    "decision_tick": lambda args: bench_decision_tick(),
+    "change_lane": lambda args: bench_change_lane(),
+}
+
+
+def metric(results: Dict[str, Any], key: str) -> Optional[float]:
+    """A metric by its dotted key, None if it's missing."""
+    value: Any = results
+    for part in key.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value if isinstance(value, (int, float)) else None
+
+
+def compare(
+    results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float
+) -> List[str]:
+    """Key metrics worse than the baseline by more than tolerance."""
+    regressions = []
+    for name, keys in KEY_METRICS.items():
+        for key, direction in keys.items():
+            new = metric(results.get(name, {}), key)
+            old = metric(baseline.get(name, {}), key)
+            if new is None or not old:
+                continue
+            change = (new - old) / old * direction
+            if change < -tolerance:
+                regressions.append(f"{name} {key}: {old:.6g} -> {new:.6g}")
+    return regressions
+
+
+def main() -> None:
+    """Run the benchmarks and write their results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="bench.json", help="results file")
+    parser.add_argument("--baseline", help="results of a previous run")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="e.g. 0.2")
+    parser.add_argument(
+        "--only", default=",".join(BENCHMARKS), help="comma separated benchmarks"
+    )
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--rate", type=float, default=5000.0, help="probes per sec")
+    args = parser.parse_args()
+
+    results: Dict[str, Any] = {}
+    for name in args.only.split(","):
+        print(f"running {name}", file=sys.stderr)
+        try:
+            results[name] = BENCHMARKS[name](args)
+        except Exception as e:
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+    report: Dict[str, Any] = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    regressions: List[str] = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], args.tolerance)
+        report["regressions"] = regressions
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
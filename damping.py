@@ -0,0 +1,103 @@
+"""Flap damping of dvel lane switches."""
+
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+
+class SwitchDamper(object):
+
+    """Decide whether a lane switch proposed by the policy should happen.
+
+    A switch is suppressed when the new lane isn't better by more than the
+    hysteresis, when the current lane hasn't been used for min_dwell
+    seconds, during the hold-down that follows repeated flips (it doubles on
+    every flip within flap_window, up to holddown_max) or when max_switches
+    have already happened in the last budget_period seconds. A switch away
+    from a lane that is down is never suppressed.
+    """
+
+    def __init__(
+        self,
+        hysteresis: float = 0.2,
+        min_dwell: float = 5.0,
+        holddown: float = 2.0,
+        holddown_max: float = 60.0,
+        flap_window: float = 30.0,
+        max_switches: int = 10,
+        budget_period: float = 60.0,
+    ) -> None:
+        """Constructor of SwitchDamper."""
+        self.hysteresis = hysteresis
+        self.min_dwell = min_dwell
+        self.holddown = holddown
+        self.holddown_max = holddown_max
+        self.flap_window = flap_window
+        self.max_switches = max_switches
+        self.budget_period = budget_period
+        self.penalty = 0.0
+        self.hold_until = 0.0
+        self.last_switch: Optional[float] = None
+        self._history: Deque[float] = deque()
+        self.counters: Dict[str, int] = {
+            "switches": 0,
+            "forced": 0,
+            "suppressed_hysteresis": 0,
+            "suppressed_dwell": 0,
+            "suppressed_holddown": 0,
+            "suppressed_budget": 0,
+        }
+
+    def allow(
+        self,
+        cur_cost: float,
+        new_cost: float,
+        down: bool = False,
+        now: Optional[float] = None,
+    ) -> bool:
+        """Whether switching from the current lane to a new one is allowed.
+
+        :cur_cost: cost of the current lane
+        :new_cost: cost of the new lane
+        :down: whether the current lane is down
+
+        """
+        now = time.monotonic() if now is None else now
+        if down:
+            self.counters["forced"] += 1
+            return True
+        reason = None
+        if not new_cost * (1 + self.hysteresis) < cur_cost:
+            reason = "hysteresis"
+        elif self.last_switch is not None and now - self.last_switch < self.min_dwell:
+            reason = "dwell"
+        elif now < self.hold_until:
+            reason = "holddown"
+        else:
+            while self._history and self._history[0] <= now - self.budget_period:
+                self._history.popleft()
+            if len(self._history) >= self.max_switches:
+                reason = "budget"
+        if reason:
+            self.counters[f"suppressed_{reason}"] += 1
+            return False
+        return True
+
+    def switched(self, now: Optional[float] = None) -> None:
+        """Record a lane switch."""
+        now = time.monotonic() if now is None else now
+        if self.last_switch is not None and now - self.last_switch < self.flap_window:
+            self.penalty = min(max(self.penalty * 2, self.holddown), self.holddown_max)
+        else:
+            self.penalty = 0.0
+        self.hold_until = now + self.penalty
+        self.last_switch = now
+        self._history.append(now)
+        self.counters["switches"] += 1
+
+    def status(self) -> Dict[str, float]:
+        """Counters and current state of the damper."""
+        status = dict(self.counters)
+        status["holddown"] = self.penalty
+        status["holddown_remaining"] = max(0.0, self.hold_until - time.monotonic())
+        return status
@@ -6,16 +6,87 @@ import aiohttp
 import asyncio
 import async_timeout
 import logging
+import math
+import multiprocessing
 import os
+import time
 import uvloop
 from aioinflux import InfluxDBClient
 from collections import namedtuple
+from typing import Any, Dict, List, Optional
+from ticker import Ticker
+from udpprobe import UDPProber
+from writer import BufferedWriter, IngestSender
 
 logging.basicConfig(level=logging.DEBUG)
 log = logging.getLogger(__name__)
 
+# header of the echo responses with the server processing time, in ms
+SERVER_TIME_HEADER = "X-Server-Time"
+
 HTTPServerInfo = namedtuple("HTTPServerInfo", "addr port endpoint")
 DBServerInfo = namedtuple("DBServerInfo", "addr port name")
+WriterInfo = namedtuple("WriterInfo", "batch_size flush_interval max_points policy")
+WriterInfo.__new__.__defaults__ = (1000, 1.0, 100000, "drop_oldest")
+IngestInfo = namedtuple("IngestInfo", "addr port")
+# probed lane, its samples are tagged with name, bind_addr is the local address
+# of the interface attached to the lane
+LaneInfo = namedtuple("LaneInfo", "name addr bind_addr")
+LaneInfo.__new__.__defaults__ = (None,)
+
+
+class Rollup(object):
+
+    """Summarize the probes of an interval in a single point.
+
+    A rollup has the probes sent and lost, the loss rate and the count, min,
+    mean, max, p99 and standard deviation of the rtts of the interval, so
+    InfluxDB stores a point per lane per interval instead of one per probe.
+    """
+
+    def __init__(self, interval: float = 1.0) -> None:
+        """Constructor of Rollup."""
+        self.interval = interval
+        self.rtts: List[float] = []
+        self.lost = 0
+        self.start = time.monotonic()
+
+    def add(self, rtt: Optional[float]) -> None:
+        """Add the rtt of a probe, None if it was lost."""
+        if rtt is None:
+            self.lost += 1
+        else:
+            self.rtts.append(rtt)
+
+    def due(self) -> bool:
+        """Whether the interval is over."""
+        return time.monotonic() - self.start >= self.interval
+
+    def pop(self) -> Dict[str, Any]:
+        """Fields of the rollup point of the interval, and start a new one.
+
+        The rtt fields are left out when every probe was lost.
+        """
+        count = len(self.rtts)
+        sent = count + self.lost
+        fields: Dict[str, Any] = {
+            "sent": sent,
+            "lost": self.lost,
+            "loss": self.lost / sent if sent else 0.0,
+            "count": count,
+        }
+        if count:
+            rtts = sorted(self.rtts)
+            mean = sum(rtts) / count
+            fields["min"] = rtts[0]
+            fields["mean"] = mean
+            fields["max"] = rtts[-1]
+            fields["p99"] = rtts[max(0, math.ceil(0.99 * count) - 1)]
+            fields["stddev"] = math.sqrt(sum((x - mean) ** 2 for x in rtts) / count)
+        self.rtts = []
+        self.lost = 0
+        self.start = time.monotonic()
+        return fields
 
 
 class Client(object):
@@ -29,61 +100,319 @@ class Client(object):
         dbs_info: DBServerInfo,
         frequency: float = 0.001,
         timeout: int = 1,
+        measure_connect: bool = False,
+        conn_limit: int = 1,
+        dns_ttl: int = 300,
+        writer_info: WriterInfo = WriterInfo(),
+        ingest_info: Optional[IngestInfo] = None,
+        probe_mode: str = "http",
+        udp_port: int = 8001,
+        bind_addr: Optional[str] = None,
+        rollup_interval: float = 1.0,
+        raw_points: bool = False,
     ) -> None:
-        """Constructor of Client."""
+        """Constructor of Client.
+
+        :measure_connect: if True, every probe opens a new connection, so the
+            rtt includes the TCP handshake. Otherwise, a single keep-alive
+            connection is reused and only the request itself is measured.
+        :conn_limit: max number of simultaneous connections to the server
+        :dns_ttl: seconds to cache DNS resolutions of the server address
+        :writer_info: batching and drop policy of the InfluxDB writer
+        :ingest_info: dvel NApp ingest endpoint, samples are also pushed
+            there if it's set
+        :probe_mode: "http" to GET the echo endpoint or "udp" to send
+            sequence numbered probes to a UDP reflector on udp_port
+        :bind_addr: local address the probes are sent from
+        :rollup_interval: seconds covered by each rollup point, which has
+            the sent and lost probes, the loss rate and the rtt min, mean,
+            max, p99 and standard deviation of the interval
+        :raw_points: if True, successful probes also write rtt points
+
+        """
         self.name = name
         self.h_info = https_info
         self.d_info = dbs_info
-        self.influx_client = InfluxDBClient(
-            host=dbs_info.addr, db=dbs_info.name, port=dbs_info.port
-        )
         self.timeout = timeout
         self.frequency = frequency
+        self.measure_connect = measure_connect
+        self.conn_limit = conn_limit
+        self.dns_ttl = dns_ttl
+        self.w_info = writer_info
+        self.i_info = ingest_info
+        self.probe_mode = probe_mode
+        self.udp_port = udp_port
+        self.bind_addr = bind_addr
+        self.rollup_interval = rollup_interval
+        self.raw_points = raw_points
+        self._warm = False
+
+    def make_connector(self) -> aiohttp.TCPConnector:
+        """Make the TCP connector used during the whole life of the probe."""
+        local_addr = (self.bind_addr, 0) if self.bind_addr else None
+        if self.measure_connect:
+            return aiohttp.TCPConnector(
+                limit=self.conn_limit,
+                ttl_dns_cache=self.dns_ttl,
+                force_close=True,
+                local_addr=local_addr,
+            )
+        return aiohttp.TCPConnector(
+            limit=self.conn_limit,
+            ttl_dns_cache=self.dns_ttl,
+            keepalive_timeout=max(15.0, self.frequency * 10),
+            local_addr=local_addr,
+        )
+
+    async def warm_up(self, session, url) -> None:
+        """Open the keep-alive connection before measuring.
+
+        After a timeout or a connection error the pooled connection is
+        dropped, so the next probe would pay a new handshake.
+        """
+        if self._warm or self.measure_connect:
+            return
+        await self.make_request(session, url)
+        self._warm = True
 
-    async def make_request(self, session, url):
-        """ Make request. """
+    async def make_request(self, session, url) -> float:
+        """ Make request, it returns the server processing time in ms. """
 
         async with async_timeout.timeout(self.timeout):
             async with session.get(url) as response:
-                return await response.text()
+                await response.read()
+                return float(response.headers.get(SERVER_TIME_HEADER, 0.0))
 
     async def run(self):
         """Coroutine run."""
-        client = InfluxDBClient(host=self.d_info.addr, db=self.d_info.name)
+        client = InfluxDBClient(
+            host=self.d_info.addr, port=int(self.d_info.port), db=self.d_info.name
+        )
         try:
             await client.create_database(host=self.d_info.addr, db=self.d_info.name)
         except aiohttp.client_exceptions.ClientConnectorError as e:
             log.error(e)
             return
-        cnt_pkt_loss = 0
-        cur_rtt = 0.0
+        writer = BufferedWriter(client, *self.w_info)
+        asyncio.ensure_future(writer.run())
+        sender = None
+        if self.i_info:
+            sender = await IngestSender.connect(self.i_info.addr, self.i_info.port)
+            sender.on_rate = lambda host, rate: self.set_rate(rate)
+        await self.probe(writer, sender)
+
+    def set_rate(self, rate: float) -> None:
+        """Set the probes per second, as adapted by the NApp."""
+        if rate > 0:
+            self.frequency = 1.0 / rate
+
+    async def probe(self, writer: BufferedWriter, sender) -> None:
+        """Probe the lane, writing the samples with a writer and a sender."""
+        if self.probe_mode == "udp":
+            await self.run_udp(writer, sender)
+        else:
+            await self.run_http(writer, sender)
+
+    async def run_http(self, writer: BufferedWriter, sender) -> None:
+        """Probe the HTTP echo endpoint.
+
+        Timeouts and connection errors, such as the server dropping the
+        connection, count as lost probes. Each rtt point also carries the
+        scheduling lag of its probe in ms, and rollups the max since the
+        previous rollup.
+        """
+        ticker = Ticker()
+        rollup = Rollup(self.rollup_interval)
+        tags = {"host": self.name}
         url = f"http://{self.h_info.addr}:{self.h_info.port}/{self.h_info.endpoint}"
+        async with aiohttp.ClientSession(connector=self.make_connector()) as session:
+            while True:
+                lag = await ticker.tick(self.frequency)
+                cur_rtt = None
+                try:
+                    await self.warm_up(session, url)
+                    request_start = time.perf_counter_ns()
+                    server_time = await self.make_request(session, url)
+                    elapsed = (time.perf_counter_ns() - request_start) / 1e6
+                    cur_rtt = elapsed - server_time
+                except asyncio.TimeoutError as e:
+                    self._warm = False
+                except (aiohttp.client_exceptions.ClientError, OSError) as e:
+                    log.error(f"HTTP server {self.h_info.addr} error: {e!r}")
+                    self._warm = False
+                if sender:
+                    sender.send(self.name, cur_rtt)
+                timestamp = time.time_ns()
+                if self.raw_points and cur_rtt is not None:
+                    await writer.write(
+                        "rtt",
+                        tags,
+                        {"value": cur_rtt, "sched_lag": lag / 1e6},
+                        timestamp,
+                    )
+                rollup.add(cur_rtt)
+                if rollup.due():
+                    fields = rollup.pop()
+                    fields["sched_lag"] = ticker.pop_max_lag() / 1e6
+                    await writer.write("rollup", tags, fields, timestamp)
+
+    async def run_udp(self, writer: BufferedWriter, sender) -> None:
+        """Probe a UDP reflector.
+
+        Rollups carry the max scheduling lag in ms since the previous rollup,
+        and they're written along with a probe_stats point.
+        """
+        ticker = Ticker()
+        rollup = Rollup(self.rollup_interval)
+        samples = []
+        transport, prober = await UDPProber.connect(
+            self.h_info.addr,
+            self.udp_port,
+            on_sample=samples.append,
+            timeout=self.timeout,
+            local_addr=(self.bind_addr, 0) if self.bind_addr else None,
+        )
+        tags = {"host": self.name}
+        try:
+            while True:
+                await ticker.tick(self.frequency)
+                prober.send()
+                batch = samples[:]
+                samples.clear()
+                timestamp = time.time_ns()
+                for i, cur_rtt in enumerate(batch):
+                    if sender:
+                        sender.send(self.name, cur_rtt)
+                    rollup.add(cur_rtt)
+                    if self.raw_points and cur_rtt is not None:
+                        await writer.write(
+                            "rtt", tags, {"value": cur_rtt}, timestamp + i
+                        )
+                if not rollup.due():
+                    continue
+                fields = rollup.pop()
+                fields["sched_lag"] = ticker.pop_max_lag() / 1e6
+                await writer.write("rollup", tags, fields, timestamp)
+                await writer.write(
+                    "probe_stats",
+                    tags,
+                    {
+                        "jitter": prober.jitter,
+                        "reordered": prober.counters["reordered"],
+                        "late": prober.counters["late"],
+                        "skipped": ticker.skipped,
+                    },
+                    timestamp,
+                )
+        finally:
+            transport.close()
+
+
+class MultiClient(object):
+
+    """Probe many lanes from a single event loop.
+
+    Each lane runs as a task of its own Client, and they all share a single
+    InfluxDB writer and ingest sender, so a process can probe hundreds of
+    lanes. A lane whose task fails is restarted after restart_delay seconds
+    without disturbing the others.
+    """
+
+    def __init__(
+        self,
+        lanes: List[LaneInfo],
+        https_info: HTTPServerInfo,
+        dbs_info: DBServerInfo,
+        writer_info: WriterInfo = WriterInfo(),
+        ingest_info: Optional[IngestInfo] = None,
+        restart_delay: float = 1.0,
+        **kwargs,
+    ) -> None:
+        """Constructor of MultiClient.
+
+        :lanes: lanes to probe, their addr replaces the one of https_info
+        :restart_delay: seconds to wait before restarting a failed lane
+        :kwargs: Client parameters shared by every lane
+
+        """
+        self.d_info = dbs_info
+        self.restart_delay = restart_delay
+        self.w_info = writer_info
+        self.i_info = ingest_info
+        self.clients = [
+            Client(
+                lane.name,
+                https_info._replace(addr=lane.addr),
+                dbs_info,
+                bind_addr=lane.bind_addr,
+                **kwargs,
+            )
+            for lane in lanes
+        ]
+        self._by_name = {c.name: c for c in self.clients}
+
+    def set_rate(self, host: str, rate: float) -> None:
+        """Set the probes per second of a lane."""
+        client = self._by_name.get(host)
+        if client is not None:
+            client.set_rate(rate)
+
+    async def run(self):
+        """Coroutine run."""
+        client = InfluxDBClient(
+            host=self.d_info.addr, port=int(self.d_info.port), db=self.d_info.name
+        )
+        try:
+            await client.create_database(host=self.d_info.addr, db=self.d_info.name)
+        except aiohttp.client_exceptions.ClientConnectorError as e:
+            log.error(e)
+            return
+        writer = BufferedWriter(client, *self.w_info)
+        asyncio.ensure_future(writer.run())
+        sender = None
+        if self.i_info:
+            sender = await IngestSender.connect(self.i_info.addr, self.i_info.port)
+            sender.on_rate = self.set_rate
+        await self.probe(writer, sender)
+
+    async def probe(self, writer: BufferedWriter, sender) -> None:
+        """Probe every lane, each one on its own supervised task."""
+        await asyncio.gather(*(self.supervise(c, writer, sender) for c in self.clients))
+
+    async def supervise(self, client: Client, writer: BufferedWriter, sender) -> None:
+        """Probe a lane, restarting it whenever its probing fails."""
         while True:
             try:
-                async with aiohttp.ClientSession() as session:
-                    request_start = loop.time()
-                    await self.make_request(session, url)
-                    cur_rtt = ((loop.time() - request_start) * 1e3) / 2.0
-                    print(cur_rtt)
-            except asyncio.TimeoutError as e:
-                cur_rtt = 0.0
-                cnt_pkt_loss += 1
-            except aiohttp.client_exceptions.ClientConnectorError as e:
-                log.error(f"HTTP server {self.h_info.addr} connection error")
-            finally:
-                rtt_point = dict(
-                    measurement="rtt",
-                    tags={"host": CONTAINER},
-                    fields={"value": cur_rtt},
-                )
-                await client.write(rtt_point)
-                pkt_loss_point = dict(
-                    measurement="cnt_pkt_loss",
-                    tags={"host": CONTAINER},
-                    fields={"value": cnt_pkt_loss},
-                )
-                await client.write(pkt_loss_point)
-                await asyncio.sleep(self.frequency)
+                await client.probe(writer, sender)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception(f"lane {client.name} failed, restarting it")
+            client._warm = False
+            await asyncio.sleep(self.restart_delay)
+
+
+def parse_lanes(spec: str) -> List[LaneInfo]:
+    """Parse lanes as ``name=addr[@bind_addr]``, separated by commas."""
+    lanes = []
+    for item in spec.split(","):
+        name, _, addr = item.strip().partition("=")
+        addr, _, bind_addr = addr.partition("@")
+        lanes.append(LaneInfo(name, addr, bind_addr or None))
+    return lanes
+
+
+def run_lanes(lanes: List[LaneInfo], *args, **kwargs) -> None:
+    """Probe lanes with a MultiClient on a new uvloop."""
+    loop = uvloop.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(MultiClient(lanes, *args, **kwargs).run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.close()
 
 
 if __name__ == "__main__":
@@ -95,13 +424,74 @@ if __name__ == "__main__":
     DB_PORT = os.environ.get("DB_PORT", 8086)
     DB_NAME = os.environ.get("DB_NAME", "dvel")
     CONTAINER = os.environ.get("HOSTNAME", "cx")
+    MEASURE_CONNECT = os.environ.get("MEASURE_CONNECT", "0") == "1"
+    BATCH_SIZE = int(os.environ.get("BATCH_SIZE", 1000))
+    FLUSH_INTERVAL = float(os.environ.get("FLUSH_INTERVAL", 1.0))
+    MAX_POINTS = int(os.environ.get("MAX_POINTS", 100000))
+    DROP_POLICY = os.environ.get("DROP_POLICY", "drop_oldest")
+    INGEST_SERVER = os.environ.get("INGEST_SERVER")
+    INGEST_PORT = os.environ.get("INGEST_PORT", 8099)
+    PROBE_MODE = os.environ.get("PROBE_MODE", "http")
+    UDP_PORT = int(os.environ.get("UDP_PORT", 8001))
+    LANES = os.environ.get("LANES")
+    PROBE_WORKERS = int(os.environ.get("PROBE_WORKERS", 1))
+    ROLLUP_INTERVAL = float(os.environ.get("ROLLUP_INTERVAL", 1.0))
+    RAW_POINTS = os.environ.get("RAW_POINTS", "0") == "1"
+
+    if LANES:
+        lanes = parse_lanes(LANES)
+        ingest_info = None
+        if INGEST_SERVER:
+            ingest_info = IngestInfo(INGEST_SERVER, INGEST_PORT)
+        args = (
+            HTTPServerInfo(HTTP_SERVER, HTTP_PORT, ENDPOINT),
+            DBServerInfo(DB_SERVER, DB_PORT, DB_NAME),
+        )
+        kwargs = dict(
+            measure_connect=MEASURE_CONNECT,
+            writer_info=WriterInfo(BATCH_SIZE, FLUSH_INTERVAL, MAX_POINTS, DROP_POLICY),
+            ingest_info=ingest_info,
+            probe_mode=PROBE_MODE,
+            udp_port=UDP_PORT,
+            rollup_interval=ROLLUP_INTERVAL,
+            raw_points=RAW_POINTS,
+        )
+        # lanes are spread over the worker processes, the first share runs here
+        workers = max(1, min(PROBE_WORKERS, len(lanes)))
+        processes = [
+            multiprocessing.Process(
+                target=run_lanes, args=(lanes[i::workers],) + args, kwargs=kwargs
+            )
+            for i in range(1, workers)
+        ]
+        for process in processes:
+            process.start()
+        run_lanes(lanes[0::workers], *args, **kwargs)
+        for process in processes:
+            process.join()
+        exit(0)
 
     try:
         loop = uvloop.new_event_loop()
         asyncio.set_event_loop(loop)
         http_server_info = HTTPServerInfo(HTTP_SERVER, HTTP_PORT, ENDPOINT)
         db_server_info = DBServerInfo(DB_SERVER, DB_PORT, DB_NAME)
-        c = Client(CONTAINER, http_server_info, db_server_info)
+        writer_info = WriterInfo(BATCH_SIZE, FLUSH_INTERVAL, MAX_POINTS, DROP_POLICY)
+        ingest_info = None
+        if INGEST_SERVER:
+            ingest_info = IngestInfo(INGEST_SERVER, INGEST_PORT)
+        c = Client(
+            CONTAINER,
+            http_server_info,
+            db_server_info,
+            measure_connect=MEASURE_CONNECT,
+            writer_info=writer_info,
+            ingest_info=ingest_info,
+            probe_mode=PROBE_MODE,
+            udp_port=UDP_PORT,
+            rollup_interval=ROLLUP_INTERVAL,
+            raw_points=RAW_POINTS,
+        )
         loop.run_until_complete(c.run())
     except KeyboardInterrupt:
         loop.close()
@@ -1,23 +1,66 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import asyncio
+import multiprocessing
+import os
 import time
+import uvloop
 from sanic import Sanic
-from sanic.response import json
+from sanic.response import json, raw
+from typing import Any, Dict
+from udpprobe import UDPReflector
 
 app = Sanic()
 
+# the echo body is always the same, so it's encoded once
+ECHO_BODY = b'{"response":"reply"}'
+# header with the time spent serving an echo request, in ms
+SERVER_TIME_HEADER = "X-Server-Time"
+
+
+class ServerStats(object):
+
+    """Aggregated timing counters of the echo requests of a worker."""
+
+    def __init__(self) -> None:
+        """Constructor of ServerStats."""
+        self.started = time.monotonic()
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, elapsed_ms: float) -> None:
+        """Add the processing time of a request."""
+        self.count += 1
+        self.total_ms += elapsed_ms
+        if elapsed_ms > self.max_ms:
+            self.max_ms = elapsed_ms
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Counters as a dict, times in ms."""
+        uptime = time.monotonic() - self.started
+        return {
+            "pid": os.getpid(),
+            "requests": self.count,
+            "requests_per_sec": self.count / uptime if uptime > 0 else 0.0,
+            "mean_ms": self.total_ms / self.count if self.count else 0.0,
+            "max_ms": self.max_ms,
+        }
+
+
+stats = ServerStats()
+
 
 @app.middleware("request")
 async def add_start_time(request):
     """Prepend initial time when this request was served."""
-    request["start_time"] = time.time()
+    request["start_time"] = time.perf_counter()
 
 
-@app.middleware("response")
 async def add_spent_time(request, response):
     """Add spent time on each response."""
-    spend_time = (time.time() - request["start_time"]) * 1000
+    spend_time = (time.perf_counter() - request["start_time"]) * 1e3
     print(
         "{} {} {} {} {}ms".format(
             response.status,
@@ -31,9 +74,61 @@ async def add_spent_time(request, response):
 
 @app.route("/echo")
 async def echo(request):
-    """Just used for testing the server."""
-    return json({"response": "reply"})
+    """Just used for testing the server.
+
+    The time spent serving it is echoed back on the X-Server-Time header, so
+    the client can subtract it from the rtt.
+    """
+    elapsed = (time.perf_counter() - request["start_time"]) * 1e3
+    stats.add(elapsed)
+    return raw(
+        ECHO_BODY,
+        content_type="application/json",
+        headers={SERVER_TIME_HEADER: f"{elapsed:.6f}"},
+    )
+
+
+@app.route("/stats")
+async def server_stats(request):
+    """Timing counters of the worker that serves this request.
+
+    Every worker keeps its own counters, so with many workers they only cover
+    the requests of the worker whose pid is in the response.
+    """
+    return json(stats.as_dict())
+
+
+def run_udp(port: int) -> None:
+    """Run the UDP reflector."""
+    loop = uvloop.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(
+        loop.create_datagram_endpoint(
+            UDPReflector, local_addr=("0.0.0.0", port), reuse_port=True
+        )
+    )
+    try:
+        loop.run_forever()
+    finally:
+        loop.close()
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=8000)
+    PROBE_MODE = os.environ.get("PROBE_MODE", "http")
+    UDP_PORT = int(os.environ.get("UDP_PORT", 8001))
+    WORKERS = int(os.environ.get("WORKERS", 1))
+    LOG_REQUESTS = os.environ.get("LOG_REQUESTS", "0") == "1"
+
+    if PROBE_MODE == "udp":
+        # each worker binds the same port, the kernel spreads the probes
+        workers = [
+            multiprocessing.Process(target=run_udp, args=(UDP_PORT,))
+            for _ in range(WORKERS - 1)
+        ]
+        for worker in workers:
+            worker.start()
+        run_udp(UDP_PORT)
+    else:
+        if LOG_REQUESTS:
+            app.register_middleware(add_spent_time, "response")
+        app.run(host="0.0.0.0", port=8000, workers=WORKERS, access_log=LOG_REQUESTS)
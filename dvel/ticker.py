@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import time
+from typing import Optional
+
+
+class Ticker(object):
+
+    """Periodic scheduler based on absolute deadlines.
+
+    Deadlines are spaced by the period from the previous deadline instead of
+    from the end of the previous iteration, so the time spent measuring and
+    writing doesn't drift the cadence. Deadlines missed by more than a whole
+    period are skipped instead of sent in a burst. The lag is how late each
+    tick woke up, which tells event loop stalls apart from network latency.
+    """
+
+    def __init__(self) -> None:
+        """Constructor of Ticker."""
+        self.deadline: Optional[int] = None
+        self.lag_ns = 0
+        self.max_lag_ns = 0
+        self.ticks = 0
+        self.skipped = 0
+
+    async def tick(self, period: float) -> int:
+        """Wait for the next deadline, it returns the lag in ns.
+
+        :period: seconds between deadlines, it can change between ticks
+
+        """
+        period_ns = int(period * 1e9)
+        now = time.monotonic_ns()
+        if self.deadline is None:
+            self.deadline = now
+        else:
+            self.deadline += period_ns
+            behind = now - self.deadline
+            if period_ns and behind > period_ns:
+                missed = behind // period_ns
+                self.deadline += missed * period_ns
+                self.skipped += missed
+        delay = self.deadline - now
+        if delay > 0:
+            await asyncio.sleep(delay / 1e9)
+        self.lag_ns = max(0, time.monotonic_ns() - self.deadline)
+        self.max_lag_ns = max(self.max_lag_ns, self.lag_ns)
+        self.ticks += 1
+        return self.lag_ns
+
+    def pop_max_lag(self) -> int:
+        """Max lag since the last call, in ns."""
+        lag, self.max_lag_ns = self.max_lag_ns, 0
+        return lag
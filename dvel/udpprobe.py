@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import struct
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+
+# sequence number and client send time in ns, echoed back by the reflector
+PROBE = struct.Struct("!IQ")
+SEQ_MOD = 2 ** 32
+
+
+class UDPReflector(asyncio.DatagramProtocol):
+
+    """Echo every probe back to its sender."""
+
+    def __init__(self) -> None:
+        """Constructor of UDPReflector."""
+        self.transport = None
+        self.reflected = 0
+
+    def connection_made(self, transport) -> None:
+        """Keep the transport."""
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        """Send the probe back as is."""
+        self.transport.sendto(data, addr)
+        self.reflected += 1
+
+
+class UDPProber(asyncio.DatagramProtocol):
+
+    """Send sequence numbered and timestamped probes and match their replies.
+
+    A probe is lost when its reply doesn't arrive within timeout seconds, and
+    its reply, if it arrives later, is counted as late and left out of the
+    rtts, reordering and jitter. A reply is reordered when its sequence number
+    is lower than the highest one received, and jitter is the RFC 3550
+    interarrival jitter of the rtts.
+    on_sample is called with the rtt in ms of every reply, or None for every
+    lost probe.
+    """
+
+    def __init__(
+        self,
+        on_sample: Callable[[Optional[float]], None],
+        timeout: float = 1.0,
+        payload_size: int = 0,
+    ) -> None:
+        """Constructor of UDPProber.
+
+        :on_sample: called with each rtt in ms, None for lost probes
+        :timeout: seconds to wait for a reply before counting a loss
+        :payload_size: padding bytes added to each probe
+
+        """
+        self.on_sample = on_sample
+        self.timeout_ns = int(timeout * 1e9)
+        self.padding = bytes(payload_size)
+        self.transport = None
+        self._seq = 0
+        self._highest: Optional[int] = None
+        self._last_rtt: Optional[float] = None
+        self._pending: "OrderedDict[int, int]" = OrderedDict()
+        self.jitter = 0.0
+        self.counters: Dict[str, int] = {
+            "sent": 0,
+            "received": 0,
+            "lost": 0,
+            "reordered": 0,
+            "late": 0,
+        }
+
+    @classmethod
+    async def connect(
+        cls, addr: str, port: int, local_addr: Tuple[str, int] = None, **kwargs
+    ) -> Tuple[asyncio.DatagramTransport, "UDPProber"]:
+        """Make a UDPProber connected to a reflector."""
+        loop = asyncio.get_event_loop()
+        return await loop.create_datagram_endpoint(
+            lambda: cls(**kwargs), remote_addr=(addr, int(port)), local_addr=local_addr
+        )
+
+    def connection_made(self, transport) -> None:
+        """Keep the transport."""
+        self.transport = transport
+
+    def send(self) -> None:
+        """Send a probe and expire the ones whose replies are overdue."""
+        now = time.perf_counter_ns()
+        self._expire(now)
+        seq = self._seq
+        self._seq = (seq + 1) % SEQ_MOD
+        self._pending[seq] = now
+        self.transport.sendto(PROBE.pack(seq, now) + self.padding)
+        self.counters["sent"] += 1
+
+    def _expire(self, now: int) -> None:
+        """Count the probes waiting for longer than timeout as lost."""
+        deadline = now - self.timeout_ns
+        while self._pending:
+            seq, sent = next(iter(self._pending.items()))
+            if sent > deadline:
+                break
+            del self._pending[seq]
+            self.counters["lost"] += 1
+            self.on_sample(None)
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        """Match a reply with its probe."""
+        now = time.perf_counter_ns()
+        try:
+            seq, sent = PROBE.unpack_from(data)
+        except struct.error:
+            return
+        self._expire(now)
+        if self._pending.pop(seq, None) is None:
+            self.counters["late"] += 1
+            return
+        self.counters["received"] += 1
+        if self._highest is not None and (seq - self._highest) % SEQ_MOD > SEQ_MOD // 2:
+            self.counters["reordered"] += 1
+        else:
+            self._highest = seq
+        rtt = (now - sent) / 1e6
+        if self._last_rtt is not None:
+            self.jitter += (abs(rtt - self._last_rtt) - self.jitter) / 16
+        self._last_rtt = rtt
+        self.on_sample(rtt)
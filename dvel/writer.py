@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+log = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+BLOCK = "block"
+POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+def _escape_key(value: str) -> str:
+    """Escape a measurement, tag key or tag value for the line protocol."""
+    return value.replace(",", r"\,").replace("=", r"\=").replace(" ", r"\ ")
+
+
+def _format_field(value: Any) -> str:
+    """Format a field value for the line protocol."""
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, int):
+        return f"{value}i"
+    if isinstance(value, float):
+        return repr(value)
+    value = str(value).replace("\\", "\\\\").replace('"', r"\"")
+    return f'"{value}"'
+
+
+def to_line(
+    measurement: str,
+    tags: Dict[str, str],
+    fields: Dict[str, Any],
+    timestamp: Optional[int] = None,
+) -> str:
+    """Serialize a point to InfluxDB line protocol.
+
+    :timestamp: epoch in nanoseconds, defaults to now. Buffered points must
+        carry their own timestamp, otherwise they'd be stamped at flush time.
+
+    """
+    if timestamp is None:
+        timestamp = time.time_ns()
+    key = _escape_key(measurement)
+    for tag, value in sorted(tags.items()):
+        key += f",{_escape_key(tag)}={_escape_key(str(value))}"
+    field_set = ",".join(
+        f"{_escape_key(field)}={_format_field(value)}"
+        for field, value in fields.items()
+    )
+    return f"{key} {field_set} {timestamp}"
+
+
+class BufferedWriter(object):
+
+    """Buffer points in memory and write them to InfluxDB in batches."""
+
+    def __init__(
+        self,
+        influx_client,
+        batch_size: int = 1000,
+        flush_interval: float = 1.0,
+        max_points: int = 100000,
+        policy: str = DROP_OLDEST,
+    ) -> None:
+        """Constructor of BufferedWriter.
+
+        :influx_client: aioinflux InfluxDBClient
+        :batch_size: flush as soon as this many points are buffered
+        :flush_interval: flush at least every flush_interval seconds
+        :max_points: upper bound of buffered points
+        :policy: what to do when the buffer is full, either drop_oldest,
+            drop_newest or block (backpressure on the writer)
+
+        """
+        if policy not in POLICIES:
+            raise ValueError(f"policy should be one of {POLICIES}")
+        self.client = influx_client
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_points = max(max_points, batch_size)
+        self.policy = policy
+        self.dropped = 0
+        self.written = 0
+        self._buffer: deque = deque()
+        self._flush_evt = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._running = False
+
+    def __len__(self) -> int:
+        """Number of buffered points."""
+        return len(self._buffer)
+
+    async def write(
+        self,
+        measurement: str,
+        tags: Dict[str, str],
+        fields: Dict[str, Any],
+        timestamp: Optional[int] = None,
+    ) -> bool:
+        """Buffer a point, it returns False if the point has been dropped.
+
+        It only awaits when the buffer is full and the policy is block.
+        """
+        line = to_line(measurement, tags, fields, timestamp)
+        if len(self._buffer) >= self.max_points:
+            if self.policy == DROP_NEWEST:
+                self.dropped += 1
+                return False
+            elif self.policy == DROP_OLDEST:
+                self._buffer.popleft()
+                self.dropped += 1
+            else:
+                self._not_full.clear()
+                await self._not_full.wait()
+        self._buffer.append(line)
+        if len(self._buffer) >= self.batch_size:
+            self._flush_evt.set()
+        return True
+
+    async def flush(self) -> None:
+        """Write all buffered points in batches of batch_size."""
+        while self._buffer:
+            n = min(self.batch_size, len(self._buffer))
+            batch = [self._buffer.popleft() for _ in range(n)]
+            self._not_full.set()
+            try:
+                await self.client.write("\n".join(batch))
+                self.written += n
+            except Exception as e:
+                # put it back, older points are the first to go if it's full
+                space = self.max_points - len(self._buffer)
+                if space < n:
+                    self.dropped += n - max(space, 0)
+                    batch = batch[n - max(space, 0):]
+                self._buffer.extendleft(reversed(batch))
+                log.error(f"InfluxDB write failed, {len(batch)} points kept: {e}")
+                return
+
+    async def run(self) -> None:
+        """Coroutine that flushes by size or by time until it's stopped."""
+        self._running = True
+        while self._running:
+            try:
+                await asyncio.wait_for(self._flush_evt.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_evt.clear()
+            await self.flush()
+
+    async def close(self) -> None:
+        """Stop the flushing coroutine and flush what is left."""
+        self._running = False
+        self._flush_evt.set()
+        await self.flush()
+
+
+class IngestSender(asyncio.DatagramProtocol):
+
+    """Push samples straight to the dvel NApp ingest endpoint over UDP.
+
+    The NApp replies with ``rate <host> <pps>`` lines, which are passed to
+    on_rate.
+    """
+
+    def __init__(self) -> None:
+        """Constructor of IngestSender."""
+        self.transport = None
+        self.errors = 0
+        self.on_rate: Optional[Callable[[str, float], None]] = None
+
+    @classmethod
+    async def connect(cls, addr: str, port: int) -> "IngestSender":
+        """Create the UDP endpoint of an IngestSender."""
+        loop = asyncio.get_event_loop()
+        _, protocol = await loop.create_datagram_endpoint(
+            cls, remote_addr=(addr, int(port))
+        )
+        return protocol
+
+    def connection_made(self, transport) -> None:
+        """Keep the transport."""
+        self.transport = transport
+
+    def error_received(self, exc: Exception) -> None:
+        """Count socket errors, such as the NApp not listening yet."""
+        self.errors += 1
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        """Handle the probe rates sent by the NApp."""
+        if self.on_rate is None:
+            return
+        for line in data.decode(errors="ignore").splitlines():
+            try:
+                kind, host, rate = line.split()
+                if kind == "rate":
+                    self.on_rate(host, float(rate))
+            except ValueError:
+                continue
+
+    def send(self, host: str, rtt: Optional[float]) -> None:
+        """Send a sample, a None rtt means the probe was lost."""
+        if self.transport is None:
+            return
+        value = "-" if rtt is None else f"{rtt:.3f}"
+        self.transport.sendto(f"{host} {value}\n".encode())
+
+    def close(self) -> None:
+        """Close the transport."""
+        if self.transport:
+            self.transport.close()
@@ -0,0 +1,140 @@
+"""In-process OpenFlow fast path used to change lanes."""
+
+import itertools
+import random
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from kytos.core.events import KytosEvent
+from napps.kytos.of_core.v0x04.flow import Flow04
+from pyof.v0x04.controller2switch.barrier_request import BarrierRequest
+from pyof.v0x04.controller2switch.flow_mod import FlowModCommand
+
+OF_V0X04 = 0x04
+
+
+class FastPathError(Exception):
+
+    """Raised when the fast path can't be used or a switch didn't confirm."""
+
+
+class _Barrier(object):
+
+    """Pending barrier request."""
+
+    __slots__ = ("event", "replied_at")
+
+    def __init__(self) -> None:
+        """Constructor of _Barrier."""
+        self.event = threading.Event()
+        self.replied_at = 0.0
+
+
+class FastPath(object):
+
+    """Send FlowMods straight to the switches over the Kytos connections.
+
+    Flows are replaced with an install new, barrier, delete old, barrier
+    sequence, sent to all switches at once, so traffic is never blackholed
+    and the switches are reprogrammed in parallel without flow_manager's
+    REST round trips.
+    """
+
+    def __init__(self, controller, timeout: float = 1.0) -> None:
+        """Constructor of FastPath.
+
+        :controller: kytos controller
+        :timeout: max time to wait for each barrier reply, in seconds
+
+        """
+        self.controller = controller
+        self.timeout = timeout
+        self._xids = itertools.count(random.randint(1, 2 ** 30))
+        self._barriers: Dict[int, _Barrier] = {}
+        self._lock = threading.Lock()
+
+    def switch(self, dpid: str):
+        """Get a connected OpenFlow 1.3 switch or raise FastPathError."""
+        switch = self.controller.get_switch_by_dpid(dpid)
+        if switch is None or not switch.is_connected():
+            raise FastPathError(f"switch {dpid} is not connected")
+        if switch.connection.protocol.version != OF_V0X04:
+            raise FastPathError(f"switch {dpid} isn't OpenFlow 1.3")
+        return switch
+
+    def _send(self, switch, message, msg_type: str) -> None:
+        """Put a message on the msg_out buffer."""
+        event = KytosEvent(
+            name=f"viniarck/dvel.messages.out.{msg_type}",
+            content={"destination": switch.connection, "message": message},
+        )
+        self.controller.buffers.msg_out.put(event)
+
+    def _barrier(self, switch) -> Tuple[int, _Barrier]:
+        """Send a barrier request."""
+        xid = next(self._xids) & 0xFFFFFFFF
+        barrier = _Barrier()
+        with self._lock:
+            self._barriers[xid] = barrier
+        self._send(switch, BarrierRequest(xid=xid), "ofpt_barrier_request")
+        return xid, barrier
+
+    def barrier_reply(self, xid: int) -> None:
+        """Handle a barrier reply."""
+        with self._lock:
+            barrier = self._barriers.pop(xid, None)
+        if barrier:
+            barrier.replied_at = time.perf_counter()
+            barrier.event.set()
+
+    def _wait(
+        self, pending: Dict[str, Tuple[int, _Barrier]], start: float
+    ) -> Dict[str, float]:
+        """Wait for the pending barriers, it returns the elapsed ms of each dpid."""
+        deadline = start + self.timeout
+        elapsed = {}
+        for dpid, (xid, barrier) in pending.items():
+            if not barrier.event.wait(max(0.0, deadline - time.perf_counter())):
+                with self._lock:
+                    for other_xid, _ in pending.values():
+                        self._barriers.pop(other_xid, None)
+                raise FastPathError(f"switch {dpid} barrier reply timed out")
+            elapsed[dpid] = (barrier.replied_at - start) * 1e3
+        return elapsed
+
+    def replace(
+        self,
+        new_flows: Dict[str, List[Dict]],
+        old_flows: Dict[str, List[Dict]],
+    ) -> Dict[str, Dict[str, float]]:
+        """Install new_flows and then strictly delete old_flows on each dpid.
+
+        Old flows are only deleted once all switches have confirmed the new
+        ones. It returns the install and total changeover time of each dpid,
+        in ms.
+        """
+        switches = {dpid: self.switch(dpid) for dpid in {**new_flows, **old_flows}}
+
+        start = time.perf_counter()
+        pending = {}
+        for dpid, switch in switches.items():
+            for flow_dict in new_flows.get(dpid, []):
+                flow_mod = Flow04.from_dict(flow_dict, switch).as_of_add_flow_mod()
+                self._send(switch, flow_mod, "ofpt_flow_mod")
+            pending[dpid] = self._barrier(switch)
+        installed = self._wait(pending, start)
+
+        pending = {}
+        for dpid, switch in switches.items():
+            for flow_dict in old_flows.get(dpid, []):
+                flow_mod = Flow04.from_dict(flow_dict, switch).as_of_delete_flow_mod()
+                flow_mod.command = FlowModCommand.OFPFC_DELETE_STRICT
+                self._send(switch, flow_mod, "ofpt_flow_mod")
+            pending[dpid] = self._barrier(switch)
+        deleted = self._wait(pending, start)
+
+        return {
+            dpid: {"install_ms": installed[dpid], "total_ms": deleted[dpid]}
+            for dpid in switches
+        }
@@ -0,0 +1,175 @@
+"""Pooled and coalescing flow_manager client."""
+
+import json
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.models import Response
+from urllib3.util.retry import Retry
+
+# urllib3 1.26 renamed method_whitelist to allowed_methods, and 2.0 dropped the
+# old name, while requests 2.21 still installs an older urllib3
+RETRY_METHODS_ARG = (
+    "allowed_methods"
+    if hasattr(Retry, "DEFAULT_ALLOWED_METHODS")
+    else "method_whitelist"
+)
+
+# flows and their ready to send flow_manager request body
+FlowSet = namedtuple("FlowSet", "flows payload")
+
+
+def serialize(flows: List[Dict]) -> bytes:
+    """Serialize flows as a flow_manager request body."""
+    return json.dumps({"flows": flows}).encode()
+
+
+def flow_set(flows: List[Dict]) -> FlowSet:
+    """Make a FlowSet, serializing its flows once."""
+    return FlowSet(flows, serialize(flows))
+
+
+def merge(flow_sets: List[FlowSet]) -> FlowSet:
+    """Merge FlowSets, keeping the payload when there's a single one."""
+    if len(flow_sets) == 1:
+        return flow_sets[0]
+    flows: List[Dict] = []
+    for fset in flow_sets:
+        flows.extend(fset.flows)
+    return FlowSet(flows, None)
+
+
+class _Batch(object):
+
+    """Flows waiting to be pushed to a dpid."""
+
+    __slots__ = ("flows", "payload", "future")
+
+    def __init__(self, flows: List[Dict], payload: Optional[bytes]) -> None:
+        """Constructor of _Batch."""
+        self.flows = flows
+        self.payload = payload
+        self.future: Future = None
+
+
+class FlowPusher(object):
+
+    """Push flows to flow_manager over a pooled keep-alive session.
+
+    Pushes are dispatched on a thread pool, so different dpids are provisioned
+    in parallel, whereas pushes to the same dpid are serialized and the ones
+    that are still waiting are coalesced into a single request.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        workers: int = 8,
+        retries: int = 3,
+        backoff: float = 0.1,
+        timeout: float = 5.0,
+    ) -> None:
+        """Constructor of FlowPusher.
+
+        :url: flow_manager base URL
+        :workers: max number of concurrent pushes
+        :retries: retries of a failed push, with exponential backoff
+        :backoff: backoff factor of the retries, in seconds
+        :timeout: timeout of each request, in seconds
+
+        """
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(500, 502, 503, 504),
+            raise_on_status=False,
+            **{RETRY_METHODS_ARG: frozenset(["POST", "DELETE"])},
+        )
+        adapter = HTTPAdapter(pool_maxsize=workers, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._queued: Dict[str, _Batch] = {}
+        self._dpid_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        # called with the dpid and the ms of each push
+        self.on_push: Optional[Callable[[str, float], None]] = None
+
+    def push(
+        self, dpid: str, flows: List[Dict], payload: Optional[bytes] = None
+    ) -> Response:
+        """Push flows to a dpid and wait for the response.
+
+        :payload: flows already serialized, it saves serializing them again
+
+        """
+        endpoint = f"{self.url}/flows/{dpid}"
+        start = time.perf_counter()
+        response = self.session.post(
+            endpoint,
+            data=payload or serialize(flows),
+            headers={"Content-Type": "application/json"},
+            timeout=self.timeout,
+        )
+        if self.on_push:
+            self.on_push(dpid, (time.perf_counter() - start) * 1e3)
+        return response
+
+    def delete(self, dpid: str, flows: List[Dict]) -> Response:
+        """Delete flows of a dpid and wait for the response."""
+        endpoint = f"{self.url}/flows/{dpid}"
+        return self.session.delete(
+            endpoint,
+            data=serialize(flows),
+            headers={"Content-Type": "application/json"},
+            timeout=self.timeout,
+        )
+
+    def submit(self, dpid: str, flows: FlowSet) -> Future:
+        """Push a FlowSet to a dpid in the background.
+
+        If there's already a push to this dpid waiting to be sent, the flows
+        are appended to it and its future is returned.
+        """
+        with self._lock:
+            batch = self._queued.get(dpid)
+            if batch is not None:
+                batch.flows.extend(flows.flows)
+                batch.payload = None
+                return batch.future
+            batch = _Batch(list(flows.flows), flows.payload)
+            self._queued[dpid] = batch
+            self._dpid_locks.setdefault(dpid, threading.Lock())
+            batch.future = self.executor.submit(self._run, dpid, batch)
+            return batch.future
+
+    def _run(self, dpid: str, batch: _Batch) -> Response:
+        """Send a batch once the previous push to this dpid has finished."""
+        with self._dpid_locks[dpid]:
+            with self._lock:
+                if self._queued.get(dpid) is batch:
+                    del self._queued[dpid]
+            return self.push(dpid, batch.flows, batch.payload)
+
+    def push_many(self, flows: Dict[str, FlowSet]) -> Dict[str, Response]:
+        """Push flows to several dpids in parallel and wait for all of them.
+
+        It raises the first exception of a failed push.
+        """
+        futures = {
+            dpid: self.submit(dpid, dpid_flows) for dpid, dpid_flows in flows.items()
+        }
+        return {dpid: future.result() for dpid, future in futures.items()}
+
+    def shutdown(self) -> None:
+        """Stop the workers and close the session."""
+        self.executor.shutdown(wait=False)
+        self.session.close()
@@ -0,0 +1,161 @@
+"""Forecasting of the lane rtt and loss rate, it needs NumPy."""
+
+from typing import Dict, Tuple
+
+import numpy as np
+
+
+def holt(series: np.ndarray, alpha: float, beta: float, horizon: float) -> np.ndarray:
+    """Holt's linear trend forecast of each row, horizon steps ahead.
+
+    :series: one row of equally spaced samples per lane, oldest first
+
+    """
+    level = series[:, 0].copy()
+    trend = np.zeros(len(series))
+    for column in series.T[1:]:
+        prev = level
+        level = alpha * column + (1 - alpha) * (level + trend)
+        trend = beta * (level - prev) + (1 - beta) * trend
+    return level + horizon * trend
+
+
+def cusum(series: np.ndarray, threshold: float, drift: float) -> np.ndarray:
+    """Whether each row shifted upwards in its second half.
+
+    It's a one-sided CUSUM of the second half of each row, normalized by the
+    mean and standard deviation of the first half.
+
+    :threshold: alarm level of the cumulative sum, in standard deviations
+    :drift: deviations per step that don't add up
+
+    """
+    half = series.shape[1] // 2
+    baseline = series[:, :half]
+    mean = baseline.mean(axis=1)
+    std = np.maximum(baseline.std(axis=1), np.maximum(0.01 * np.abs(mean), 1e-3))
+    total = np.zeros(len(series))
+    alarm = np.zeros(len(series), dtype=bool)
+    for column in series.T[half:]:
+        total = np.maximum(0.0, total + (column - mean) / std - drift)
+        alarm |= total > threshold
+    return alarm
+
+
+class Forecaster(object):
+
+    """Predict the rtt and loss rate of the lanes a few seconds ahead.
+
+    Samples are kept on a grid of window steps of step seconds per lane,
+    repeating the last value over gaps, and every lane is forecast at once
+    with Holt's linear trend. When a CUSUM change-point test finds an upward
+    shift of a lane, its forecast is at least its latest value, so a
+    degradation is acted on before it's reflected by the averages.
+    """
+
+    def __init__(
+        self,
+        step: float = 1.0,
+        window: int = 60,
+        horizon: float = 5.0,
+        alpha: float = 0.5,
+        beta: float = 0.2,
+        threshold: float = 5.0,
+        drift: float = 0.5,
+        min_samples: int = 10,
+    ) -> None:
+        """Constructor of Forecaster.
+
+        :step: seconds of each sample of the grid
+        :window: number of samples of each lane
+        :horizon: seconds ahead of the forecasts
+        :alpha: level smoothing factor
+        :beta: trend smoothing factor
+        :threshold: CUSUM alarm level, in standard deviations
+        :drift: CUSUM deviations per step that don't add up
+        :min_samples: lanes with fewer samples aren't forecast
+
+        """
+        self.step = step
+        self.window = window
+        self.horizon = horizon / step
+        self.alpha = alpha
+        self.beta = beta
+        self.threshold = threshold
+        self.drift = drift
+        self.min_samples = min_samples
+        self.keys: Dict[str, int] = {}
+        self.rtt = np.zeros((0, window))
+        self.loss = np.zeros((0, window))
+        self.count = np.zeros(0, dtype=int)
+        self.last_step = np.zeros(0, dtype=int)
+
+    def _row(self, key: str) -> int:
+        """Row of a lane, it's added if it's new."""
+        row = self.keys.get(key)
+        if row is None:
+            row = len(self.keys)
+            self.keys[key] = row
+            self.rtt = np.vstack((self.rtt, np.zeros((1, self.window))))
+            self.loss = np.vstack((self.loss, np.zeros((1, self.window))))
+            self.count = np.append(self.count, 0)
+            self.last_step = np.append(self.last_step, 0)
+        return row
+
+    def add(self, key: str, now: float, rtt: float, loss: float) -> None:
+        """Add a sample of a lane, the latest one of a step wins.
+
+        A lane without samples for a whole window, e.g. while it was down,
+        starts over from the new sample.
+
+        :now: time of the sample in seconds, e.g. time.monotonic()
+
+        """
+        row = self._row(key)
+        step = int(now // self.step)
+        if not self.count[row] or step - self.last_step[row] >= self.window:
+            self.rtt[row] = rtt
+            self.loss[row] = loss
+            self.count[row] = 1
+        elif step > self.last_step[row]:
+            shift = step - self.last_step[row]
+            for series in (self.rtt, self.loss):
+                series[row] = np.roll(series[row], -shift)
+                series[row, -shift:] = series[row, -shift - 1]
+            self.count[row] = min(self.count[row] + shift, self.window)
+        self.rtt[row, -1] = rtt
+        self.loss[row, -1] = loss
+        self.last_step[row] = step
+
+    def remove(self, key: str) -> None:
+        """Stop forecasting a lane."""
+        row = self.keys.pop(key, None)
+        if row is None:
+            return
+        keep = np.arange(len(self.count)) != row
+        self.rtt = self.rtt[keep]
+        self.loss = self.loss[keep]
+        self.count = self.count[keep]
+        self.last_step = self.last_step[keep]
+        self.keys = {k: r - (r > row) for k, r in self.keys.items()}
+
+    def predict(self) -> Dict[str, Tuple[float, float]]:
+        """Forecast rtt and loss rate of each lane with enough samples."""
+        ready = self.count >= self.min_samples
+        if not ready.any():
+            return {}
+        forecasts = []
+        for series in (self.rtt[ready], self.loss[ready]):
+            forecast = holt(series, self.alpha, self.beta, self.horizon)
+            alarm = cusum(series, self.threshold, self.drift)
+            latest = np.maximum(forecast, series[:, -1])
+            forecasts.append(np.where(alarm, latest, forecast))
+        rtt = np.maximum(forecasts[0], 0.0)
+        loss = np.clip(forecasts[1], 0.0, 1.0)
+        rows = np.flatnonzero(ready)
+        index = {row: i for i, row in enumerate(rows)}
+        return {
+            key: (float(rtt[index[row]]), float(loss[index[row]]))
+            for key, row in self.keys.items()
+            if row in index
+        }
@@ -2,17 +2,30 @@
 
 import aiohttp
 import requests
+import threading
 import time
 import uvloop
 import async_timeout
 import asyncio
-from aioinflux import InfluxDBClient
+from aioinflux import InfluxDBClient, InfluxDBError
 from kytos.core import KytosNApp, log, rest
 from kytos.core.helpers import listen_to
 from kytos.core.events import KytosEvent
-from flask import jsonify
+from flask import jsonify, request
 from napps.viniarck.dvel import settings
-from typing import List, Dict, Any
+from napps.viniarck.dvel.aggregator import StreamAggregator
+from napps.viniarck.dvel.fastpath import FastPath, FastPathError
+from napps.viniarck.dvel.metrics import StageTimer
+from napps.viniarck.dvel.flowpusher import FlowPusher, merge
+from napps.viniarck.dvel.model import DTNPair, Lane, Network, prepare_flow_mod
+from napps.viniarck.dvel.optimizer import LaneOptimizer
+from napps.viniarck.dvel.paths import Link, PathCache, assign, hops
+from napps.viniarck.dvel.ratecontrol import ProbeRateController
+from napps.viniarck.dvel import retention
+from napps.viniarck.dvel.scoring import make_policy
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import List, Dict, Any, Optional, Set, Tuple
 from requests.models import Response
 
 """
@@ -40,6 +53,46 @@ d5 -- (5)       |                               |        (5) -- d8
 """
 
 
+class IngestProtocol(asyncio.DatagramProtocol):
+
+    """UDP endpoint where the probes push their samples.
+
+    The address each probe pushes from is kept, so its probe rate can be
+    sent back to it.
+    """
+
+    def __init__(self, aggregator: StreamAggregator) -> None:
+        """Constructor of IngestProtocol."""
+        self.aggregator = aggregator
+        self.transport = None
+        self.peers: Dict[str, Tuple[str, int]] = {}
+        self.wakeup = asyncio.Event()
+
+    def connection_made(self, transport) -> None:
+        """Keep the transport."""
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        """Ingest the samples of a datagram."""
+        for host in self.aggregator.ingest(data):
+            self.peers[host] = addr
+        self.wakeup.set()
+
+    def send_rates(self, rates: Dict[str, float]) -> None:
+        """Send ``rate <host> <pps>`` lines to the probes, a datagram per peer."""
+        lines: Dict[Tuple[str, int], List[str]] = defaultdict(list)
+        for host, rate in rates.items():
+            addr = self.peers.get(host)
+            if addr is not None:
+                lines[addr].append(f"rate {host} {rate:.3f}\n")
+        for addr, peer_lines in lines.items():
+            self.transport.sendto("".join(peer_lines).encode(), addr)
+
+    def error_received(self, exc: Exception) -> None:
+        """Log socket errors."""
+        log.error(f"Ingest endpoint error: {exc}")
+
+
 class Main(KytosNApp):
     """Main class of viniarck/dvel NApp.
 
@@ -47,315 +100,400 @@ class Main(KytosNApp):
 
     def setup(self) -> None:
         """Create a graph to handle the nodes and edges."""
+        self.t_setup = time.monotonic()
 
-        try:
-            self.dpids: List[str] = settings.dpids
-        except AttributeError:
-            log.error("dpids list is missing on settings.py")
-            exit(1)
-
-        self.http_server = settings.http_server
-        self.http_port = settings.http_port
-        self.endpoint = settings.endpoint
         self.db_server = settings.db_server
         self.db_name = settings.db_name
         self.frequency = settings.frequency
-        self.timeout = settings.timeout
-        self.c_params = settings.c_params
-        self.containers = settings.containers
-
-        self.bb_n_evcs: int = 3  # only 3 different paths in the core for now
-        self.bb_nni_ofn1: int = 2
-        self.bb_nni_ofn2: int = self.bb_nni_ofn1 + self.bb_n_evcs
-        self.bb_nni_vlan1: int = 100  # starts at vlan id 100
-        self.bb_nn1_vlan2: int = self.bb_nni_vlan1 + self.bb_n_evcs
-        self.bb_edge_uni_ofnum: int = 1
-        self.bb_host_vlan: int = self.bb_nn1_vlan2 + 1
-
-        self.bb_sws: Dict[str, Any] = {
-            "dpids": self.dpids[-2:],  # last two elements.
-            "nni_ofnums": range(self.bb_nni_ofn1, self.bb_nni_ofn2),
-            "nni_vlans": range(self.bb_nni_vlan1, self.bb_nn1_vlan2),
-            "uni_ofnum": self.bb_edge_uni_ofnum,
-        }
+        self.max_rtt = settings.max_rtt
+        self.ingest_addr = settings.ingest_addr
+        self.ingest_port = settings.ingest_port
+        self.rtt_stat = settings.rtt_stat
+        self.query_timeout = settings.query_timeout
+        self.query_sem = None
+        self.timer = StageTimer()
+        self.ingest = None
+        self.aggregator = None
+        if self.ingest_port:
+            self.aggregator = StreamAggregator(settings.window, settings.ewma_alpha)
+
+        forecaster = None
+        if settings.forecast is not None:
+            try:
+                from napps.viniarck.dvel.forecast import Forecaster
+            except ImportError as e:
+                log.error(f"settings.forecast needs NumPy, forecasting is off: {e}")
+            else:
+                forecaster = Forecaster(**settings.forecast)
+
+        self.network = Network(
+            settings.vlan_range, settings.probe_port_start, settings.host_evc_priorities
+        )
+        self.optimizer = LaneOptimizer(
+            self.network,
+            make_policy(settings.policy, **settings.policy_params),
+            self.max_rtt,
+            settings.damping,
+            ProbeRateController(
+                settings.probe_budget, settings.probe_rate_min, settings.probe_rate_max
+            ),
+            forecaster,
+        )
+        try:
+            for name, attrs in settings.pairs.items():
+                self.add_pair(name, attrs)
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            log.error(f"Invalid pairs on settings.py: {e}")
+            exit(1)
+        self.default_pair: str = next(iter(self.network.pairs), None)
+        self.dpids: List[str] = sorted(self.network.dpids())
+        # the flows of every dpid, lane and host EVC priority are built once
+        self.network.precompute()
+        self.paths = PathCache(settings.path_count)
+        self._routes: Dict[str, Tuple[tuple, list]] = {}
+        self._topology_lock = threading.Lock()
+        self._lane_lock = threading.Lock()
+
+        self.fast_path = None
+        if settings.fast_path:
+            self.fast_path = FastPath(self.controller, settings.fast_path_timeout)
+        self.flow_pusher = FlowPusher(
+            settings.FMNGR_URL,
+            workers=settings.flow_push_workers,
+            retries=settings.flow_push_retries,
+            backoff=settings.flow_push_backoff,
+        )
+        self.flow_pusher.on_push = self._on_push
 
-        self.edge_n_evcs: int = self.bb_n_evcs  # one container for each evc
-        self.edge_uni_ofn1: int = 3
-        self.edge_uni_ofn2: int = self.edge_uni_ofn1 + self.edge_n_evcs
-        self.edge_host_ofnum: int = 1
-        self.bb_edge_nni_ofnum: int = 2  # single uplink, so no range for now.
-
-        self.edge_sws: Dict[str, Any] = {
-            "dpids": self.dpids[0:2],
-            "uni_ofnums": range(self.edge_uni_ofn1, self.edge_uni_ofn2),
-            "nni_vlans": self.bb_sws["nni_vlans"],
-            "nni_ofnum": self.bb_edge_nni_ofnum,
+        self.timeline: Dict[str, Any] = {
+            "execute": None,
+            "all_provisioned": None,
+            "dpids": {},
         }
+        self._timeline_lock = threading.Lock()
+        self.all_ready = threading.Event()
 
         self.loop = None
         self.run_flag = True
 
-    async def http_post(self, session, url):
-        """ Send http post. """
-        async with async_timeout.timeout(self.timeout):
-            async with session.post(url) as response:
-                return await response.text()
+    def add_pair(self, name: str, attrs: Dict[str, Any]) -> DTNPair:
+        """Add a DTN pair and its lanes.
 
-    async def main_coroutine(self):
-        """Main coroutine."""
-        client = InfluxDBClient(host=self.db_server, db=self.db_name)
+        :name: pair name
+        :attrs: dict with the edges and lanes of the pair, as on settings.py
+
+        """
+        pair = self.network.add_pair(name, attrs["edges"], attrs["lanes"])
+        self.optimizer.add_pair(pair)
+        return pair
+
+    def _update_lane(
+        self,
+        lane: Lane,
+        rtt: Optional[float],
+        pkt_loss: Optional[float] = None,
+        jitter: Optional[float] = None,
+    ) -> None:
+        """Update the metrics of a lane, a lane without rtt is down."""
+        went_down = self.optimizer.update(lane, rtt, pkt_loss, jitter)
+        # if current path is down, steer away
+        if went_down and lane.index == lane.pair.active:
+            log.info(f"Current path of {lane.pair.name} is down! Steering away.")
+
+    async def _query_lane(self, client, key: str) -> Optional[Dict[str, float]]:
+        """Query the metrics of a lane, None if they're unknown or it failed.
+
+        They're read from the rollups of the probes, not from their raw points.
+        """
+        query = (
+            'select mean("mean"), mean("stddev"), sum("lost"), sum("sent") '
+            f'from {retention.ROLLUP} where ("host" = \'{key}\') '
+            "and time > now() - 3s"
+        )
+        async with self.query_sem:
+            try:
+                with self.timer.time("influx_query"):
+                    async with async_timeout.timeout(self.query_timeout):
+                        query_res = await client.query(query)
+            except asyncio.TimeoutError:
+                log.warning(f"rtt query of {key} timed out")
+                return None
+            except (InfluxDBError, aiohttp.client_exceptions.ClientError) as e:
+                log.warning(f"rtt query of {key} failed: {e}")
+                return None
+        res = query_res["results"][0]
+        if not res.get("series"):
+            return None
+        _, mean, stddev, lost, sent = res["series"][0]["values"][0]
+        lost, sent = lost or 0, sent or 0
+        if mean is None:
+            # every probe sent in the window was lost
+            return {"rtt": None, "pkt_loss": 1.0} if sent else None
+        metrics = {"rtt": float(mean or 0.0), "jitter": float(stddev or 0.0)}
+        if sent:
+            metrics["pkt_loss"] = min(1.0, lost / sent)
+        return metrics
+
+    async def _read_lanes_influx(self, client) -> Set[DTNPair]:
+        """Read the rtt, jitter and loss rate of each lane from InfluxDB.
+
+        Lanes are queried concurrently, at most query_concurrency at a time,
+        and a lane whose query times out or fails keeps its previous metrics.
+        It returns the pairs that have been updated.
+        """
+        lanes = list(self.network.lanes_by_probe.values())
+        results = await asyncio.gather(
+            *(self._query_lane(client, lane.probe) for lane in lanes)
+        )
+        pairs = set()
+        for lane, metrics in zip(lanes, results):
+            if metrics is not None:
+                self._update_lane(lane, **metrics)
+                pairs.add(lane.pair)
+        return pairs
+
+    async def _setup_retention(self, client) -> None:
+        """Set up the retention policies and downsampling of settings.retention.
+
+        Creating a policy that exists with other settings or dropping a
+        continuous query that doesn't exist fail, and they're followed by the
+        statements that take care of it.
+        """
+        params = settings.retention
+        for statement in retention.statements(
+            self.db_name, params["raw"], params["rollup"], params["interval"]
+        ):
+            try:
+                await client.query(statement)
+            except InfluxDBError as e:
+                if statement.startswith(("CREATE RETENTION", "DROP")):
+                    log.debug(f"{statement}: {e}")
+                else:
+                    log.warning(f"{statement}: {e}")
+
+    async def _write_latency(self, client) -> None:
+        """Write the stage latency summaries to InfluxDB."""
+        points = self.timer.points()
+        if not points:
+            return
         try:
-            await client.create_database(host=self.db_server, db=self.db_name)
-        except aiohttp.client_exceptions.ClientConnectorError as e:
-            log.error(e)
+            await client.write(points)
+        except (aiohttp.client_exceptions.ClientError, asyncio.TimeoutError) as e:
+            log.warning(f"Stage latencies couldn't be written: {e}")
+
+    def _on_push(self, dpid: str, ms: float) -> None:
+        """Record the time of a flow_manager push."""
+        self.timer.observe("flow_push", ms)
+        self.timer.observe(f"flow_push.{dpid}", ms)
+
+    async def _wait_tick(self) -> None:
+        """Wait for the next decision tick.
+
+        With streaming ingest, ticks are at least frequency seconds apart and
+        wait for new samples for up to max_tick seconds.
+        """
+        await asyncio.sleep(self.frequency)
+        if self.ingest is None:
             return
-        log_flag = True
+        try:
+            await asyncio.wait_for(self.ingest.wakeup.wait(), settings.max_tick)
+        except asyncio.TimeoutError:
+            pass
+        self.ingest.wakeup.clear()
+
+    async def main_coroutine(self):
+        """Main coroutine."""
+        client = None
+        if self.aggregator:
+            _, self.ingest = await self.loop.create_datagram_endpoint(
+                lambda: IngestProtocol(self.aggregator),
+                local_addr=(self.ingest_addr, self.ingest_port),
+            )
+            log.info(f"Ingesting samples on {self.ingest_addr}:{self.ingest_port}")
+        else:
+            self.query_sem = asyncio.Semaphore(settings.query_concurrency)
+        if not self.aggregator or settings.latency_influx or settings.retention:
+            client = InfluxDBClient(host=self.db_server, db=self.db_name)
+            try:
+                await client.create_database(host=self.db_server, db=self.db_name)
+                if settings.retention:
+                    await self._setup_retention(client)
+            except aiohttp.client_exceptions.ClientConnectorError as e:
+                log.error(e)
+                # only polling can't do without InfluxDB
+                if not self.aggregator:
+                    return
+        log.info("Waiting for all dpids to be provisioned")
+        await self.loop.run_in_executor(None, self.all_ready.wait)
+        next_rates = next_latency = self.loop.time()
         while self.run_flag:
             try:
-                cur_key = self.c_params["l_rtt_key"]
-                l_rtt = self.containers[cur_key]["rtt"]
-                for key, attrs in self.containers.items():
-                    query = f'select mean("value") from rtt where ("host" = \'{key}\') and time > now() - 3s fill(0) limit 1'
-                    query_res = await client.query(query)
-                    series = query_res["results"][0].get("series")
-                    if series:
-                        values = series[0].get("values")
-                        point = float(values[0][-1])
-                        self.containers[key]["rtt"] = point
-                        # if current path is down, steer away
-                        if point == 0.0:
-                            if log_flag and key == cur_key:
-                                log.info("Current path is down! Steering away.")
-                                log_flag = False
-                            self.containers[key]["rtt"] = self.c_params["max_rtt"]
-                await asyncio.sleep(self.frequency)
+                tick_start = time.perf_counter()
+                with self.timer.time("read"):
+                    if self.aggregator:
+                        pairs = self.optimizer.read_stream(
+                            self.aggregator, self.rtt_stat
+                        )
+                    else:
+                        pairs = await self._read_lanes_influx(client)
+                if self.optimizer.forecaster and pairs:
+                    with self.timer.time("forecast"):
+                        self.optimizer.forecast()
                 # optimize
-                log.debug(f"current_lowest {self.containers[cur_key]['rtt']}")
-
-                # find lowest first
-                for key, attrs in self.containers.items():
-                    # if the latency is lower, update lowest rtt key
-                    if attrs["rtt"] * 1.20 < l_rtt and attrs["rtt"] > 0:
-                        cur_key = key
-                        l_rtt = attrs["rtt"]
-                if self.c_params["l_rtt_key"] != cur_key:
-                    log_flag = True
-                    evc_path = self.containers[cur_key]["evc_path"]
-                    log.info(f"changing to lane #{evc_path}")
-                    self.c_params["l_rtt_key"] = cur_key
-
-                    async with aiohttp.ClientSession() as session:
-                        my_str = f"http://{self.http_server}:{self.http_port}/{self.endpoint}/{evc_path}"
-                        print(my_str)
-                        data = await self.http_post(session, my_str)
-                        log.info(data)
+                for pair in pairs:
+                    with self.timer.time("decision"):
+                        path = self.optimizer.decide(pair)
+                    if path is None:
+                        continue
+                    log.info(f"changing {pair.name} to lane #{path}")
+                    # the changeover blocks on the switches, so it runs off the loop
+                    with self.timer.time("changeover"):
+                        await self.loop.run_in_executor(
+                            None, self._change_lane, pair.lanes[path]
+                        )
+                self.timer.observe("tick", (time.perf_counter() - tick_start) * 1e3)
+                if self.ingest and self.loop.time() >= next_rates:
+                    self.ingest.send_rates(self.optimizer.rates.rates())
+                    next_rates = self.loop.time() + settings.probe_rate_interval
+                if settings.latency_influx and self.loop.time() >= next_latency:
+                    await self._write_latency(client)
+                    next_latency = self.loop.time() + settings.latency_interval
+                await self._wait_tick()
 
             except aiohttp.client_exceptions.ClientConnectorError as e:
-                log.error(f"HTTP server {self.http_server} connection refused")
+                log.error(f"InfluxDB server {self.db_server} connection refused")
                 return
 
     def execute(self) -> None:
         """Execute."""
         log.info("Starting uvloop")
+        self.timeline["execute"] = round(time.monotonic() - self.t_setup, 6)
         self.loop = uvloop.new_event_loop()
         asyncio.set_event_loop(self.loop)
-        self._wait_all_dpids(self.dpids)
+        # switches that completed their handshake before this NApp was loaded
+        for dpid in self.dpids:
+            switch = self.controller.get_switch_by_dpid(dpid)
+            if switch and switch.is_connected():
+                self.switch_ready(dpid)
         self.loop.run_until_complete(self.main_coroutine())
 
     def shutdown(self) -> None:
         """Shutdown the napp."""
+        self.flow_pusher.shutdown()
+        self.all_ready.set()
         if self.loop:
             self.run_flag = False
             time.sleep(1)
             self.loop.close()
 
-    def _wait_all_dpids(self, dpids: List[str]) -> None:
-        """Wait until all dpids have connected.
-
-        :dpids: List of switch dpids
-
-        """
-
-        log.info("Waiting for all dpids to connect")
-        connected = False
-        while not connected:
-            if self.controller.switches.keys():
-                for dpid in dpids:
-                    if dpid not in self.controller.switches.keys():
-                        break
-                    if dpid in self.controller.switches.keys():
-                        if not self.controller.switches[dpid].is_connected():
-                            break
-                connected = True
-            time.sleep(1)
-        log.info("All dpids have connected")
-        time.sleep(3)  # after handshake
-        for dpid in dpids:
-            self.provision_evcs_dpid(dpid)
-
-    def _provision_bb_evcs(self, dpid: str) -> Response:
-        """Provision Backbone Ethernet Virtual Circuits for this dpid.
+    def switch_ready(self, dpid: str) -> None:
+        """Provision a dpid as soon as its handshake is complete.
 
         :dpid: Switch dpid
 
         """
-        fmods = []
-        for nni, vlan in zip(self.bb_sws["nni_ofnums"], self.bb_sws["nni_vlans"]):
-            # tagged
-            fmod = self.prepare_flow_mod(
-                in_interface=self.bb_sws["uni_ofnum"],
-                out_interface=nni,
-                in_vlan=vlan,
-                out_vlan=vlan,
-            )
-            fmods.append(fmod)
-            # tagged
-            fmod_opposite = self.prepare_flow_mod(
-                in_interface=nni,
-                out_interface=self.bb_sws["uni_ofnum"],
-                in_vlan=vlan,
-                out_vlan=vlan,
-            )
-            fmods.append(fmod_opposite)
-        response = self.send_flow_mods(dpid, fmods)
-        if response.status_code != 200:
-            log.error("Response {}".format(response.text))
-        return response
-
-    def _provision_edge_evcs(self, dpid: str) -> Response:
-        """Provision Backbone Ethernet Virtual Circuits on this dpid.
+        self._mark(dpid, "handshake")
+        self.provision_evcs_dpid(dpid)
 
-        :dpid: Switch dpid
+    def _mark(self, dpid: str, stage: str) -> None:
+        """Record when a dpid first reached a startup stage.
 
+        Times are seconds since setup. Once every dpid has been provisioned,
+        the decision loop is released.
         """
-        fmods = []
-        unis = []
-        # containers probes
-        unis.extend(self.edge_sws["uni_ofnums"])
-        # host ofnum
-        unis.append(self.edge_host_ofnum)
-
-        nnis_vlans = []
-        nnis_vlans.extend(self.edge_sws["nni_vlans"])
-        nnis_vlans.append(self.bb_host_vlan)
-
-        for uni, vlan in zip(unis, nnis_vlans):
-            # untagged
-            fmod = self.prepare_flow_mod(
-                in_interface=uni,
-                out_interface=self.edge_sws["nni_ofnum"],
-                push=True,
-                out_vlan=vlan,
-            )
-            fmods.append(fmod)
-            # pop
-            fmod_opposite = self.prepare_flow_mod(
-                in_interface=self.edge_sws["nni_ofnum"],
-                out_interface=uni,
-                in_vlan=vlan,
-                pop=True,
-            )
-            fmods.append(fmod_opposite)
-        response = self.send_flow_mods(dpid, fmods)
-        if response.status_code != 200:
-            log.error("Response {}".format(response.text))
-        return response
-
-    def _provision_host_bb_evc(self, dpid: str, path: int = 1) -> Response:
-        """Provision Backbone Ethernet Virtual Circuit of the Host on this dpid.
-
-        :dpid: Switch dpid
-        :path: int 1, 2, or 3
-
+        now = round(time.monotonic() - self.t_setup, 6)
+        with self._timeline_lock:
+            stages = self.timeline["dpids"].setdefault(dpid, {})
+            if stage in stages:
+                return
+            stages[stage] = now
+            if self.all_ready.is_set() or stage != "provisioned":
+                return
+            for other in self.dpids:
+                if "provisioned" not in self.timeline["dpids"].get(other, {}):
+                    return
+            self.timeline["all_provisioned"] = now
+        log.info(f"All dpids have been provisioned {now}s after setup")
+        self.all_ready.set()
+
+    def _fast_change_lane(
+        self, pair: DTNPair, lane: Lane
+    ) -> Dict[str, Dict[str, float]]:
+        """Change the host EVC of a pair to another lane over the fast path.
+
+        New flows get the other host EVC priority, so they're installed side
+        by side with the current ones before these are deleted.
         """
-        fmods = []
-        vlan = self.bb_host_vlan
-        # tagged
-        fmod = self.prepare_flow_mod(
-            in_interface=self.bb_edge_uni_ofnum,
-            out_interface=int(path) + self.bb_edge_uni_ofnum,
-            in_vlan=vlan,
-            out_vlan=vlan,
-        )
-        fmods.append(fmod)
-        # tagged
-        fmod_opposite = self.prepare_flow_mod(
-            in_interface=int(path) + self.bb_edge_uni_ofnum,
-            out_interface=self.bb_edge_uni_ofnum,
-            in_vlan=vlan,
-            out_vlan=vlan,
+        new_prio = self.network.other_priority(pair.host_prio)
+        new_flows = self.network.host_flows(lane, new_prio)
+        old_flows = self.network.host_flows(pair.active_lane, pair.host_prio)
+        timings = self.fast_path.replace(
+            {dpid: fset.flows for dpid, fset in new_flows.items()},
+            {dpid: fset.flows for dpid, fset in old_flows.items()},
         )
-        fmods.append(fmod_opposite)
-        response = self.send_flow_mods(dpid, fmods)
-        if response.status_code != 200:
-            log.error("Response {}".format(response.text))
-        return response
+        for dpid, timing in timings.items():
+            self.timer.observe(f"fastpath_install.{dpid}", timing["install_ms"])
+            self.timer.observe(f"fastpath_total.{dpid}", timing["total_ms"])
+        pair.host_prio = new_prio
+        return timings
 
-    def provision_evcs_dpid(self, dpid: str) -> None:
+    def provision_evcs_dpid(self, dpid: str) -> Optional[Future]:
         """Provision Ethernet Virtual Circuits (EVCs) for each pre-defined dpid
 
+        The flows are pushed in the background, it returns the push future.
+
         :dpid: Switch dpid
 
         """
-        response = None
-        if dpid in self.bb_sws["dpids"]:
-            response = self._provision_bb_evcs(dpid)
-            response = self._provision_host_bb_evc(dpid)
-        elif dpid in self.edge_sws["dpids"]:
-            response = self._provision_edge_evcs(dpid)
-        if response:
-            log.info("Switch {} Response {}".format(dpid, response.status_code))
-        else:
+        if dpid not in self.network.dpids():
             log.error("dpid {} not found".format(dpid))
+            return None
+        flows = merge(self.network.dpid_flows(dpid))
 
-    @staticmethod
-    def prepare_flow_mod(
-        in_interface, out_interface, in_vlan=None, out_vlan=None, push=False, pop=False
-    ) -> Dict[str, Any]:
-        """Prepare flow mod for sigle-tag EVCs."""
-        default_action = {"action_type": "output", "port": out_interface}
-
-        flow_mod = {"match": {"in_port": in_interface}, "actions": [default_action]}
-        if in_vlan:
-            flow_mod["match"]["dl_vlan"] = in_vlan
-        if out_vlan:
-            new_action = {"action_type": "set_vlan", "vlan_id": out_vlan}
-            flow_mod["actions"].insert(0, new_action)
-        if push:
-            new_action = {"action_type": "push_vlan", "tag_type": 1}
-            flow_mod["actions"].insert(0, new_action)
-        if pop:
-            new_action = {"action_type": "pop_vlan"}
-            flow_mod["actions"].insert(0, new_action)
-        return flow_mod
+        def log_response(future: Future) -> None:
+            try:
+                response = future.result()
+            except requests.exceptions.RequestException as e:
+                log.error("Switch {} provisioning failed: {}".format(dpid, e))
+                return
+            if response.status_code != 200:
+                log.error("Response {}".format(response.text))
+                return
+            self._mark(dpid, "provisioned")
+            log.info("Switch {} Response {}".format(dpid, response.status_code))
 
-    @staticmethod
-    def send_flow_mods(switch, flow_mods) -> Response:
-        """Send a flow_mod list to a specific switch."""
-        endpoint = "%s/flows/%s" % (settings.FMNGR_URL, switch)
+        future = self.flow_pusher.submit(dpid, flows)
+        future.add_done_callback(log_response)
+        return future
 
-        data = {"flows": flow_mods}
-        return requests.post(endpoint, json=data)
+    prepare_flow_mod = staticmethod(prepare_flow_mod)
+
+    def send_flow_mods(self, switch, flow_mods) -> Response:
+        """Send a flow_mod list to a specific switch."""
+        return self.flow_pusher.push(switch, flow_mods)
 
-    def _activate_host_evc(self, dpid, cvlan) -> Response:
+    def _activate_host_evc(self, dpid, cvlan, pair: str = None) -> Response:
         """Activate the host EVPL cvlan
 
         :dpid: Switch dpid
         :cvlan: customer vlan (int)
+        :pair: DTN pair whose edge is dpid, defaults to the first pair
         """
+        dtn_pair = self.network.pairs[pair or self.default_pair]
+        edge = next(edge for edge in dtn_pair.edges if edge.dpid == dpid)
         fmods = []
         # untagged
         fmod = self.prepare_flow_mod(
-            in_interface=self.edge_host_ofnum,
-            out_interface=self.bb_edge_nni_ofnum,
+            in_interface=edge.host_port,
+            out_interface=edge.uplink_port,
             push=True,
             out_vlan=cvlan,
         )
         fmods.append(fmod)
         # pop
         fmod_opposite = self.prepare_flow_mod(
-            in_interface=self.bb_edge_nni_ofnum,
-            out_interface=self.edge_host_ofnum,
+            in_interface=edge.uplink_port,
+            out_interface=edge.host_port,
             in_vlan=cvlan,
             pop=True,
         )
@@ -365,25 +503,376 @@ class Main(KytosNApp):
             log.error("Response {}".format(response.text))
         return response
 
+    @staticmethod
+    def _link(link) -> Link:
+        """Make a Link of a kytos/topology link."""
+        return Link(
+            link.id,
+            link.endpoint_a.switch.dpid,
+            link.endpoint_a.port_number,
+            link.endpoint_b.switch.dpid,
+            link.endpoint_b.port_number,
+            float(link.metadata.get("cost", 1.0)),
+        )
+
+    def route_pairs(self) -> None:
+        """Set the hops of the lanes of the dynamic pairs from their paths.
+
+        The paths come from the cache, so only the pairs whose paths have been
+        invalidated or whose edges got linked elsewhere are moved, and lanes
+        whose path still exists stay on it, see paths.assign. The flows of
+        the hops that a lane has left are deleted and the dpids of its new
+        hops are provisioned.
+
+        Lanes are moved on the decision loop, after the failovers scheduled
+        before, so a failed lane is failed over before it loses its hops.
+        """
+        self._on_loop(self._route_pairs)
+
+    def _route_pairs(self) -> None:
+        """Move the lanes of the dynamic pairs, see route_pairs."""
+        moved: Set[str] = set()
+        stale: Dict[str, List[Dict]] = defaultdict(list)
+        with self._topology_lock:
+            for pair in self.network.pairs.values():
+                if not pair.dynamic:
+                    continue
+                ends = tuple(
+                    self.paths.neighbor(edge.dpid, edge.uplink_port)
+                    for edge in pair.edges
+                )
+                paths = []
+                if None not in ends:
+                    paths = self.paths.paths(
+                        ends[0][0], ends[1][0], {edge.dpid for edge in pair.edges}
+                    )
+                last = self._routes.get(pair.name)
+                if last and last[0] == ends and last[1] is paths:
+                    continue
+                self._routes[pair.name] = (ends, paths)
+                candidates = [hops(path, ends[0][1], ends[1][1]) for path in paths]
+                assigned = assign(
+                    {index: lane.hops for index, lane in pair.lanes.items()},
+                    candidates,
+                )
+                for index, lane in pair.lanes.items():
+                    lane_hops = assigned[index]
+                    if lane_hops == lane.hops:
+                        continue
+                    for dpid, flows in self.network.set_hops(lane, lane_hops).items():
+                        stale[dpid].extend(flows)
+                    moved.update(lane.dpids)
+                    lane.down = not lane_hops
+                    log.info(f"{lane} hops {lane_hops}")
+
+        for dpid, flows in list(stale.items()):
+            # flows with the same match are overwritten by the new ones
+            matches = [
+                flow["match"]
+                for fset in self.network.dpid_flows(dpid)
+                for flow in fset.flows
+            ]
+            stale[dpid] = [flow for flow in flows if flow["match"] not in matches]
+        # deleting and pushing flows blocks on flow_manager, so it's off the loop
+        if self.loop is not None and self.loop.is_running():
+            self.loop.run_in_executor(None, self._push_routes, stale, moved)
+        else:
+            self._push_routes(stale, moved)
+
+    def _push_routes(self, stale: Dict[str, List[Dict]], moved: Set[str]) -> None:
+        """Delete the stale flows of the moved lanes and provision their dpids."""
+        for dpid, flows in stale.items():
+            if not flows:
+                continue
+            try:
+                self.flow_pusher.delete(dpid, flows)
+            except requests.exceptions.RequestException as e:
+                log.error("Switch {} stale flows deletion failed: {}".format(dpid, e))
+        for dpid in moved:
+            switch = self.controller.get_switch_by_dpid(dpid)
+            if switch and switch.is_connected():
+                self.provision_evcs_dpid(dpid)
+
     @rest("/changelane/<path>", methods=["POST"])
     def change_lane(self, path) -> tuple:
-        """Change the application EVC to another path.
+        """Change the application EVC of the first DTN pair to another path.
 
-        :path: path number either 1, 2, or 3
+        :path: lane number of the first DTN pair
         """
+        return self.change_pair_lane(self.default_pair, path)
 
-        if int(path) not in range(1, 4):
-            return jsonify({"response": "path number should be 1, 2 or 3"}), 404
+    @rest("/changelane/<pair>/<path>", methods=["POST"])
+    def change_pair_lane(self, pair, path) -> tuple:
+        """Change the application EVC of a DTN pair to another path.
 
-        response = None
-        for dpid in self.bb_sws["dpids"]:
-            response = self._provision_host_bb_evc(dpid, int(path))
-            if response.status_code != 200:
-                log.error("Response {}".format(response.text))
-                return jsonify({"response": response.text}), 404
-        log.info("changed to lane #{}".format(path))
+        :pair: DTN pair name
+        :path: lane number
+        """
+        try:
+            lane = self.network.lane(pair, int(path))
+        except ValueError:
+            lane = None
+        if lane is None:
+            return jsonify({"response": f"{pair} has no lane {path}"}), 404
+        with self.timer.time("changeover"):
+            body, status = self._change_lane(lane)
+        return jsonify(body), status
+
+    def _change_lane(self, lane: Lane) -> Tuple[Dict[str, Any], int]:
+        """Move the application EVC of a DTN pair to one of its lanes.
+
+        It returns the response body and status code.
+        """
+        dtn_pair = lane.pair
+        pair = dtn_pair.name
+        path = lane.index
+        with self._lane_lock:
+            # a changeover decided before its lane failed is dropped
+            if lane.failed:
+                return {"response": f"{pair} lane #{path} has failed"}, 409
+            if self.fast_path:
+                try:
+                    changeover = self._fast_change_lane(dtn_pair, lane)
+                except FastPathError as e:
+                    log.warning(f"Fast path failed, falling back to flow_manager: {e}")
+                else:
+                    dtn_pair.active = path
+                    log.info(f"changed {pair} to lane #{path} changeover {changeover}")
+                    return (
+                        {
+                            "response": f"changed {pair} to lane #{path}",
+                            "changeover": changeover,
+                        },
+                        200,
+                    )
+
+            try:
+                responses = self.flow_pusher.push_many(
+                    self.network.host_flows(lane, dtn_pair.host_prio)
+                )
+            except requests.exceptions.RequestException as e:
+                log.error("Lane change failed: {}".format(e))
+                return {"response": str(e)}, 404
+            for response in responses.values():
+                if response.status_code != 200:
+                    log.error("Response {}".format(response.text))
+                    return {"response": response.text}, 404
+            dtn_pair.active = path
+        log.info("changed {} to lane #{}".format(pair, path))
+
+        return {"response": "changed {} to lane #{}".format(pair, path)}, 200
+
+    def _on_loop(self, func, *args) -> None:
+        """Call func on the decision loop, or right away if it isn't running.
+
+        Kytos event handlers run on their own threads, so the lane, damper
+        and optimizer state that the decision loop reads and changes between
+        awaits is only changed from the loop.
+        """
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(func, *args)
+        else:
+            func(*args)
+
+    def _call_on_loop(self, func, *args) -> Any:
+        """Call func on the decision loop and wait for what it returns.
 
-        return jsonify({"response": "changed to lane #{}".format(path)}), 200
+        It's called right away if the loop isn't running, and exceptions are
+        raised to the caller either way.
+        """
+        if self.loop is None or not self.loop.is_running():
+            return func(*args)
+
+        async def call() -> Any:
+            return func(*args)
+
+        return asyncio.run_coroutine_threadsafe(call(), self.loop).result()
+
+    def fail_over(self, dpid: str, port: int) -> None:
+        """Mark the lanes through a port as failed and move their pairs away.
+
+        Pairs whose active lane goes through the port are moved to their
+        standby lane right away, without waiting for the probes. It's done on
+        the decision loop, so it doesn't race with the lane decisions.
+
+        :dpid: Switch dpid
+        :port: port number
+
+        """
+        self._on_loop(self._fail_over, dpid, port)
+
+    def _fail_over(self, dpid: str, port: int) -> None:
+        """Fail over the lanes through a port, see fail_over."""
+        for lane in self.network.lanes_at(dpid, port):
+            lane.failed = True
+            self._update_lane(lane, None)
+            pair = lane.pair
+            if pair.active != lane.index:
+                continue
+            backup = pair.backup()
+            if backup is None:
+                log.error(f"{pair.name} has no lane to fail over to")
+                continue
+            self.optimizer.force_switch(pair)
+            log.info(f"{lane} failed on {dpid}:{port}, failing over to {backup}")
+            # the changeover blocks on the switches, so it runs off the loop
+            if self.loop is not None and self.loop.is_running():
+                self.loop.run_in_executor(None, self._fail_over_to, backup)
+            else:
+                self._fail_over_to(backup)
+
+    def _fail_over_to(self, lane: Lane) -> None:
+        """Change a pair to its backup lane."""
+        with self.timer.time("failover"):
+            self._change_lane(lane)
+
+    def restore(self, dpid: str, port: int) -> None:
+        """Clear the failed flag of the lanes through a port."""
+        self._on_loop(self._restore, dpid, port)
+
+    def _restore(self, dpid: str, port: int) -> None:
+        """Clear the failed flag of the lanes through a port, see restore."""
+        for lane in self.network.lanes_at(dpid, port):
+            lane.failed = False
+
+    @rest("/pairs", methods=["GET"])
+    def list_pairs(self) -> tuple:
+        """List the DTN pairs, their active lane and lanes."""
+        pairs = {
+            name: {
+                "active": pair.active,
+                "standby": pair.standby,
+                "host_vlan": pair.host_vlan,
+                "lanes": {
+                    index: {
+                        "probe": lane.probe,
+                        "vlan": lane.vlan,
+                        "dpids": lane.dpids,
+                        "rtt": lane.rtt,
+                        "pkt_loss": lane.pkt_loss,
+                        "jitter": lane.jitter,
+                        "down": lane.down,
+                        "failed": lane.failed,
+                        "forecast": self.optimizer.forecasts.get(lane.probe),
+                    }
+                    for index, lane in pair.lanes.items()
+                },
+            }
+            for name, pair in self.network.pairs.items()
+        }
+        return jsonify(pairs), 200
+
+    @rest("/pairs/<name>", methods=["POST"])
+    def create_pair(self, name) -> tuple:
+        """Add a DTN pair, the body has its edges and lanes as on settings.py.
+
+        The dpids of the new pair are provisioned right away.
+        """
+        try:
+            self._call_on_loop(self._create_pair, name, request.get_json())
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            return jsonify({"response": str(e)}), 400
+        return jsonify({"response": f"{name} created"}), 201
+
+    def _create_pair(self, name: str, attrs: Dict[str, Any]) -> DTNPair:
+        """Add a DTN pair, route it and provision its dpids, see create_pair."""
+        pair = self.add_pair(name, attrs)
+        if pair.dynamic:
+            self._route_pairs()
+        dpids = {edge.dpid for edge in pair.edges}
+        for lane in pair.lanes.values():
+            dpids.update(lane.dpids)
+        for dpid in dpids:
+            switch = self.controller.get_switch_by_dpid(dpid)
+            if switch and switch.is_connected():
+                self.provision_evcs_dpid(dpid)
+        return pair
+
+    @rest("/stats/switching", methods=["GET"])
+    def switching_stats(self) -> tuple:
+        """Lane switches and suppressed switches counters of each pair."""
+        dampers = self.optimizer.dampers
+        return jsonify({name: damper.status() for name, damper in dampers.items()}), 200
+
+    @rest("/probes/rates", methods=["GET"])
+    def probe_rates(self) -> tuple:
+        """Probes per second of each lane."""
+        return jsonify(self.optimizer.rates.rates()), 200
+
+    @rest("/stats/latency", methods=["GET"])
+    def latency_stats(self) -> tuple:
+        """Count, mean, min, max, p50, p90 and p99 of each stage, in ms."""
+        return jsonify(self.timer.snapshot()), 200
+
+    @rest("/stats/latency", methods=["DELETE"])
+    def reset_latency_stats(self) -> tuple:
+        """Reset the latency histograms."""
+        self.timer.reset()
+        return jsonify({"response": "reset"}), 200
+
+    @rest("/stats/startup", methods=["GET"])
+    def startup_stats(self) -> tuple:
+        """Startup timeline, in seconds since setup."""
+        return jsonify(self.timeline), 200
+
+    @rest("/samples", methods=["POST"])
+    def ingest_samples(self) -> tuple:
+        """Ingest probe samples, one ``<host> <rtt_ms>`` per line."""
+        if not self.aggregator or not self.loop:
+            return jsonify({"response": "streaming ingest is disabled"}), 404
+        self.loop.call_soon_threadsafe(self.aggregator.ingest, request.get_data())
+        return jsonify({"response": "accepted"}), 202
+
+    @listen_to("kytos/of_core.v0x04.messages.in.ofpt_barrier_reply")
+    def on_barrier_reply(self, event: KytosEvent) -> None:
+        """Confirm the fast path barrier requests."""
+        if self.fast_path:
+            self.fast_path.barrier_reply(event.content["message"].header.xid.value)
+
+    @listen_to("kytos/topology.updated")
+    def on_topology_updated(self, event: KytosEvent) -> None:
+        """Sync the paths graph with the active links of the topology."""
+        topology = event.content.get("topology")
+        if topology is None:
+            return
+        links = [
+            self._link(link) for link in topology.links.values() if link.is_active()
+        ]
+        with self._topology_lock:
+            self.paths.sync(links)
+        self.route_pairs()
+
+    @listen_to("kytos/topology.link_up")
+    def on_link_up(self, event: KytosEvent) -> None:
+        """Add a link to the paths graph."""
+        link = event.content["link"]
+        for endpoint in (link.endpoint_a, link.endpoint_b):
+            self.restore(endpoint.switch.dpid, endpoint.port_number)
+        with self._topology_lock:
+            self.paths.add_link(self._link(link))
+        self.route_pairs()
+
+    @listen_to("kytos/topology.link_down")
+    def on_link_down(self, event: KytosEvent) -> None:
+        """Fail over the lanes of a link and remove it from the paths graph."""
+        link = event.content["link"]
+        for endpoint in (link.endpoint_a, link.endpoint_b):
+            self.fail_over(endpoint.switch.dpid, endpoint.port_number)
+        with self._topology_lock:
+            self.paths.remove_link(link.id)
+        self.route_pairs()
+
+    @listen_to("kytos/of_core.switch.interface.link_down")
+    def on_interface_down(self, event: KytosEvent) -> None:
+        """Fail over the lanes of a port that went down."""
+        interface = event.content["interface"]
+        self.fail_over(interface.switch.dpid, interface.port_number)
+
+    @listen_to("kytos/of_core.switch.interface.link_up")
+    def on_interface_up(self, event: KytosEvent) -> None:
+        """Clear the failed flag of the lanes of a port that came back."""
+        interface = event.content["interface"]
+        self.restore(interface.switch.dpid, interface.port_number)
 
     @listen_to("kytos/of_core.handshake_complete")
     def update_topology(self, event: KytosEvent) -> None:
@@ -393,6 +882,4 @@ class Main(KytosNApp):
         if "switch" not in event.content:
             return
 
-        switch = event.content["switch"]
-        time.sleep(3)  # after handshake
-        self.provision_evcs_dpid(switch.dpid)
+        self.switch_ready(event.content["switch"].dpid)
@@ -0,0 +1,131 @@
+"""Latency histograms of the dvel stages."""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+
+class Histogram(object):
+
+    """Log-scaled histogram of latencies in ms.
+
+    Buckets grow by resolution, so percentiles have a bounded relative error
+    and adding a value is O(1) regardless of how many have been added.
+    """
+
+    def __init__(
+        self, resolution: float = 0.02, min_value: float = 1e-3, max_value: float = 1e6
+    ) -> None:
+        """Constructor of Histogram.
+
+        :resolution: relative error of the buckets
+        :min_value: values below it fall in the first bucket
+        :max_value: values above it fall in the last bucket
+
+        """
+        self.min_value = min_value
+        self._log_base = math.log1p(resolution)
+        self._n_buckets = int(math.log(max_value / min_value) / self._log_base) + 2
+        self._buckets = [0] * self._n_buckets
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def _bucket(self, value: float) -> int:
+        """Bucket index of a value."""
+        if value <= self.min_value:
+            return 0
+        index = int(math.log(value / self.min_value) / self._log_base) + 1
+        return min(index, self._n_buckets - 1)
+
+    def add(self, value: float) -> None:
+        """Add a value in ms."""
+        self._buckets[self._bucket(value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Approximate q percentile, q in [0, 100]."""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * q / 100.0))
+        seen = 0
+        for index, count in enumerate(self._buckets):
+            seen += count
+            if seen >= rank:
+                if index == 0:
+                    return self.min
+                value = self.min_value * math.exp(index * self._log_base)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Count, mean, min, max and p50, p90, p99."""
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else None,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+        }
+
+
+class StageTimer(object):
+
+    """Latency histograms of named stages, safe to use from any thread."""
+
+    def __init__(self) -> None:
+        """Constructor of StageTimer."""
+        self.histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, ms: float) -> None:
+        """Add a latency in ms to a stage."""
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = Histogram()
+                self.histograms[stage] = histogram
+            histogram.add(ms)
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        """Time a block as a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, (time.perf_counter() - start) * 1e3)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Summary of each stage."""
+        with self._lock:
+            return {stage: hist.as_dict() for stage, hist in self.histograms.items()}
+
+    def reset(self) -> None:
+        """Drop every histogram."""
+        with self._lock:
+            self.histograms = {}
+
+    def points(self, measurement: str = "dvel_latency") -> List[Dict[str, Any]]:
+        """Summaries as InfluxDB points, tagged by stage."""
+        timestamp = time.time_ns()
+        return [
+            {
+                "measurement": measurement,
+                "tags": {"stage": stage},
+                "fields": {k: float(v) for k, v in summary.items() if v is not None},
+                "time": timestamp,
+            }
+            for stage, summary in self.snapshot().items()
+            if summary["count"]
+        ]
@@ -0,0 +1,472 @@
+"""DTN pairs, lanes and their flows."""
+
+import heapq
+from collections import defaultdict, namedtuple
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from napps.viniarck.dvel.flowpusher import FlowSet, flow_set
+from napps.viniarck.dvel.scoring import LaneMetrics
+
+# backbone hop of a lane, in_port faces the first edge of the pair
+Hop = namedtuple("Hop", "dpid in_port out_port")
+# edge switch of a DTN pair, where its host and probes are connected
+Edge = namedtuple("Edge", "dpid host_port uplink_port")
+
+
+def prepare_flow_mod(
+    in_interface,
+    out_interface,
+    in_vlan=None,
+    out_vlan=None,
+    push=False,
+    pop=False,
+    priority=None,
+) -> Dict[str, Any]:
+    """Prepare flow mod for sigle-tag EVCs."""
+    default_action = {"action_type": "output", "port": out_interface}
+
+    flow_mod = {"match": {"in_port": in_interface}, "actions": [default_action]}
+    if priority:
+        flow_mod["priority"] = priority
+    if in_vlan:
+        flow_mod["match"]["dl_vlan"] = in_vlan
+    if out_vlan:
+        new_action = {"action_type": "set_vlan", "vlan_id": out_vlan}
+        flow_mod["actions"].insert(0, new_action)
+    if push:
+        new_action = {"action_type": "push_vlan", "tag_type": 1}
+        flow_mod["actions"].insert(0, new_action)
+    if pop:
+        new_action = {"action_type": "pop_vlan"}
+        flow_mod["actions"].insert(0, new_action)
+    return flow_mod
+
+
+class Allocator(object):
+
+    """Allocate the lowest free number of a range, such as VLANs or ports."""
+
+    def __init__(self, first: int, last: int, name: str = "") -> None:
+        """Constructor of Allocator."""
+        self.first = first
+        self.last = last
+        self.name = name
+        self._next = first
+        self._free: List[int] = []
+
+    def allocate(self) -> int:
+        """Allocate a number, it raises ValueError if the range is exhausted."""
+        if self._free:
+            return heapq.heappop(self._free)
+        if self._next > self.last:
+            raise ValueError(f"{self.name} range {self.first}-{self.last} is exhausted")
+        value = self._next
+        self._next += 1
+        return value
+
+    def release(self, value: int) -> None:
+        """Give a number back."""
+        heapq.heappush(self._free, value)
+
+
+class Lane(object):
+
+    """Candidate path of a DTN pair and its latest metrics."""
+
+    __slots__ = (
+        "pair",
+        "index",
+        "vlan",
+        "hops",
+        "probe",
+        "probe_ports",
+        "bandwidth",
+        "rtt",
+        "pkt_loss",
+        "jitter",
+        "down",
+        "failed",
+    )
+
+    def __init__(
+        self,
+        pair: "DTNPair",
+        index: int,
+        vlan: int,
+        hops: List[Hop],
+        probe: str,
+        probe_ports: Tuple[int, int],
+        bandwidth: float = 0.0,
+        rtt: float = 1.0e4,
+    ) -> None:
+        """Constructor of Lane.
+
+        :index: lane number within its pair, starting at 1
+        :probe: host tag of the samples of this lane
+        :probe_ports: probe ports on the first and second edges
+        :bandwidth: lane bandwidth in Mbps, 0 if it's unknown
+
+        down is set from the probes and failed from link and port events.
+        """
+        self.pair = pair
+        self.index = index
+        self.vlan = vlan
+        self.hops = hops
+        self.probe = probe
+        self.probe_ports = probe_ports
+        self.bandwidth = bandwidth
+        self.rtt = rtt
+        self.pkt_loss = 0.0
+        self.jitter = 0.0
+        self.down = False
+        self.failed = False
+
+    @property
+    def dpids(self) -> List[str]:
+        """Backbone dpids of this lane."""
+        return [hop.dpid for hop in self.hops]
+
+    def metrics(self) -> LaneMetrics:
+        """LaneMetrics of this lane."""
+        return LaneMetrics(self.rtt, self.pkt_loss, self.jitter, self.bandwidth)
+
+    def __repr__(self) -> str:
+        """Lane representation."""
+        return f"Lane({self.pair.name}#{self.index}, probe={self.probe})"
+
+
+class DTNPair(object):
+
+    """Pair of DTNs, the host EVC between them and its candidate lanes."""
+
+    __slots__ = (
+        "name",
+        "edges",
+        "host_vlan",
+        "lanes",
+        "active",
+        "host_prio",
+        "dynamic",
+        "standby",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        edges: Tuple[Edge, Edge],
+        host_vlan: int,
+        host_prio: int,
+        dynamic: bool = False,
+    ) -> None:
+        """Constructor of DTNPair.
+
+        :dynamic: whether the hops of the lanes are computed from the topology
+
+        """
+        self.name = name
+        self.edges = edges
+        self.host_vlan = host_vlan
+        self.lanes: Dict[int, Lane] = {}
+        self.active = 1
+        self.host_prio = host_prio
+        self.dynamic = dynamic
+        self.standby: Optional[int] = None
+
+    @property
+    def active_lane(self) -> Lane:
+        """Lane currently used by the host EVC."""
+        return self.lanes[self.active]
+
+    def backup(self) -> Optional[Lane]:
+        """Lane to fail over to, the standby or else the first lane that is up."""
+        standby = self.lanes.get(self.standby)
+        if standby is not None and standby.index != self.active and not standby.down:
+            return standby
+        for lane in self.lanes.values():
+            if lane.index != self.active and not lane.down:
+                return lane
+        return None
+
+    def __repr__(self) -> str:
+        """DTNPair representation."""
+        return f"DTNPair({self.name}, lanes={len(self.lanes)})"
+
+
+class Network(object):
+
+    """DTN pairs, their lanes and the indexes used to provision them.
+
+    Adding or removing a pair only touches its own lanes and the flow caches
+    of the dpids it goes through, and a dpid is provisioned from the pairs
+    and lanes indexed on it, so nothing here grows with the total number of
+    EVCs.
+    """
+
+    def __init__(
+        self,
+        vlan_range: Tuple[int, int] = (100, 4094),
+        probe_port_start: int = 3,
+        host_priorities: Tuple[int, int] = (0x8000, 0x8001),
+    ) -> None:
+        """Constructor of Network.
+
+        :vlan_range: VLANs allocated to the lanes and host EVCs
+        :probe_port_start: first edge port allocated to the probes
+        :host_priorities: host EVC flow priorities, they alternate on changes
+
+        """
+        self.vlans = Allocator(*vlan_range, name="VLAN")
+        self.probe_port_start = probe_port_start
+        self.host_priorities = host_priorities
+        self.pairs: Dict[str, DTNPair] = {}
+        self.lanes_by_probe: Dict[str, Lane] = {}
+        self.pairs_by_dpid: Dict[str, Set[DTNPair]] = defaultdict(set)
+        self.lanes_by_dpid: Dict[str, Set[Lane]] = defaultdict(set)
+        self._ports: Dict[str, Allocator] = {}
+        self._static: Dict[str, FlowSet] = {}
+        self._host: Dict[Tuple[str, int, int], Dict[str, FlowSet]] = {}
+
+    def _port_allocator(self, dpid: str) -> Allocator:
+        """Probe port allocator of an edge dpid."""
+        if dpid not in self._ports:
+            self._ports[dpid] = Allocator(
+                self.probe_port_start, 0xFFFFFEFF, name=f"{dpid} probe port"
+            )
+        return self._ports[dpid]
+
+    def add_pair(
+        self, name: str, edges: Iterable[Dict], lanes: Iterable[Dict]
+    ) -> DTNPair:
+        """Add a DTN pair and allocate the VLANs and probe ports of its lanes.
+
+        :edges: two dicts with the dpid, host_port and uplink_port of each edge
+        :lanes: dicts with the probe, hops and optionally bandwidth of each lane,
+            when none of them has hops, the pair is dynamic and they're set
+            later with set_hops
+
+        """
+        if name in self.pairs:
+            raise ValueError(f"DTN pair {name} already exists")
+        edges = tuple(Edge(**edge) for edge in edges)
+        if len(edges) != 2:
+            raise ValueError(f"DTN pair {name} should have two edges")
+        lanes = list(lanes)
+        probes = [attrs["probe"] for attrs in lanes]
+        lane_hops = [[Hop(*hop) for hop in attrs.get("hops", ())] for attrs in lanes]
+        bandwidths = [float(attrs.get("bandwidth", 0.0)) for attrs in lanes]
+        for probe in probes:
+            if probe in self.lanes_by_probe or probes.count(probe) > 1:
+                raise ValueError(f"probe {probe} is already used")
+        dynamic = not any(lane_hops)
+        pair = DTNPair(name, edges, 0, self.host_priorities[0], dynamic)
+        # nothing is registered until every VLAN and probe port is allocated
+        vlans: List[int] = []
+        ports: List[Tuple[Allocator, int]] = []
+        try:
+            for _ in range(len(lanes) + 1):
+                vlans.append(self.vlans.allocate())
+            for _ in lanes:
+                for edge in edges:
+                    allocator = self._port_allocator(edge.dpid)
+                    ports.append((allocator, allocator.allocate()))
+        except ValueError:
+            for vlan in vlans:
+                self.vlans.release(vlan)
+            for allocator, port in ports:
+                allocator.release(port)
+            raise
+        for index, probe in enumerate(probes, 1):
+            lane = Lane(
+                pair,
+                index,
+                vlans[index - 1],
+                lane_hops[index - 1],
+                probe,
+                tuple(port for _, port in ports[2 * index - 2 : 2 * index]),
+                bandwidths[index - 1],
+            )
+            pair.lanes[index] = lane
+            self.lanes_by_probe[lane.probe] = lane
+            for dpid in lane.dpids:
+                self.lanes_by_dpid[dpid].add(lane)
+                self._static.pop(dpid, None)
+        pair.host_vlan = vlans[-1]
+        self.pairs[name] = pair
+        for edge in edges:
+            self.pairs_by_dpid[edge.dpid].add(pair)
+            self._static.pop(edge.dpid, None)
+        return pair
+
+    def remove_pair(self, name: str) -> DTNPair:
+        """Remove a DTN pair and release its VLANs and probe ports."""
+        pair = self.pairs.pop(name)
+        for lane in pair.lanes.values():
+            del self.lanes_by_probe[lane.probe]
+            self.vlans.release(lane.vlan)
+            for edge, port in zip(pair.edges, lane.probe_ports):
+                self._ports[edge.dpid].release(port)
+            for dpid in lane.dpids:
+                self.lanes_by_dpid[dpid].discard(lane)
+                self._static.pop(dpid, None)
+            for priority in self.host_priorities:
+                self._host.pop((name, lane.index, priority), None)
+        self.vlans.release(pair.host_vlan)
+        for edge in pair.edges:
+            self.pairs_by_dpid[edge.dpid].discard(pair)
+            self._static.pop(edge.dpid, None)
+        return pair
+
+    def set_hops(self, lane: Lane, hops: List[Hop]) -> Dict[str, List[Dict[str, Any]]]:
+        """Move a lane to other hops.
+
+        It returns the flows of the hops that the lane has left, per dpid, so
+        they can be deleted.
+        """
+        stale: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+        pair = lane.pair
+        for hop in lane.hops:
+            if hop in hops:
+                continue
+            stale[hop.dpid].extend(self._hop_flows(hop, lane.vlan))
+            if pair.active == lane.index:
+                stale[hop.dpid].extend(
+                    self._hop_flows(hop, pair.host_vlan, pair.host_prio)
+                )
+        for dpid in lane.dpids:
+            self.lanes_by_dpid[dpid].discard(lane)
+            self._static.pop(dpid, None)
+        lane.hops = list(hops)
+        lane.failed = False
+        for dpid in lane.dpids:
+            self.lanes_by_dpid[dpid].add(lane)
+            self._static.pop(dpid, None)
+        for priority in self.host_priorities:
+            self._host.pop((pair.name, lane.index, priority), None)
+        return stale
+
+    def lanes_at(self, dpid: str, port: int) -> List[Lane]:
+        """Lanes whose hops go through a port."""
+        return [
+            lane
+            for lane in self.lanes_by_dpid.get(dpid, ())
+            if any(
+                hop.dpid == dpid and port in (hop.in_port, hop.out_port)
+                for hop in lane.hops
+            )
+        ]
+
+    def dpids(self) -> Set[str]:
+        """All the dpids that have dvel flows."""
+        dpids = {dpid for dpid, pairs in self.pairs_by_dpid.items() if pairs}
+        dpids.update(dpid for dpid, lanes in self.lanes_by_dpid.items() if lanes)
+        return dpids
+
+    def lane(self, pair: str, index: int) -> Optional[Lane]:
+        """Get a lane, None if it doesn't exist."""
+        dtn_pair = self.pairs.get(pair)
+        if dtn_pair is None:
+            return None
+        return dtn_pair.lanes.get(index)
+
+    @staticmethod
+    def _edge_flows(pair: DTNPair, side: int) -> List[Dict[str, Any]]:
+        """Flows of a pair on one of its edges, the lanes probes and the host."""
+        edge = pair.edges[side]
+        unis = [(lane.probe_ports[side], lane.vlan) for lane in pair.lanes.values()]
+        unis.append((edge.host_port, pair.host_vlan))
+        fmods = []
+        for uni, vlan in unis:
+            # untagged
+            fmods.append(
+                prepare_flow_mod(
+                    in_interface=uni,
+                    out_interface=edge.uplink_port,
+                    push=True,
+                    out_vlan=vlan,
+                )
+            )
+            # pop
+            fmods.append(
+                prepare_flow_mod(
+                    in_interface=edge.uplink_port,
+                    out_interface=uni,
+                    in_vlan=vlan,
+                    pop=True,
+                )
+            )
+        return fmods
+
+    @staticmethod
+    def _hop_flows(hop: Hop, vlan: int, priority: int = None) -> List[Dict[str, Any]]:
+        """Tagged flows of a VLAN on a backbone hop, both directions."""
+        return [
+            prepare_flow_mod(
+                in_interface=hop.in_port,
+                out_interface=hop.out_port,
+                in_vlan=vlan,
+                out_vlan=vlan,
+                priority=priority,
+            ),
+            prepare_flow_mod(
+                in_interface=hop.out_port,
+                out_interface=hop.in_port,
+                in_vlan=vlan,
+                out_vlan=vlan,
+                priority=priority,
+            ),
+        ]
+
+    def static_flows(self, dpid: str) -> FlowSet:
+        """Flows of a dpid that don't depend on the active lanes, cached.
+
+        These are the edge flows of the pairs on this dpid and the flows of
+        every lane that goes through it.
+        """
+        if dpid not in self._static:
+            fmods = []
+            for pair in self.pairs_by_dpid.get(dpid, ()):
+                for side, edge in enumerate(pair.edges):
+                    if edge.dpid == dpid:
+                        fmods.extend(self._edge_flows(pair, side))
+            for lane in self.lanes_by_dpid.get(dpid, ()):
+                for hop in lane.hops:
+                    if hop.dpid == dpid:
+                        fmods.extend(self._hop_flows(hop, lane.vlan))
+            self._static[dpid] = flow_set(fmods)
+        return self._static[dpid]
+
+    def host_flows(self, lane: Lane, priority: int) -> Dict[str, FlowSet]:
+        """Host EVC flows of a pair over one of its lanes, per dpid, cached."""
+        key = (lane.pair.name, lane.index, priority)
+        if key not in self._host:
+            per_dpid: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+            for hop in lane.hops:
+                per_dpid[hop.dpid].extend(
+                    self._hop_flows(hop, lane.pair.host_vlan, priority)
+                )
+            self._host[key] = {
+                dpid: flow_set(fmods) for dpid, fmods in per_dpid.items()
+            }
+        return self._host[key]
+
+    def dpid_flows(self, dpid: str) -> List[FlowSet]:
+        """All the FlowSets of a dpid, including the active host EVCs."""
+        flow_sets = [self.static_flows(dpid)]
+        for lane in self.lanes_by_dpid.get(dpid, ()):
+            pair = lane.pair
+            if pair.active == lane.index:
+                flow_sets.append(self.host_flows(lane, pair.host_prio)[dpid])
+        return flow_sets
+
+    def precompute(self) -> None:
+        """Build the flow caches of every dpid, lane and host priority."""
+        for dpid in self.dpids():
+            self.static_flows(dpid)
+        for pair in self.pairs.values():
+            for lane in pair.lanes.values():
+                for priority in self.host_priorities:
+                    self.host_flows(lane, priority)
+
+    def other_priority(self, priority: int) -> int:
+        """The other host EVC priority."""
+        return self.host_priorities[1 - self.host_priorities.index(priority)]
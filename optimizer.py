@@ -0,0 +1,160 @@
+"""Lane selection of dvel, apart from the probes, InfluxDB and the switches."""
+
+import time
+from typing import Any, Dict, Optional, Set, Tuple
+
+from napps.viniarck.dvel.aggregator import StreamAggregator
+from napps.viniarck.dvel.damping import SwitchDamper
+from napps.viniarck.dvel.model import DTNPair, Lane, Network
+from napps.viniarck.dvel.ratecontrol import ProbeRateController, switch_gaps
+from napps.viniarck.dvel.scoring import LaneMetrics, Policy, select_lane
+
+
+class LaneOptimizer(object):
+
+    """Turn lane samples into lane switch decisions.
+
+    It keeps the lane metrics, the flap damper of each pair, the probe rates
+    and the forecasts, but it doesn't do any I/O: the NApp feeds it what the
+    probes report and applies the lanes it picks, and the simulator drives it
+    the same way on a virtual clock, which every method takes as now.
+    """
+
+    def __init__(
+        self,
+        network: Network,
+        policy: Policy,
+        max_rtt: float = 1.0e4,
+        damping: Optional[Dict[str, Any]] = None,
+        rates: Optional[ProbeRateController] = None,
+        forecaster=None,
+    ) -> None:
+        """Constructor of LaneOptimizer.
+
+        :max_rtt: rtt of a lane that is down or hasn't been measured yet
+        :damping: SwitchDamper params of each pair
+        :rates: probe rates, updated with the urgency of the lanes
+        :forecaster: optional forecast.Forecaster of the lane metrics
+
+        """
+        self.network = network
+        self.policy = policy
+        self.max_rtt = max_rtt
+        self.damping = damping or {}
+        self.rates = rates or ProbeRateController()
+        self.forecaster = forecaster
+        self.forecasts: Dict[str, Tuple[float, float]] = {}
+        self.dampers: Dict[str, SwitchDamper] = {}
+
+    def add_pair(self, pair: DTNPair) -> None:
+        """Start optimizing a pair of the network."""
+        for lane in pair.lanes.values():
+            lane.rtt = self.max_rtt
+            self.rates.add(lane.probe)
+        self.dampers[pair.name] = SwitchDamper(**self.damping)
+
+    def update(
+        self,
+        lane: Lane,
+        rtt: Optional[float],
+        pkt_loss: Optional[float] = None,
+        jitter: Optional[float] = None,
+        now: Optional[float] = None,
+    ) -> bool:
+        """Update the metrics of a lane, a lane without rtt is down.
+
+        It returns whether the lane has just gone down.
+        """
+        now = time.monotonic() if now is None else now
+        was_down = lane.down
+        lane.down = lane.failed or not rtt
+        if lane.down:
+            lane.rtt = self.max_rtt
+            lane.pkt_loss = 1.0
+            if not was_down:
+                self.rates.boost(lane.probe, now)
+            return not was_down
+        lane.rtt = rtt
+        if pkt_loss is not None:
+            lane.pkt_loss = pkt_loss
+        if jitter is not None:
+            lane.jitter = jitter
+        if self.forecaster:
+            self.forecaster.add(lane.probe, now, rtt, lane.pkt_loss)
+        return False
+
+    def read_stream(
+        self, aggregator: StreamAggregator, stat: str, now: Optional[float] = None
+    ) -> Set[DTNPair]:
+        """Update the lanes whose pushed samples changed since the last call.
+
+        It returns the pairs of these lanes, so the work of a tick only grows
+        with the lanes that have news.
+
+        :stat: rtt statistic of the lanes, see LaneStats.get
+
+        """
+        now = time.monotonic() if now is None else now
+        pairs = set()
+        for probe in aggregator.pop_dirty(now):
+            lane = self.network.lanes_by_probe.get(probe)
+            stats = aggregator.lanes.get(probe)
+            if lane is None or stats is None:
+                continue
+            stats.expire(now)
+            self.update(lane, stats.get(stat), stats.loss_rate, stats.jitter, now)
+            pairs.add(lane.pair)
+        return pairs
+
+    def forecast(self) -> None:
+        """Refresh the forecasts of the lanes."""
+        if self.forecaster:
+            self.forecasts = self.forecaster.predict()
+
+    def metrics(self, lane: Lane) -> LaneMetrics:
+        """Metrics of a lane, made worse by its forecast when it's higher.
+
+        Forecasts only make lanes look worse, so traffic moves ahead of a
+        predicted degradation but not to a lane only predicted to recover.
+        """
+        metrics = lane.metrics()
+        forecast = self.forecasts.get(lane.probe)
+        if forecast is None or lane.down:
+            return metrics
+        rtt, loss = forecast
+        return metrics._replace(rtt=max(metrics.rtt, rtt), loss=max(metrics.loss, loss))
+
+    def decide(self, pair: DTNPair, now: Optional[float] = None) -> Optional[int]:
+        """Pick the lane of a pair, it returns the new lane or None to stay.
+
+        The caller is expected to change the pair to the returned lane.
+        """
+        now = time.monotonic() if now is None else now
+        costs = {
+            index: self.policy.cost(self.metrics(lane))
+            for index, lane in pair.lanes.items()
+        }
+        standby = [
+            index
+            for index, lane in pair.lanes.items()
+            if index != pair.active and not lane.down
+        ]
+        pair.standby = min(standby, key=costs.get) if standby else None
+        damper = self.dampers[pair.name]
+        gaps = switch_gaps(costs, pair.active, damper.hysteresis)
+        for index, lane in pair.lanes.items():
+            self.rates.update(lane.probe, lane.rtt, lane.jitter, gaps[index])
+        best = select_lane(costs, pair.active, margin=0.0)
+        if best == pair.active or not damper.allow(
+            costs[pair.active], costs[best], down=pair.active_lane.down, now=now
+        ):
+            return None
+        damper.switched(now)
+        return best
+
+    def force_switch(self, pair: DTNPair, now: Optional[float] = None) -> None:
+        """Record a switch that skipped the damping, e.g. a failover."""
+        now = time.monotonic() if now is None else now
+        damper = self.dampers[pair.name]
+        damper.allow(self.max_rtt, 0.0, down=True, now=now)
+        damper.switched(now)
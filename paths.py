@@ -0,0 +1,287 @@
+"""Candidate paths of the lanes over the backbone topology."""
+
+import heapq
+import math
+from collections import defaultdict, namedtuple
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+from napps.viniarck.dvel.model import Hop
+
+# undirected link between two switch ports
+Link = namedtuple("Link", "id dpid_a port_a dpid_b port_b cost")
+Link.__new__.__defaults__ = (1.0,)
+# link traversed from a dpid and port to another dpid and port
+Step = namedtuple("Step", "link_id src src_port dst dst_port")
+# cache key, the source and destination dpids and the excluded dpids
+PathKey = Tuple[str, str, FrozenSet[str]]
+
+
+def hops(steps: List[Step], in_port: int, out_port: int) -> List[Hop]:
+    """Backbone hops of a path.
+
+    :steps: links of the path, empty when it's a single switch
+    :in_port: port of the first switch facing the first edge
+    :out_port: port of the last switch facing the second edge
+
+    """
+    if not steps:
+        return []
+    result = [Hop(steps[0].src, in_port, steps[0].src_port)]
+    for prev, step in zip(steps, steps[1:]):
+        result.append(Hop(step.src, prev.dst_port, step.src_port))
+    result.append(Hop(steps[-1].dst, steps[-1].dst_port, out_port))
+    return result
+
+
+def assign(
+    current: Dict[int, List[Hop]], candidates: List[List[Hop]]
+) -> Dict[int, List[Hop]]:
+    """Hops of each lane of a pair given the candidate hops of its paths.
+
+    Lanes whose hops are still a candidate keep them, so a topology change
+    doesn't move the lanes on unaffected paths. The other lanes take the
+    candidates left, shortest first in lane order, and lanes left without
+    one get no hops.
+
+    :current: hops of each lane, by lane index
+    :candidates: hops of each path, shortest first
+
+    """
+    free = list(range(len(candidates)))
+    assigned: Dict[int, List[Hop]] = {}
+    for index in sorted(current):
+        lane_hops = current[index]
+        for i in free:
+            if lane_hops and candidates[i] == lane_hops:
+                assigned[index] = lane_hops
+                free.remove(i)
+                break
+    for index in sorted(current):
+        if index not in assigned:
+            assigned[index] = candidates[free.pop(0)] if free else []
+    return assigned
+
+
+class _Entry(object):
+
+    """Cached paths of a key and the distances used to invalidate them."""
+
+    __slots__ = ("paths", "costs", "dist_src", "dist_dst", "links")
+
+    def __init__(
+        self,
+        paths: List[List[Step]],
+        costs: List[float],
+        dist_src: Dict[str, float],
+        dist_dst: Dict[str, float],
+    ) -> None:
+        """Constructor of _Entry."""
+        self.paths = paths
+        self.costs = costs
+        self.dist_src = dist_src
+        self.dist_dst = dist_dst
+        self.links = {step.link_id for path in paths for step in path}
+
+
+class PathCache(object):
+
+    """k shortest link-disjoint paths between dpids, cached per link.
+
+    Paths are found by successive shortest paths, removing the links of the
+    previous ones. A removed link only invalidates the entries whose paths
+    go through it. An added link only invalidates the entries that have
+    fewer than k paths or for which the shortest path through the new link,
+    bounded by the distances of the initial search, is shorter than their
+    longest path, so topology events don't trigger a full graph search.
+    The distances of the entries that an added link doesn't invalidate are
+    lowered through it, so the next added links are bounded correctly.
+    """
+
+    def __init__(self, k: int = 3) -> None:
+        """Constructor of PathCache.
+
+        :k: number of paths between each pair of dpids
+
+        """
+        self.k = k
+        self.links: Dict[str, Link] = {}
+        self.adj: Dict[str, Dict[str, Link]] = defaultdict(dict)
+        self._ports: Dict[Tuple[str, int], Tuple[str, int]] = {}
+        self._entries: Dict[PathKey, _Entry] = {}
+        self._by_link: Dict[str, Set[PathKey]] = defaultdict(set)
+        self.counters = {"hits": 0, "misses": 0, "invalidated": 0}
+
+    def neighbor(self, dpid: str, port: int) -> Optional[Tuple[str, int]]:
+        """The dpid and port on the other end of a port, if it's linked."""
+        return self._ports.get((dpid, port))
+
+    def _invalidate(self, keys: Iterable[PathKey]) -> Set[PathKey]:
+        """Drop cached entries."""
+        keys = set(keys)
+        for key in keys:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                continue
+            for link_id in entry.links:
+                self._by_link[link_id].discard(key)
+            self.counters["invalidated"] += 1
+        return keys
+
+    def add_link(self, link: Link) -> Set[PathKey]:
+        """Add or update a link, it returns the invalidated keys."""
+        invalidated = set()
+        if link.id in self.links:
+            if self.links[link.id] == link:
+                return invalidated
+            invalidated |= self.remove_link(link.id)
+        self.links[link.id] = link
+        self.adj[link.dpid_a][link.id] = link
+        self.adj[link.dpid_b][link.id] = link
+        self._ports[(link.dpid_a, link.port_a)] = (link.dpid_b, link.port_b)
+        self._ports[(link.dpid_b, link.port_b)] = (link.dpid_a, link.port_a)
+
+        stale = []
+        for key, entry in self._entries.items():
+            if link.dpid_a in key[2] or link.dpid_b in key[2]:
+                continue
+            if len(entry.paths) < self.k:
+                stale.append(key)
+                continue
+            src, dst = entry.dist_src, entry.dist_dst
+            bound = link.cost + min(
+                src.get(link.dpid_a, math.inf) + dst.get(link.dpid_b, math.inf),
+                src.get(link.dpid_b, math.inf) + dst.get(link.dpid_a, math.inf),
+            )
+            if bound < entry.costs[-1]:
+                stale.append(key)
+            else:
+                # a later link may only improve the entry through this one
+                self._relax(src, link, key[2])
+                self._relax(dst, link, key[2])
+        return invalidated | self._invalidate(stale)
+
+    def _relax(
+        self, dist: Dict[str, float], link: Link, exclude: FrozenSet[str]
+    ) -> None:
+        """Lower the distances of a shortest path tree after adding a link."""
+        heap = []
+        for node, other in ((link.dpid_a, link.dpid_b), (link.dpid_b, link.dpid_a)):
+            cost = dist.get(node, math.inf) + link.cost
+            if other not in exclude and cost < dist.get(other, math.inf):
+                dist[other] = cost
+                heap.append((cost, other))
+        heapq.heapify(heap)
+        while heap:
+            cost, node = heapq.heappop(heap)
+            if cost > dist[node]:
+                continue
+            for adj_link in self.adj[node].values():
+                other = adj_link.dpid_b if adj_link.dpid_a == node else adj_link.dpid_a
+                new_cost = cost + adj_link.cost
+                if other not in exclude and new_cost < dist.get(other, math.inf):
+                    dist[other] = new_cost
+                    heapq.heappush(heap, (new_cost, other))
+
+    def remove_link(self, link_id: str) -> Set[PathKey]:
+        """Remove a link, it returns the invalidated keys."""
+        link = self.links.pop(link_id, None)
+        if link is None:
+            return set()
+        self.adj[link.dpid_a].pop(link_id, None)
+        self.adj[link.dpid_b].pop(link_id, None)
+        self._ports.pop((link.dpid_a, link.port_a), None)
+        self._ports.pop((link.dpid_b, link.port_b), None)
+        return self._invalidate(self._by_link.pop(link_id, ()))
+
+    def sync(self, links: Iterable[Link]) -> Set[PathKey]:
+        """Make the graph match a full list of links, only applying the diff."""
+        links = {link.id: link for link in links}
+        invalidated = set()
+        for link_id in set(self.links) - set(links):
+            invalidated |= self.remove_link(link_id)
+        for link in links.values():
+            invalidated |= self.add_link(link)
+        return invalidated
+
+    def _dijkstra(
+        self,
+        src: str,
+        dst: Optional[str],
+        exclude: FrozenSet[str],
+        used: Set[str],
+    ) -> Tuple[Dict[str, float], Dict[str, Step]]:
+        """Shortest path tree from src, it stops at dst if it's set."""
+        dist = {src: 0.0}
+        prev: Dict[str, Step] = {}
+        heap = [(0.0, src)]
+        while heap:
+            cost, node = heapq.heappop(heap)
+            if cost > dist[node]:
+                continue
+            if node == dst:
+                break
+            for link in self.adj[node].values():
+                if link.id in used:
+                    continue
+                if link.dpid_a == node:
+                    step = Step(link.id, node, link.port_a, link.dpid_b, link.port_b)
+                else:
+                    step = Step(link.id, node, link.port_b, link.dpid_a, link.port_a)
+                if step.dst in exclude:
+                    continue
+                new_cost = cost + link.cost
+                if new_cost < dist.get(step.dst, math.inf):
+                    dist[step.dst] = new_cost
+                    prev[step.dst] = step
+                    heapq.heappush(heap, (new_cost, step.dst))
+        return dist, prev
+
+    @staticmethod
+    def _path(prev: Dict[str, Step], src: str, dst: str) -> List[Step]:
+        """Walk a shortest path tree back from dst."""
+        steps = []
+        node = dst
+        while node != src:
+            step = prev[node]
+            steps.append(step)
+            node = step.src
+        steps.reverse()
+        return steps
+
+    def paths(
+        self, src: str, dst: str, exclude: Iterable[str] = ()
+    ) -> List[List[Step]]:
+        """k shortest link-disjoint paths from src to dst, shortest first.
+
+        :exclude: dpids that the paths can't go through
+
+        """
+        key = (src, dst, frozenset(exclude))
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.counters["hits"] += 1
+            return entry.paths
+        self.counters["misses"] += 1
+
+        paths: List[List[Step]] = []
+        costs: List[float] = []
+        if src == dst:
+            paths.append([])
+            costs.append(0.0)
+            dist_src = dist_dst = {src: 0.0}
+        else:
+            dist_src, prev = self._dijkstra(src, None, key[2], set())
+            dist_dst, _ = self._dijkstra(dst, None, key[2], set())
+            used: Set[str] = set()
+            while len(paths) < self.k and dst in prev:
+                path = self._path(prev, src, dst)
+                paths.append(path)
+                costs.append(sum(self.links[step.link_id].cost for step in path))
+                used.update(step.link_id for step in path)
+                _, prev = self._dijkstra(src, dst, key[2], used)
+
+        entry = _Entry(paths, costs, dist_src, dist_dst)
+        self._entries[key] = entry
+        for link_id in entry.links:
+            self._by_link[link_id].add(key)
+        return paths
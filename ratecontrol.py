@@ -0,0 +1,151 @@
+"""Adaptive probe rates of the dvel lanes."""
+
+import math
+import time
+from typing import Dict, Optional
+
+
+def switch_gaps(
+    costs: Dict[str, float], active: str, hysteresis: float = 0.2
+) -> Dict[str, float]:
+    """Relative distance of each lane to triggering a lane switch.
+
+    A lane triggers a switch when its cost, increased by the hysteresis, is
+    lower than the cost of the active lane. The active lane is as close as
+    its closest contender.
+
+    :costs: lane costs, keyed like active
+    :active: active lane
+
+    """
+    cur = costs[active]
+    gaps = {}
+    for lane, cost in costs.items():
+        if lane == active:
+            continue
+        if math.isinf(cost) or math.isinf(cur) or cur <= 0:
+            gaps[lane] = math.inf
+        else:
+            gaps[lane] = abs(cost * (1 + hysteresis) - cur) / cur
+    gaps[active] = min(gaps.values(), default=math.inf)
+    return gaps
+
+
+class _LaneState(object):
+
+    """Latest urgency inputs of a lane."""
+
+    __slots__ = ("variability", "gap", "boost_until")
+
+    def __init__(self) -> None:
+        """Constructor of _LaneState."""
+        self.variability = 0.0
+        self.gap = math.inf
+        self.boost_until = 0.0
+
+
+class ProbeRateController(object):
+
+    """Spread a global probes per second budget over the lanes.
+
+    Each lane gets a share of the budget proportional to its urgency, which
+    is 1 plus its variability (jitter over rtt), how close it is to
+    triggering a lane switch and a boost for boost_time seconds after a
+    failure. Every lane gets min_rate and the rest of the budget is spread by
+    urgency, up to max_rate, so a stable lane far from the best one is probed
+    slowly while the total never exceeds the budget.
+    """
+
+    def __init__(
+        self,
+        budget: float = 2000.0,
+        min_rate: float = 10.0,
+        max_rate: float = 1000.0,
+        closeness: float = 0.1,
+        boost: float = 8.0,
+        boost_time: float = 5.0,
+    ) -> None:
+        """Constructor of ProbeRateController.
+
+        :budget: probes per second of all the lanes together
+        :min_rate: min probes per second of a lane
+        :max_rate: max probes per second of a lane
+        :closeness: switch gap at which the closeness term is halved
+        :boost: urgency added after a failure
+        :boost_time: seconds that a failure boost lasts
+
+        """
+        self.budget = budget
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.closeness = closeness
+        self.boost_weight = boost
+        self.boost_time = boost_time
+        self.lanes: Dict[str, _LaneState] = {}
+
+    def add(self, lane: str) -> None:
+        """Start scheduling a lane."""
+        self.lanes.setdefault(lane, _LaneState())
+
+    def remove(self, lane: str) -> None:
+        """Stop scheduling a lane."""
+        self.lanes.pop(lane, None)
+
+    def update(
+        self, lane: str, rtt: float, jitter: float, gap: Optional[float] = None
+    ) -> None:
+        """Update the variability and switch gap of a lane.
+
+        :gap: relative distance to a lane switch, see switch_gaps
+
+        """
+        state = self.lanes.get(lane)
+        if state is None:
+            return
+        state.variability = jitter / rtt if rtt > 0 else 0.0
+        if gap is not None:
+            state.gap = gap
+
+    def boost(self, lane: str, now: Optional[float] = None) -> None:
+        """Probe a lane faster for a while, e.g. after a failure."""
+        now = time.monotonic() if now is None else now
+        state = self.lanes.get(lane)
+        if state is not None:
+            state.boost_until = now + self.boost_time
+
+    def urgency(self, state: _LaneState, now: float) -> float:
+        """Urgency of a lane, at least 1."""
+        urgency = 1.0 + state.variability
+        if not math.isinf(state.gap):
+            urgency += 1.0 / (1.0 + state.gap / self.closeness)
+        if now < state.boost_until:
+            urgency += self.boost_weight
+        return urgency
+
+    def rates(self, now: Optional[float] = None) -> Dict[str, float]:
+        """Probes per second of each lane."""
+        now = time.monotonic() if now is None else now
+        if not self.lanes:
+            return {}
+        min_rate = min(self.min_rate, self.budget / len(self.lanes))
+        rates = {lane: min_rate for lane in self.lanes}
+        spare = self.budget - min_rate * len(rates)
+        weights = {
+            lane: self.urgency(state, now) for lane, state in self.lanes.items()
+        }
+        while weights and spare > 0:
+            total = sum(weights.values())
+            capped = [
+                lane
+                for lane, weight in weights.items()
+                if spare * weight / total >= self.max_rate - rates[lane]
+            ]
+            if not capped:
+                for lane, weight in weights.items():
+                    rates[lane] += spare * weight / total
+                break
+            for lane in capped:
+                spare -= self.max_rate - rates[lane]
+                rates[lane] = self.max_rate
+                del weights[lane]
+        return rates
@@ -0,0 +1,46 @@
+"""Retention policies and downsampling of the probe points in InfluxDB."""
+
+from typing import List
+
+# measurement of the per interval rollups written by the probes
+ROLLUP = "rollup"
+# retention policy of the probe points, made the default one of the database
+RAW_RP = "dvel_raw"
+# retention policy of the rollups downsampled by the continuous query
+ROLLUP_RP = "dvel_rollup"
+# name of the continuous query
+ROLLUP_CQ = "dvel_rollup"
+
+
+def statements(db: str, raw: str, rollup: str, interval: str) -> List[str]:
+    """InfluxQL statements that set up the retention of a database.
+
+    The raw policy is created or altered and made the default one, so the
+    probe points expire after raw, and a continuous query downsamples the
+    rollups every interval into the rollup policy. The query is dropped and
+    created again, since they can't be altered. p99 of a downsampled point
+    is the max of the p99 of its rollups, an upper bound of the actual one.
+
+    :raw: InfluxQL duration of the probe points, e.g. 1d
+    :rollup: InfluxQL duration of the downsampled rollups, e.g. 52w
+    :interval: InfluxQL duration of each downsampled point, e.g. 1m
+
+    """
+    select = (
+        'SELECT min("min") AS "min", mean("mean") AS "mean", max("max") AS "max", '
+        'max("p99") AS "p99", mean("stddev") AS "stddev", '
+        'sum("count") AS "count", sum("sent") AS "sent", sum("lost") AS "lost", '
+        'sum("lost") / sum("sent") AS "loss" '
+        f'INTO "{ROLLUP_RP}"."{ROLLUP}" FROM "{RAW_RP}"."{ROLLUP}" '
+        f"GROUP BY time({interval}), *"
+    )
+    return [
+        f'CREATE RETENTION POLICY "{RAW_RP}" ON "{db}" '
+        f"DURATION {raw} REPLICATION 1 DEFAULT",
+        f'ALTER RETENTION POLICY "{RAW_RP}" ON "{db}" DURATION {raw} DEFAULT',
+        f'CREATE RETENTION POLICY "{ROLLUP_RP}" ON "{db}" '
+        f"DURATION {rollup} REPLICATION 1",
+        f'ALTER RETENTION POLICY "{ROLLUP_RP}" ON "{db}" DURATION {rollup}',
+        f'DROP CONTINUOUS QUERY "{ROLLUP_CQ}" ON "{db}"',
+        f'CREATE CONTINUOUS QUERY "{ROLLUP_CQ}" ON "{db}" BEGIN {select} END',
+    ]
@@ -0,0 +1,152 @@
+"""Lane scoring policies of dvel."""
+
+import math
+from collections import namedtuple
+from typing import Dict, Optional, Type
+
+# rtt and jitter in ms, loss as a ratio [0, 1] and bandwidth in Mbps, a
+# bandwidth of 0 or less is unknown and doesn't limit the lane
+LaneMetrics = namedtuple("LaneMetrics", "rtt loss jitter bandwidth")
+LaneMetrics.__new__.__defaults__ = (0.0, 0.0, 0.0)
+
+# constant of the Mathis et al. model, sqrt(3/2)
+MATHIS_C = math.sqrt(1.5)
+
+
+class Policy(object):
+
+    """Base class of the lane policies, the lane with the lowest cost wins."""
+
+    name = ""
+
+    def cost(self, metrics: LaneMetrics) -> float:
+        """Cost of a lane."""
+        raise NotImplementedError
+
+
+class LowestLatency(Policy):
+
+    """Prefer the lane with the lowest rtt, inflated by its loss rate."""
+
+    name = "lowest_latency"
+
+    def cost(self, metrics: LaneMetrics) -> float:
+        """The rtt over the delivery rate, a lane losing every probe costs inf."""
+        if metrics.loss >= 1.0:
+            return math.inf
+        return metrics.rtt / (1.0 - metrics.loss)
+
+
+class MaxThroughput(Policy):
+
+    """Prefer the lane with the highest estimated TCP throughput.
+
+    The estimate is the lowest of the lane bandwidth, the window limited
+    throughput and the Mathis et al. loss limited throughput,
+    MSS / RTT * C / sqrt(p).
+    """
+
+    name = "max_throughput"
+
+    def __init__(
+        self, mss: int = 1460, window: int = 32 * 2 ** 20, rtt_factor: float = 2.0
+    ) -> None:
+        """Constructor of MaxThroughput.
+
+        :mss: TCP maximum segment size in bytes
+        :window: max TCP window of the DTNs in bytes
+        :rtt_factor: the probes report half of the round trip time, so the
+            rtt is scaled by this factor
+
+        """
+        self.mss = mss
+        self.window = window
+        self.rtt_factor = rtt_factor
+
+    def throughput(self, metrics: LaneMetrics) -> float:
+        """Estimated TCP throughput of a lane in Mbps."""
+        bandwidth = metrics.bandwidth if metrics.bandwidth > 0 else math.inf
+        rtt = metrics.rtt * self.rtt_factor / 1e3
+        if rtt <= 0:
+            return bandwidth
+        bps = self.window * 8 / rtt
+        if metrics.loss > 0:
+            bps = min(bps, self.mss * 8 / rtt * MATHIS_C / math.sqrt(metrics.loss))
+        return min(bandwidth, bps / 1e6)
+
+    def cost(self, metrics: LaneMetrics) -> float:
+        """The cost is the time to transfer a megabit."""
+        throughput = self.throughput(metrics)
+        return 1.0 / throughput if throughput > 0 else math.inf
+
+
+class Weighted(Policy):
+
+    """Weighted sum of rtt, loss, jitter and bandwidth terms."""
+
+    name = "weighted"
+
+    def __init__(
+        self,
+        rtt: float = 1.0,
+        loss: float = 10.0,
+        jitter: float = 1.0,
+        bandwidth: float = 0.0,
+        ref_bandwidth: float = 1000.0,
+    ) -> None:
+        """Constructor of Weighted.
+
+        :rtt: weight of the rtt in ms
+        :loss: weight of the loss in percentage
+        :jitter: weight of the jitter in ms
+        :bandwidth: weight of ref_bandwidth / bandwidth, lanes of unknown
+            bandwidth don't get this term
+
+        """
+        self.w_rtt = rtt
+        self.w_loss = loss
+        self.w_jitter = jitter
+        self.w_bandwidth = bandwidth
+        self.ref_bandwidth = ref_bandwidth
+
+    def cost(self, metrics: LaneMetrics) -> float:
+        """Weighted cost of a lane."""
+        cost = (
+            self.w_rtt * metrics.rtt
+            + self.w_loss * metrics.loss * 100
+            + self.w_jitter * metrics.jitter
+        )
+        if self.w_bandwidth and metrics.bandwidth > 0:
+            cost += self.w_bandwidth * self.ref_bandwidth / metrics.bandwidth
+        return cost
+
+
+POLICIES: Dict[str, Type[Policy]] = {
+    policy.name: policy for policy in (LowestLatency, MaxThroughput, Weighted)
+}
+
+
+def make_policy(name: str, **params) -> Policy:
+    """Make a policy by its name."""
+    try:
+        return POLICIES[name](**params)
+    except KeyError:
+        raise ValueError(f"unknown policy {name}, options: {list(POLICIES)}")
+
+
+def select_lane(
+    costs: Dict[str, float], current: Optional[str], margin: float = 0.2
+) -> Optional[str]:
+    """Select the lowest cost lane.
+
+    The current lane is kept unless another one is better by more than
+    margin, e.g. 0.2 means 20%.
+    """
+    if not costs:
+        return current
+    best = min(costs, key=costs.get)
+    if current not in costs:
+        return best
+    if best != current and costs[best] * (1 + margin) < costs[current]:
+        return best
+    return current
@@ -3,31 +3,121 @@
 # Base URL of the Flow Manager endpoint
 FMNGR_URL = 'http://localhost:8181/api/kytos/flow_manager/v2'
 
-dpids = [
-    '00:00:00:00:00:00:00:01', '00:00:00:00:00:00:00:02',
-    '00:00:00:00:00:00:00:03', '00:00:00:00:00:00:00:04'
-]
-
-# kytos http server
-http_server = "localhost"
-# kytos http port
-http_port = "8181"
-# dvel endpoint
-endpoint = "api/viniarck/dvel/changelane"
+# concurrent pushes to flow_manager, each dpid is provisioned in parallel
+flow_push_workers = 8
+# retries of a failed push to flow_manager and their backoff factor in seconds
+flow_push_retries = 3
+flow_push_backoff = 0.1
+
+# DTN pairs. Each pair has two edge switches, where its hosts and probes are
+# connected, and its candidate lanes. A lane is probed by its own probe (the
+# host tag of its samples) and bandwidth is in Mbps. When no lane has hops, the
+# lanes follow the path_count shortest link-disjoint paths between the
+# switches linked to the uplinks of the edges, computed from kytos/topology.
+# Otherwise, hops are pinned as a list of [dpid, in_port, out_port], in_port
+# facing the first edge. VLANs and probe ports (from probe_port_start on each
+# edge) are allocated by dvel in lane order, the host EVC VLAN after the lanes
+# ones.
+pairs = {
+    "d1-d2": {
+        "edges": [
+            {"dpid": "00:00:00:00:00:00:00:01", "host_port": 1, "uplink_port": 2},
+            {"dpid": "00:00:00:00:00:00:00:02", "host_port": 1, "uplink_port": 2},
+        ],
+        "lanes": [
+            {"probe": "d3", "bandwidth": 1000.0},
+            {"probe": "d4", "bandwidth": 1000.0},
+            {"probe": "d5", "bandwidth": 1000.0},
+        ],
+    },
+}
+# number of link-disjoint paths computed for the dynamic pairs
+path_count = 3
+# VLANs allocated to the lanes and host EVCs
+vlan_range = (100, 4094)
+# first edge port of the probes
+probe_port_start = 3
+
+# change lanes sending FlowMods straight to the backbone switches instead of
+# going through flow_manager, it falls back to flow_manager on failures
+fast_path = True
+# max time to wait for the switches to confirm a fast path changeover, in seconds
+fast_path_timeout = 1.0
+# the host EVC alternates between these two flow priorities on every fast
+# path changeover, so new flows are installed before the old ones are deleted
+host_evc_priorities = (0x8000, 0x8001)
+
 # influx db server
 db_server = "localhost"
 # influx db name
 db_name = "dvel"
+# retention of the probe points in db_name, as InfluxQL durations: probe points
+# expire after raw, and a continuous query downsamples the per second rollups
+# of the probes every interval into points kept for rollup, which dashboards
+# over long ranges read. None leaves the retention policies of db_name alone.
+retention = {"raw": "1d", "rollup": "52w", "interval": "1m"}
+
+# probes push their samples to this UDP endpoint and lane statistics are
+# computed in-process. Set ingest_port to None to poll InfluxDB instead.
+ingest_addr = "0.0.0.0"
+ingest_port = 8099
+# sliding window of the lane statistics, in seconds
+window = 3.0
+# EWMA smoothing factor of the lane statistics
+ewma_alpha = 0.1
+# rtt statistic used to compare lanes: mean, ewma, min or a percentile, e.g. p90
+rtt_stat = "mean"
+
+# max number of concurrent InfluxDB lane queries when polling
+query_concurrency = 16
+# per lane query timeout, in seconds, a slow lane keeps its previous rtt
+query_timeout = 0.5
 
 # frequency to eval the async loop, 50ms
 frequency = 0.05
-# timeout to detect loss when sending requests to the db
-timeout = 3
-# container params
-c_params = {"l_rtt_key": "d3", "max_rtt": 1.0e4}
-# containers names and their respective lanes
-containers = {
-    "d3": {"rtt": 1.0e4, "pkt_loss": 0.0, "evc_path": 1},
-    "d4": {"rtt": 1.0e4, "pkt_loss": 0.0, "evc_path": 2},
-    "d5": {"rtt": 1.0e4, "pkt_loss": 0.0, "evc_path": 3},
+# with streaming ingest, the loop waits for new samples for up to max_tick
+# seconds between ticks instead of polling every frequency
+max_tick = 1.0
+# rtt of a lane that is down or hasn't been measured yet
+max_rtt = 1.0e4
+# lane scoring policy: lowest_latency, max_throughput or weighted, and its
+# params, e.g. {"mss": 8948, "window": 64 * 2 ** 20} for max_throughput
+policy = "lowest_latency"
+policy_params = {}
+# lane switch flap damping: a new lane must be better by hysteresis (20%),
+# the current lane is kept for at least min_dwell seconds, repeated flips
+# within flap_window seconds start an exponential hold-down (holddown doubled
+# on every flip up to holddown_max seconds) and there can't be more than
+# max_switches every budget_period seconds. Switching away from a down lane
+# is never damped.
+damping = {
+    "hysteresis": 0.2,
+    "min_dwell": 5.0,
+    "holddown": 2.0,
+    "holddown_max": 60.0,
+    "flap_window": 30.0,
+    "max_switches": 10,
+    "budget_period": 60.0,
 }
+
+# forecasting of the lane rtt and loss rate, which needs NumPy, None to disable.
+# Samples are kept every step seconds over window steps, forecast horizon
+# seconds ahead with Holt's linear trend (alpha and beta smoothing factors)
+# and checked for upward shifts with a CUSUM test (threshold and drift in
+# standard deviations). Lanes are scored with the worse of their metrics and
+# forecasts, e.g. {"step": 1.0, "window": 60, "horizon": 5.0}
+forecast = None
+
+# adaptive probe rates: probes per second of all lanes together (probe_budget)
+# spread by urgency, variability, closeness to a switch and recent failures,
+# between probe_rate_min and probe_rate_max per lane. Rates are sent back to
+# the probes over the ingest endpoint every probe_rate_interval seconds.
+probe_budget = 2000.0
+probe_rate_min = 10.0
+probe_rate_max = 1000.0
+probe_rate_interval = 1.0
+
+# write the stage latency histograms (GET /stats/latency) to InfluxDB every
+# latency_interval seconds
+latency_influx = False
+latency_interval = 10.0
@@ -0,0 +1,302 @@
+"""Offline simulation of the lane optimizer over recorded or synthetic traces.
+
+Probe samples of a pair are fed to the same aggregator and LaneOptimizer as
+the decision loop, on a virtual clock, without Kytos, the probes, InfluxDB
+or any network, so minutes of traffic run in seconds. From the directory
+that has the napps package:
+
+    python -m napps.viniarck.dvel.simulator --scenario mixed --duration 600
+    python -m napps.viniarck.dvel.simulator --trace samples.txt
+"""
+
+import argparse
+import bisect
+import json
+import math
+import random
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from napps.viniarck.dvel import settings
+from napps.viniarck.dvel.aggregator import StreamAggregator
+from napps.viniarck.dvel.metrics import Histogram
+from napps.viniarck.dvel.model import Network
+from napps.viniarck.dvel.optimizer import LaneOptimizer
+from napps.viniarck.dvel.ratecontrol import ProbeRateController
+from napps.viniarck.dvel.scoring import LaneMetrics, make_policy
+
+EDGES = (
+    {"dpid": "00:00:00:00:00:00:00:01", "host_port": 1, "uplink_port": 2},
+    {"dpid": "00:00:00:00:00:00:00:02", "host_port": 1, "uplink_port": 2},
+)
+
+
+class Trace(object):
+
+    """Synthetic rtt of a lane, a base rtt changed by timed events.
+
+    Events are delay steps, which add ms to the rtt, link flaps, which make
+    the lane lose every probe, and loss bursts, which lose probes at a rate.
+    """
+
+    def __init__(self, base: float, noise: float = 0.05, seed: Any = None) -> None:
+        """Constructor of Trace.
+
+        :base: rtt in ms
+        :noise: relative standard deviation of the samples
+        :seed: seed of the samples
+
+        """
+        self.base = base
+        self.noise = noise
+        self.rng = random.Random(seed)
+        self.delays: List[Tuple[float, float, float]] = []
+        self.losses: List[Tuple[float, float, float]] = []
+        self.flaps: List[Tuple[float, float, float, float]] = []
+
+    def delay_step(self, at: float, delta: float, until: float = math.inf) -> "Trace":
+        """Add delta ms to the rtt from at to until seconds."""
+        self.delays.append((at, until, delta))
+        return self
+
+    def flap(
+        self, start: float, period: float, down: float, until: float = math.inf
+    ) -> "Trace":
+        """Take the lane down for down seconds every period seconds."""
+        self.flaps.append((start, until, period, down))
+        return self
+
+    def loss_burst(self, at: float, duration: float, rate: float) -> "Trace":
+        """Lose probes at a rate for duration seconds."""
+        self.losses.append((at, at + duration, rate))
+        return self
+
+    def truth(self, t: float) -> Tuple[float, float]:
+        """rtt and loss rate of the lane at a time, without noise."""
+        rtt = self.base + sum(d for start, end, d in self.delays if start <= t < end)
+        for start, end, period, down in self.flaps:
+            if start <= t < end and (t - start) % period < down:
+                return rtt, 1.0
+        loss = max(
+            (rate for start, end, rate in self.losses if start <= t < end), default=0.0
+        )
+        return rtt, loss
+
+    def samples(
+        self, start: float, end: float, rate: float
+    ) -> Iterator[Tuple[float, Optional[float]]]:
+        """Samples of probes sent at rate per second in (start, end]."""
+        first = math.floor(start * rate) + 1
+        for n in range(first, math.floor(end * rate) + 1):
+            t = n / rate
+            rtt, loss = self.truth(t)
+            if self.rng.random() < loss:
+                yield t, None
+            else:
+                yield t, max(0.0, rtt * (1 + self.rng.gauss(0.0, self.noise)))
+
+
+class RecordedTrace(object):
+
+    """Recorded samples of a lane, its truth is the per second mean and loss."""
+
+    def __init__(self, samples: List[Tuple[float, Optional[float]]]) -> None:
+        """Constructor of RecordedTrace.
+
+        :samples: times in seconds and rtts in ms, None for lost probes
+
+        """
+        self.records = sorted(samples, key=lambda sample: sample[0])
+        self.times = [t for t, _ in self.records]
+        bins: Dict[int, List[Optional[float]]] = defaultdict(list)
+        for t, rtt in self.records:
+            bins[int(t)].append(rtt)
+        self.bins: Dict[int, Tuple[float, float]] = {}
+        for second, rtts in bins.items():
+            ok = [rtt for rtt in rtts if rtt is not None]
+            mean = sum(ok) / len(ok) if ok else settings.max_rtt
+            self.bins[second] = (mean, 1.0 - len(ok) / len(rtts))
+        self.end = self.times[-1] if self.times else 0.0
+
+    def truth(self, t: float) -> Tuple[float, float]:
+        """rtt and loss rate of the second of a time."""
+        return self.bins.get(int(t), (settings.max_rtt, 1.0))
+
+    def samples(
+        self, start: float, end: float, rate: float = 0.0
+    ) -> Iterator[Tuple[float, Optional[float]]]:
+        """Recorded samples in (start, end], rate is ignored."""
+        lo = bisect.bisect_right(self.times, start)
+        hi = bisect.bisect_right(self.times, end)
+        return iter(self.records[lo:hi])
+
+
+def load_trace(path: str) -> Dict[str, RecordedTrace]:
+    """Recorded traces of a file of ``<time_s> <host> <rtt_ms>`` lines.
+
+    A ``-`` rtt is a lost probe, as on the ingest format, and times are
+    shifted to start at 0.
+    """
+    samples: Dict[str, List[Tuple[float, Optional[float]]]] = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            t, host, value = line.split()
+            samples[host].append((float(t), None if value == "-" else float(value)))
+    start = min(t for lane in samples.values() for t, _ in lane)
+    return {
+        host: RecordedTrace([(t - start, rtt) for t, rtt in lane])
+        for host, lane in samples.items()
+    }
+
+
+def scenarios(seed: Any = None) -> Dict[str, Dict[str, Trace]]:
+    """Synthetic traces of three lanes."""
+    rng = random.Random(seed)
+
+    def lanes(*bases: float) -> List[Trace]:
+        """Traces of lanes with these base rtts."""
+        return [Trace(base, seed=rng.random()) for base in bases]
+
+    a, b, c = lanes(10.0, 12.0, 15.0)
+    delay_step = {"a": a.delay_step(60, 20, 240), "b": b, "c": c.delay_step(300, -8)}
+    a, b, c = lanes(10.0, 12.0, 15.0)
+    flapping = {"a": a.flap(30, 45, 5), "b": b.flap(50, 90, 10), "c": c}
+    a, b, c = lanes(10.0, 12.0, 15.0)
+    loss_burst = {
+        "a": a.loss_burst(60, 30, 0.3).loss_burst(200, 10, 0.8),
+        "b": b.loss_burst(120, 60, 0.1),
+        "c": c,
+    }
+    a, b, c = lanes(10.0, 12.0, 15.0)
+    mixed = {
+        "a": a.delay_step(60, 20, 180).loss_burst(300, 20, 0.5).flap(400, 60, 3),
+        "b": b.flap(100, 120, 8).delay_step(250, 10, 350),
+        "c": c.loss_burst(150, 40, 0.05),
+    }
+    return {
+        "delay_step": delay_step,
+        "flapping": flapping,
+        "loss_burst": loss_burst,
+        "mixed": mixed,
+    }
+
+
+def simulate(
+    traces: Dict[str, Any],
+    duration: float,
+    rate: float = 100.0,
+    tick: Optional[float] = None,
+    forecast: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """Run the optimizer of a pair whose lanes follow traces.
+
+    Samples are pushed to a StreamAggregator and the optimizer decides every
+    tick seconds of virtual time, changing lanes right away. A lane is
+    suboptimal when its noiseless cost is higher than the best one by more
+    than the damping hysteresis.
+
+    :traces: Trace or RecordedTrace of each lane, keyed by probe
+    :duration: seconds of virtual time
+    :rate: probes per second of each synthetic lane
+    :tick: seconds between decisions, settings.frequency by default
+    :forecast: Forecaster params, None to not forecast
+
+    """
+    tick = tick or settings.frequency
+    policy = make_policy(settings.policy, **settings.policy_params)
+    network = Network(settings.vlan_range, settings.probe_port_start)
+    pair = network.add_pair(
+        "sim", EDGES, [{"probe": probe, "bandwidth": 1000.0} for probe in traces]
+    )
+    forecaster = None
+    if forecast is not None:
+        from napps.viniarck.dvel.forecast import Forecaster
+
+        forecaster = Forecaster(**forecast)
+    optimizer = LaneOptimizer(
+        network,
+        policy,
+        settings.max_rtt,
+        settings.damping,
+        ProbeRateController(
+            settings.probe_budget, settings.probe_rate_min, settings.probe_rate_max
+        ),
+        forecaster,
+    )
+    optimizer.add_pair(pair)
+    aggregator = StreamAggregator(settings.window, settings.ewma_alpha)
+    hysteresis = optimizer.dampers[pair.name].hysteresis
+    latency = Histogram()
+    lanes = {lane.probe: lane for lane in pair.lanes.values()}
+    switches = 0
+    suboptimal = 0.0
+    wall_start = time.perf_counter()
+    prev = 0.0
+    for n in range(1, int(duration / tick) + 1):
+        now = n * tick
+        for probe, trace in traces.items():
+            for t, rtt in trace.samples(prev, now, rate):
+                aggregator.add(probe, rtt, t)
+        prev = now
+        start = time.perf_counter()
+        pairs = optimizer.read_stream(aggregator, settings.rtt_stat, now)
+        if pairs:
+            optimizer.forecast()
+            path = optimizer.decide(pair, now)
+            if path is not None:
+                pair.active = path
+                switches += 1
+        latency.add((time.perf_counter() - start) * 1e3)
+        costs = {}
+        for probe, trace in traces.items():
+            rtt, loss = trace.truth(now)
+            costs[probe] = policy.cost(
+                LaneMetrics(rtt if loss < 1.0 else settings.max_rtt, loss, 0.0, 1000.0)
+            )
+        if costs[pair.active_lane.probe] > min(costs.values()) * (1 + hysteresis):
+            suboptimal += tick
+    wall = time.perf_counter() - wall_start
+    return {
+        "lanes": list(lanes),
+        "seconds": duration,
+        "ticks": int(duration / tick),
+        "switches": switches,
+        "suboptimal_seconds": round(suboptimal, 6),
+        "suboptimal_ratio": suboptimal / duration if duration else 0.0,
+        "decision_latency_ms": latency.as_dict(),
+        "wall_seconds": wall,
+        "speedup": duration / wall if wall else math.inf,
+        "switching": optimizer.dampers[pair.name].counters,
+    }
+
+
+def main() -> None:
+    """Simulate a scenario or a recorded trace."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", default="mixed", help="synthetic scenario")
+    parser.add_argument("--trace", help="file of <time_s> <host> <rtt_ms> lines")
+    parser.add_argument("--duration", type=float, help="seconds of virtual time")
+    parser.add_argument("--rate", type=float, default=100.0, help="probes per second")
+    parser.add_argument("--tick", type=float, help="seconds between decisions")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the scenario")
+    parser.add_argument("--forecast", type=json.loads, help="Forecaster params, JSON")
+    args = parser.parse_args()
+
+    if args.trace:
+        traces = load_trace(args.trace)
+        duration = args.duration or max(trace.end for trace in traces.values())
+    else:
+        traces = scenarios(args.seed)[args.scenario]
+        duration = args.duration or 600.0
+    forecast = args.forecast
+    if forecast is None and settings.forecast is not None:
+        forecast = settings.forecast
+    result = simulate(traces, duration, args.rate, args.tick, forecast)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
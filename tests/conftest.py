@@ -0,0 +1,33 @@
+"""Make the NApp importable as napps.viniarck.dvel and the probes by name.
+
+Kytos installs NApps under a napps package, which a checkout doesn't have,
+so the checkout is registered as napps.viniarck.dvel when it can't be
+imported. The probe scripts of dvel/ import each other as top level modules.
+"""
+
+import importlib.util
+import sys
+import types
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+sys.path.insert(0, str(ROOT / "dvel"))
+
+try:
+    import napps.viniarck.dvel  # noqa: F401
+except ImportError:
+    for name in ("napps", "napps.viniarck"):
+        if name not in sys.modules:
+            package = types.ModuleType(name)
+            package.__path__ = []
+            sys.modules[name] = package
+    spec = importlib.util.spec_from_file_location(
+        "napps.viniarck.dvel",
+        ROOT / "__init__.py",
+        submodule_search_locations=[str(ROOT)],
+    )
+    dvel = importlib.util.module_from_spec(spec)
+    sys.modules["napps.viniarck.dvel"] = dvel
+    spec.loader.exec_module(dvel)
+    sys.modules["napps.viniarck"].dvel = dvel
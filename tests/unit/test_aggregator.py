@@ -0,0 +1,83 @@
+"""Tests of the streaming lane aggregator."""
+
+import pytest
+
+from napps.viniarck.dvel.aggregator import LaneStats, StreamAggregator
+
+
+def test_window_statistics():
+    stats = LaneStats(window=3.0)
+    for now, rtt in enumerate([10.0, 12.0, 8.0, 14.0]):
+        stats.add(rtt, float(now))
+    assert stats.count == 4
+    assert stats.mean == pytest.approx(11.0)
+    assert stats.min == 8.0
+    assert stats.get("mean") == stats.mean
+
+
+def test_old_samples_are_evicted():
+    stats = LaneStats(window=3.0)
+    for now, rtt in enumerate([5.0, 12.0, 8.0, 14.0, 16.0]):
+        stats.add(rtt, float(now))
+    assert stats.count == 4
+    assert stats.mean == pytest.approx(12.5)
+    assert stats.min == 8.0
+    stats.expire(10.0)
+    assert stats.count == 0
+    assert stats.mean is None
+    assert stats.min is None
+    assert stats.percentile(50) is None
+
+
+def test_ewma_and_jitter():
+    stats = LaneStats(alpha=0.5)
+    stats.add(10.0, 0.0)
+    assert stats.ewma == 10.0
+    assert stats.jitter == 0.0
+    stats.add(20.0, 0.1)
+    assert stats.ewma == 15.0
+    assert stats.jitter == pytest.approx(10.0 / 16.0)
+
+
+def test_percentiles_are_within_the_resolution():
+    stats = LaneStats(window=1e3, resolution=0.02)
+    for i in range(1, 101):
+        stats.add(float(i), float(i))
+    assert stats.percentile(50) == pytest.approx(50.0, rel=0.02)
+    assert stats.get("p99") == pytest.approx(99.0, rel=0.02)
+    assert stats.percentile(0) == 1.0
+
+
+def test_loss_rate():
+    stats = LaneStats(window=3.0)
+    assert stats.loss_rate == 0.0
+    stats.add(10.0, 0.0)
+    stats.add(None, 1.0)
+    stats.add(None, 2.0)
+    stats.add(10.0, 3.0)
+    assert stats.loss_rate == 0.5
+    stats.add(10.0, 4.5)
+    assert stats.loss_rate == pytest.approx(1 / 3)
+    assert stats.count == 2
+    stats.expire(10.0)
+    assert stats.loss_rate == 0.0
+
+
+def test_ingest():
+    aggregator = StreamAggregator()
+    hosts = aggregator.ingest(b"d3 10.5\nd4 -\nd3 11.5\nbogus\nd5 fast\n")
+    assert hosts == {"d3", "d4"}
+    assert aggregator.malformed == 2
+    assert aggregator.lanes["d3"].mean == pytest.approx(11.0)
+    assert aggregator.lanes["d4"].loss_rate == 1.0
+
+
+def test_pop_dirty_returns_new_and_silent_hosts():
+    aggregator = StreamAggregator(window=3.0)
+    aggregator.add("d3", 10.0, 0.0)
+    aggregator.add("d4", 10.0, 1.0)
+    assert aggregator.pop_dirty(1.0) == {"d3", "d4"}
+    assert aggregator.pop_dirty(2.0) == set()
+    aggregator.add("d4", 10.0, 3.5)
+    assert aggregator.pop_dirty(3.5) == {"d3", "d4"}
+    assert aggregator.pop_dirty(3.5) == set()
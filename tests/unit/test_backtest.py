@@ -0,0 +1,83 @@
+"""Tests of the forecast backtest."""
+
+import math
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from napps.viniarck.dvel import backtest  # noqa: E402
+from napps.viniarck.dvel import settings  # noqa: E402
+from napps.viniarck.dvel.scoring import LowestLatency, MaxThroughput  # noqa: E402
+
+nan = math.nan
+
+
+def test_ffill():
+    series = np.array([[nan, 1.0, nan, nan, 2.0], [3.0, nan, 4.0, nan, nan]])
+    filled = backtest.ffill(series)
+    assert np.isnan(filled[0, 0])
+    assert filled[0, 1:].tolist() == [1.0, 1.0, 1.0, 2.0]
+    assert filled[1].tolist() == [3.0, 3.0, 4.0, 4.0, 4.0]
+
+
+def test_window_mean_skips_nans():
+    mean, count = backtest.window_mean(np.array([[1.0, nan, 3.0, 5.0, nan]]), 2)
+    assert count[0].tolist() == [1, 1, 1, 2, 1]
+    assert mean[0].tolist() == [1.0, 1.0, 3.0, 4.0, 5.0]
+    mean, count = backtest.window_mean(np.array([[nan, nan]]), 2)
+    assert count[0].tolist() == [0, 0]
+    assert np.isnan(mean).all()
+
+
+def test_lane_view():
+    rtt = np.array([[nan, 10.0, nan, nan]])
+    loss = np.array([[nan, 0.0, 1.0, nan]])
+    seen_rtt, seen_loss = backtest.lane_view(rtt, loss, 1e4)
+    assert seen_rtt[0].tolist() == [1e4, 10.0, 1e4, 1e4]
+    assert seen_loss[0].tolist() == [0.0, 0.0, 1.0, 1.0]
+
+
+def degrading(steps=120, at=60):
+    """Lane 0 is the fastest until its rtt ramps up, lane 1 stays at 20 ms."""
+    rtt = np.full((2, steps), 20.0)
+    rtt[0, :at] = 10.0
+    rtt[0, at:] = 10.0 + 2.0 * np.arange(steps - at)
+    return rtt, np.zeros((2, steps))
+
+
+def test_replay_moves_away_from_a_degrading_lane():
+    rtt, loss = degrading()
+    result = backtest.replay(
+        rtt, loss, [100.0, 100.0], LowestLatency(), MaxThroughput(), 1.0, 3
+    )
+    assert result["switches"] == 1
+    assert result["degraded_events"] == 1
+    assert 0.0 < result["degraded_seconds"] < 10.0
+    assert result["mean_switching_latency"] == result["degraded_seconds"]
+    assert result["lost_throughput_mb"] >= 0.0
+
+
+def test_replay_of_a_lane_that_goes_down():
+    rtt, loss = degrading()
+    rtt[0, 60:] = nan
+    loss[0, 60:] = 1.0
+    result = backtest.replay(
+        rtt, loss, [100.0, 100.0], LowestLatency(), MaxThroughput(), 1.0, 3
+    )
+    assert result["switches"] == 1
+    assert result["degraded_events"] == 1
+
+
+def test_backtest_compares_reactive_and_predictive(monkeypatch):
+    monkeypatch.setattr(settings, "policy", "lowest_latency")
+    monkeypatch.setattr(settings, "policy_params", {})
+    rtt, loss = degrading()
+    result = backtest.backtest(
+        rtt, loss, [100.0, 100.0], 1.0, {"window": 20, "min_samples": 5}
+    )
+    reactive, predictive = result["reactive"], result["predictive"]
+    assert result["saved"]["degraded_seconds"] == pytest.approx(
+        reactive["degraded_seconds"] - predictive["degraded_seconds"]
+    )
+    assert predictive["degraded_seconds"] < reactive["degraded_seconds"]
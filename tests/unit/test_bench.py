@@ -0,0 +1,61 @@
+"""Tests of the benchmark suite, on tiny runs."""
+
+import pytest
+
+from napps.viniarck.dvel import bench
+
+
+def test_metric():
+    results = {"latency_ms": {"p50": 1.5, "note": "x"}, "switches": 3}
+    assert bench.metric(results, "latency_ms.p50") == 1.5
+    assert bench.metric(results, "switches") == 3
+    assert bench.metric(results, "latency_ms.note") is None
+    assert bench.metric(results, "latency_ms.p99") is None
+    assert bench.metric(results, "switches.p50") is None
+
+
+def test_compare_flags_regressions_past_the_tolerance():
+    baseline = {
+        "reflector": {"replies_per_sec": 1000.0},
+        "change_lane": {"latency_ms": {"p50": 2.0, "p99": 4.0}},
+        "influx_write": {"points_per_sec": 0},
+    }
+    results = {
+        "reflector": {"replies_per_sec": 850.0},
+        "change_lane": {"latency_ms": {"p50": 2.1, "p99": 6.0}},
+        "influx_write": {"points_per_sec": 10.0},
+        "decision_tick": {"error": "failed"},
+    }
+    p99 = "change_lane latency_ms.p99: 4 -> 6"
+    assert bench.compare(results, baseline, 0.2) == [p99]
+    assert bench.compare(results, baseline, 0.1) == [
+        "reflector replies_per_sec: 1000 -> 850",
+        p99,
+    ]
+
+
+def test_dpid():
+    assert bench._dpid(258) == "00:00:00:00:00:00:01:02"
+
+
+def test_decision_tick():
+    result = bench.bench_decision_tick(pairs=2, lanes=3, ticks=20)
+    assert result["lanes"] == 6
+    assert result["samples_per_tick"] == 30
+    assert result["latency_ms"]["count"] == 20
+
+
+def test_change_lane():
+    result = bench.bench_change_lane(changes=4, hops=2)
+    assert result["dpids"] == 2
+    # both directions of the host EVC on each hop
+    assert result["flows"] == 4
+    assert result["latency_ms"]["count"] == 4
+
+
+def test_influx_write():
+    for module in ("aioinflux", "uvloop"):
+        pytest.importorskip(module)
+    result = bench.bench_influx_write(points=3000, batch_size=1000)
+    assert result["received"] == 3000
+    assert result["dropped"] == 0
@@ -0,0 +1,313 @@
+"""Tests of the probe client."""
+
+import asyncio
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+for module in ("aioinflux", "async_timeout", "uvloop"):
+    pytest.importorskip(module)
+
+from aiohttp import web  # noqa: E402
+
+import client  # noqa: E402
+from client import (  # noqa: E402
+    Client,
+    Rollup,
+    DBServerInfo,
+    HTTPServerInfo,
+    LaneInfo,
+    MultiClient,
+    parse_lanes,
+)
+
+
+def run(coro):
+    """Run a coroutine on a new loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+async def echo_server(peers):
+    """Echo server on a free local port that keeps the peer of each request."""
+
+    async def echo(request):
+        peers.append(request.transport.get_extra_info("peername"))
+        return web.json_response(
+            {"response": "reply"}, headers={client.SERVER_TIME_HEADER: "0.25"}
+        )
+
+    app = web.Application()
+    app.router.add_get("/echo", echo)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/echo"
+
+
+def make_client(**kwargs):
+    """Client of a local echo server."""
+    return Client(
+        "d3",
+        HTTPServerInfo("127.0.0.1", 8000, "echo"),
+        DBServerInfo("127.0.0.1", 8086, "dvel"),
+        **kwargs,
+    )
+
+
+async def probe(c, requests):
+    """Send requests over one session, it returns the server times and peers."""
+    peers = []
+    runner, url = await echo_server(peers)
+    try:
+        async with aiohttp.ClientSession(connector=c.make_connector()) as session:
+            await c.warm_up(session, url)
+            times = [await c.make_request(session, url) for _ in range(requests)]
+    finally:
+        await runner.cleanup()
+    return times, peers
+
+
+def test_probes_reuse_a_keep_alive_connection():
+    times, peers = run(probe(make_client(), 5))
+    assert times == [0.25] * 5
+    assert len(peers) == 6
+    assert len(set(peers)) == 1
+
+
+def test_measure_connect_opens_a_connection_per_probe():
+    times, peers = run(probe(make_client(measure_connect=True), 5))
+    assert len(peers) == 5
+    assert len(set(peers)) == 5
+
+
+def test_warm_up_happens_once():
+    c = make_client()
+    _, peers = run(probe(c, 0))
+    assert c._warm
+    assert len(peers) == 1
+
+
+class FakeWriter(object):
+
+    """Writer that keeps the written points."""
+
+    def __init__(self):
+        """Constructor of FakeWriter."""
+        self.points = []
+
+    async def write(self, measurement, tags, fields, timestamp):
+        """Keep a point."""
+        self.points.append((measurement, fields))
+
+
+async def dropping_server():
+    """Server on a free local port that drops every connection."""
+
+    def drop(reader, writer):
+        writer.close()
+
+    server = await asyncio.start_server(drop, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+async def probe_dropping_server(seconds):
+    """Probe a dropping server over HTTP, it returns the written rollups."""
+    server, port = await dropping_server()
+    c = Client(
+        "d3",
+        HTTPServerInfo("127.0.0.1", port, "echo"),
+        DBServerInfo("127.0.0.1", 8086, "dvel"),
+        frequency=0.01,
+        rollup_interval=0.05,
+    )
+    writer = FakeWriter()
+    await run_for(c.run_http(writer, None), seconds)
+    server.close()
+    await server.wait_closed()
+    return [fields for name, fields in writer.points if name == "rollup"]
+
+
+def test_dropped_connections_are_lost_probes():
+    rollups = run(probe_dropping_server(0.3))
+    assert rollups
+    assert all(r["sent"] == r["lost"] and r["count"] == 0 for r in rollups)
+
+
+async def run_for(coro, seconds):
+    """Run a probing coroutine for a while, then cancel it."""
+    task = asyncio.ensure_future(coro)
+    await asyncio.sleep(seconds)
+    assert not task.done()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+def test_http_probes_write_the_rtt_minus_the_server_time(monkeypatch):
+    now = [0]
+
+    async def make_request(self, session, url):
+        now[0] += 4_000_000
+        return 0.25
+
+    async def warm_up(self, session, url):
+        pass
+
+    monkeypatch.setattr(client.time, "perf_counter_ns", lambda: now[0])
+    monkeypatch.setattr(Client, "make_request", make_request)
+    monkeypatch.setattr(Client, "warm_up", warm_up)
+    writer = FakeWriter()
+    c = make_client(frequency=0.01, raw_points=True)
+    run(run_for(c.run_http(writer, None), 0.05))
+    rtts = [fields["value"] for name, fields in writer.points if name == "rtt"]
+    assert rtts and set(rtts) == {3.75}
+
+
+class FakeProber(object):
+
+    """UDPProber stand-in whose probes all take 4 ms."""
+
+    def __init__(self, on_sample, **kwargs):
+        """Constructor of FakeProber."""
+        self.on_sample = on_sample
+        self.jitter = 0.5
+        self.counters = {"reordered": 0, "late": 0}
+
+    @classmethod
+    async def connect(cls, addr, port, local_addr=None, **kwargs):
+        """Make a FakeProber and its transport."""
+        return FakeUDPTransport(), cls(**kwargs)
+
+    def send(self):
+        """Report the rtt of a probe."""
+        self.on_sample(4.0)
+
+
+class FakeUDPTransport(object):
+
+    """Transport that can only be closed."""
+
+    def close(self):
+        """Close the transport."""
+
+
+def test_udp_probes_write_the_rtt(monkeypatch):
+    monkeypatch.setattr(client, "UDPProber", FakeProber)
+    writer = FakeWriter()
+    c = make_client(
+        frequency=0.01, raw_points=True, probe_mode="udp", rollup_interval=0.02
+    )
+    run(run_for(c.probe(writer, None), 0.05))
+    rtts = [fields["value"] for name, fields in writer.points if name == "rtt"]
+    jitters = [f["jitter"] for name, f in writer.points if name == "probe_stats"]
+    assert rtts and set(rtts) == {4.0}
+    assert jitters and set(jitters) == {0.5}
+
+
+def test_a_failed_lane_is_restarted_without_stopping_the_others(monkeypatch):
+    multi = MultiClient(
+        parse_lanes("d3=10.0.0.3,d4=10.0.0.4"),
+        HTTPServerInfo("127.0.0.1", 8000, "echo"),
+        DBServerInfo("127.0.0.1", 8086, "dvel"),
+        restart_delay=0.0,
+    )
+    calls = []
+
+    async def probe(self, writer, sender):
+        calls.append(self.name)
+        if self.name == "d3" and calls.count("d3") < 3:
+            raise RuntimeError("lane failure")
+        await asyncio.sleep(0.01)
+
+    monkeypatch.setattr(Client, "probe", probe)
+    run(asyncio.wait_for(multi.probe(FakeWriter(), None), 1.0))
+    assert calls.count("d3") == 3
+    assert calls.count("d4") == 1
+
+
+def test_parse_lanes():
+    assert parse_lanes("d3=10.0.0.3, d4=10.0.0.4@10.1.0.4") == [
+        LaneInfo("d3", "10.0.0.3"),
+        LaneInfo("d4", "10.0.0.4", "10.1.0.4"),
+    ]
+
+
+def test_multi_client_probes_each_lane_on_its_own_address():
+    multi = MultiClient(
+        parse_lanes("d3=10.0.0.3,d4=10.0.0.4@10.1.0.4"),
+        HTTPServerInfo("127.0.0.1", 8000, "echo"),
+        DBServerInfo("127.0.0.1", 8086, "dvel"),
+        measure_connect=True,
+    )
+    assert [(c.name, c.h_info.addr, c.bind_addr) for c in multi.clients] == [
+        ("d3", "10.0.0.3", None),
+        ("d4", "10.0.0.4", "10.1.0.4"),
+    ]
+    assert all(c.measure_connect for c in multi.clients)
+
+
+def test_probes_are_sent_from_the_bind_address():
+    _, peers = run(probe(make_client(bind_addr="127.0.0.2"), 1))
+    assert {host for host, _ in peers} == {"127.0.0.2"}
+
+
+def test_set_rate():
+    multi = MultiClient(
+        parse_lanes("d3=10.0.0.3,d4=10.0.0.4"),
+        HTTPServerInfo("127.0.0.1", 8000, "echo"),
+        DBServerInfo("127.0.0.1", 8086, "dvel"),
+        frequency=0.01,
+    )
+    multi.set_rate("d4", 200.0)
+    multi.set_rate("d9", 200.0)
+    multi.set_rate("d3", 0.0)
+    assert [c.frequency for c in multi.clients] == [0.01, 0.005]
+
+
+def test_rollup_fields():
+    rollup = Rollup()
+    for rtt in [4.0, None, 2.0, 6.0, None]:
+        rollup.add(rtt)
+    fields = rollup.pop()
+    assert fields == {
+        "sent": 5,
+        "lost": 2,
+        "loss": 0.4,
+        "count": 3,
+        "min": 2.0,
+        "mean": 4.0,
+        "max": 6.0,
+        "p99": 6.0,
+        "stddev": pytest.approx((8 / 3) ** 0.5),
+    }
+    assert rollup.pop() == {"sent": 0, "lost": 0, "loss": 0.0, "count": 0}
+
+
+def test_rollup_p99():
+    rollup = Rollup()
+    for rtt in range(1, 201):
+        rollup.add(float(rtt))
+    assert rollup.pop()["p99"] == 198.0
+
+
+def test_rollup_of_lost_probes_has_no_rtt():
+    rollup = Rollup()
+    rollup.add(None)
+    assert rollup.pop() == {"sent": 1, "lost": 1, "loss": 1.0, "count": 0}
+
+
+def test_rollup_is_due_after_its_interval(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(client.time, "monotonic", lambda: now[0])
+    rollup = Rollup(interval=1.0)
+    assert not rollup.due()
+    now[0] = 101.0
+    assert rollup.due()
+    rollup.pop()
+    assert not rollup.due()
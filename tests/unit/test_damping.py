@@ -0,0 +1,70 @@
+"""Tests of the lane switch flap damping."""
+
+from napps.viniarck.dvel.damping import SwitchDamper
+
+
+def damper(**kwargs):
+    """SwitchDamper that only damps what a test asks for."""
+    params = dict(hysteresis=0.0, min_dwell=0.0, holddown=0.0, max_switches=100)
+    params.update(kwargs)
+    return SwitchDamper(**params)
+
+
+def test_hysteresis():
+    d = damper(hysteresis=0.2)
+    assert not d.allow(10.0, 9.0, now=0.0)
+    assert d.allow(10.0, 8.0, now=0.0)
+    assert d.counters["suppressed_hysteresis"] == 1
+
+
+def test_min_dwell():
+    d = damper(min_dwell=5.0)
+    assert d.allow(10.0, 5.0, now=0.0)
+    d.switched(0.0)
+    assert not d.allow(10.0, 5.0, now=4.0)
+    assert d.allow(10.0, 5.0, now=5.0)
+    assert d.counters["suppressed_dwell"] == 1
+
+
+def test_holddown_doubles_on_flips():
+    d = damper(holddown=2.0, holddown_max=5.0, flap_window=30.0)
+    d.switched(0.0)
+    assert d.penalty == 0.0
+    d.switched(1.0)
+    assert d.penalty == 2.0
+    assert not d.allow(10.0, 5.0, now=2.0)
+    assert d.allow(10.0, 5.0, now=3.0)
+    d.switched(3.0)
+    assert d.penalty == 4.0
+    d.switched(8.0)
+    assert d.penalty == 5.0
+    d.switched(100.0)
+    assert d.penalty == 0.0
+    assert d.counters["suppressed_holddown"] == 1
+
+
+def test_switch_budget():
+    d = damper(max_switches=2, budget_period=60.0, flap_window=0.0)
+    for now in (0.0, 1.0):
+        assert d.allow(10.0, 5.0, now=now)
+        d.switched(now)
+    assert not d.allow(10.0, 5.0, now=59.0)
+    assert d.allow(10.0, 5.0, now=60.0)
+    assert d.counters["suppressed_budget"] == 1
+
+
+def test_a_down_lane_is_always_left():
+    d = damper(hysteresis=0.2, min_dwell=5.0)
+    d.switched(0.0)
+    assert d.allow(10.0, 10.0, down=True, now=1.0)
+    assert d.counters["forced"] == 1
+
+
+def test_status():
+    d = damper(holddown=2.0)
+    d.switched(0.0)
+    d.switched(1.0)
+    status = d.status()
+    assert status["switches"] == 2
+    assert status["holddown"] == 2.0
+    assert status["holddown_remaining"] >= 0.0
@@ -0,0 +1,165 @@
+"""Tests of the OpenFlow fast path, they need Kytos and of_core."""
+
+import pytest
+
+pytest.importorskip("kytos.core")
+pytest.importorskip("napps.kytos.of_core.v0x04.flow")
+
+from napps.viniarck.dvel import fastpath  # noqa: E402
+from napps.viniarck.dvel.fastpath import FastPath, FastPathError  # noqa: E402
+
+S3 = "00:00:00:00:00:00:00:03"
+S4 = "00:00:00:00:00:00:00:04"
+
+
+class FakeFlowMod(object):
+
+    """FlowMod of a flow dict."""
+
+    def __init__(self, command: str, flow: dict) -> None:
+        """Constructor of FakeFlowMod."""
+        self.command = command
+        self.flow = flow
+
+
+class FakeFlow(object):
+
+    """Flow04 that builds FakeFlowMods."""
+
+    def __init__(self, flow: dict) -> None:
+        """Constructor of FakeFlow."""
+        self.flow = flow
+
+    @classmethod
+    def from_dict(cls, flow: dict, switch) -> "FakeFlow":
+        """Flow of a flow dict."""
+        return cls(flow)
+
+    def as_of_add_flow_mod(self) -> FakeFlowMod:
+        """Add FlowMod."""
+        return FakeFlowMod("add", self.flow)
+
+    def as_of_delete_flow_mod(self) -> FakeFlowMod:
+        """Delete FlowMod."""
+        return FakeFlowMod("delete", self.flow)
+
+
+class FakeConnection(object):
+
+    """Switch connection of an OpenFlow version."""
+
+    def __init__(self, dpid: str, version: int) -> None:
+        """Constructor of FakeConnection."""
+        self.dpid = dpid
+        self.protocol = type("Protocol", (object,), {"version": version})()
+
+
+class FakeSwitch(object):
+
+    """Kytos switch."""
+
+    def __init__(self, dpid: str, connected=True, version=fastpath.OF_V0X04):
+        """Constructor of FakeSwitch."""
+        self.connected = connected
+        self.connection = FakeConnection(dpid, version)
+
+    def is_connected(self) -> bool:
+        """Whether the switch is connected."""
+        return self.connected
+
+
+class FakeController(object):
+
+    """Kytos controller whose switches reply to barriers right away."""
+
+    def __init__(self, switches, silent=()) -> None:
+        """Constructor of FakeController.
+
+        :switches: switch of each dpid
+        :silent: dpids that don't reply to barriers
+
+        """
+        self.switches = switches
+        self.silent = set(silent)
+        self.fast_path = None
+        self.sent = []
+        self.buffers = type("Buffers", (object,), {"msg_out": self})()
+
+    def get_switch_by_dpid(self, dpid):
+        """Get a switch."""
+        return self.switches.get(dpid)
+
+    def put(self, event) -> None:
+        """Keep an outgoing message and reply to it if it's a barrier."""
+        dpid = event.content["destination"].dpid
+        message = event.content["message"]
+        if isinstance(message, FakeFlowMod):
+            self.sent.append((dpid, message.command, message.flow["n"]))
+        else:
+            self.sent.append((dpid, "barrier", None))
+            if dpid not in self.silent:
+                self.fast_path.barrier_reply(message.header.xid)
+
+
+def make_fast_path(monkeypatch, switches, silent=(), timeout=1.0):
+    """FastPath over a FakeController."""
+    monkeypatch.setattr(fastpath, "Flow04", FakeFlow)
+    controller = FakeController(switches, silent)
+    controller.fast_path = FastPath(controller, timeout=timeout)
+    return controller.fast_path, controller
+
+
+def backbone():
+    """Connected s3 and s4."""
+    return {S3: FakeSwitch(S3), S4: FakeSwitch(S4)}
+
+
+def test_new_flows_are_confirmed_before_old_ones_are_deleted(monkeypatch):
+    fp, controller = make_fast_path(monkeypatch, backbone())
+    times = fp.replace(
+        {S3: [{"n": 1}], S4: [{"n": 2}]}, {S3: [{"n": 3}], S4: [{"n": 4}]}
+    )
+    assert controller.sent == [
+        (S3, "add", 1),
+        (S3, "barrier", None),
+        (S4, "add", 2),
+        (S4, "barrier", None),
+        (S3, fastpath.FlowModCommand.OFPFC_DELETE_STRICT, 3),
+        (S3, "barrier", None),
+        (S4, fastpath.FlowModCommand.OFPFC_DELETE_STRICT, 4),
+        (S4, "barrier", None),
+    ]
+    assert set(times) == {S3, S4}
+    for dpid in times:
+        assert 0.0 <= times[dpid]["install_ms"] <= times[dpid]["total_ms"]
+    assert fp._barriers == {}
+
+
+def test_a_missing_barrier_reply_times_out(monkeypatch):
+    fp, controller = make_fast_path(monkeypatch, backbone(), silent={S4}, timeout=0.01)
+    with pytest.raises(FastPathError):
+        fp.replace({S3: [{"n": 1}], S4: [{"n": 2}]}, {S3: [{"n": 3}]})
+    assert [command for _, command, _ in controller.sent] == [
+        "add",
+        "barrier",
+        "add",
+        "barrier",
+    ]
+    assert fp._barriers == {}
+
+
+@pytest.mark.parametrize(
+    "switch",
+    [None, FakeSwitch(S3, connected=False), FakeSwitch(S3, version=0x01)],
+)
+def test_unusable_switches(monkeypatch, switch):
+    fp, controller = make_fast_path(monkeypatch, {S3: switch})
+    with pytest.raises(FastPathError):
+        fp.replace({S3: [{"n": 1}]}, {})
+    assert controller.sent == []
+
+
+def test_late_barrier_replies_are_ignored(monkeypatch):
+    fp, _ = make_fast_path(monkeypatch, backbone())
+    fp.barrier_reply(12345)
+    assert fp._barriers == {}
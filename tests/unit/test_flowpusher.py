@@ -0,0 +1,160 @@
+"""Tests of the pooled and coalescing flow_manager client."""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from napps.viniarck.dvel.flowpusher import (
+    FlowPusher,
+    FlowSet,
+    flow_set,
+    merge,
+    serialize,
+)
+
+DPID = "00:00:00:00:00:00:00:03"
+
+
+class FlowManager(HTTPServer):
+
+    """flow_manager that keeps the flows it's sent.
+
+    The first request blocks until release is set and the first failures
+    requests are answered with a 503.
+    """
+
+    def __init__(self, failures: int = 0) -> None:
+        """Constructor of FlowManager."""
+        super().__init__(("127.0.0.1", 0), FlowsHandler)
+        self.failures = failures
+        self.requests = []
+        self.release = threading.Event()
+        self.release.set()
+        self.received = threading.Event()
+
+    @property
+    def url(self) -> str:
+        """Base URL of the server."""
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class FlowsHandler(BaseHTTPRequestHandler):
+
+    """Handle the requests of FlowManager."""
+
+    def _handle(self) -> None:
+        """Keep a request and reply to it."""
+        server = self.server
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        server.requests.append((self.command, self.path, json.loads(body)["flows"]))
+        server.received.set()
+        server.release.wait(5.0)
+        status = 200
+        if server.failures:
+            server.failures -= 1
+            status = 503
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    do_POST = _handle
+    do_DELETE = _handle
+
+    def log_message(self, *args) -> None:
+        """Don't log the requests."""
+
+
+@pytest.fixture
+def flow_manager(request):
+    """FlowManager served on a thread."""
+    server = FlowManager(getattr(request, "param", 0))
+    thread = threading.Thread(
+        target=server.serve_forever, args=(0.01,), daemon=True
+    )
+    thread.start()
+    yield server
+    server.release.set()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def pusher(flow_manager):
+    """FlowPusher of the FlowManager."""
+    pusher = FlowPusher(flow_manager.url, workers=4, backoff=0.0)
+    yield pusher
+    pusher.shutdown()
+
+
+def test_push_and_delete(flow_manager, pusher):
+    timed = []
+    pusher.on_push = lambda dpid, ms: timed.append(dpid)
+    assert pusher.push(DPID, [{"priority": 1}]).status_code == 200
+    assert pusher.delete(DPID, [{"priority": 2}]).status_code == 200
+    assert flow_manager.requests == [
+        ("POST", f"/flows/{DPID}", [{"priority": 1}]),
+        ("DELETE", f"/flows/{DPID}", [{"priority": 2}]),
+    ]
+    assert timed == [DPID]
+
+
+def test_waiting_pushes_to_a_dpid_are_coalesced(flow_manager, pusher):
+    flow_manager.release.clear()
+    first = pusher.submit(DPID, flow_set([{"priority": 1}]))
+    assert flow_manager.received.wait(5.0)
+    second = pusher.submit(DPID, flow_set([{"priority": 2}]))
+    third = pusher.submit(DPID, flow_set([{"priority": 3}]))
+    assert third is second
+    flow_manager.release.set()
+    assert first.result(5.0).status_code == 200
+    assert second.result(5.0).status_code == 200
+    assert [flows for _, _, flows in flow_manager.requests] == [
+        [{"priority": 1}],
+        [{"priority": 2}, {"priority": 3}],
+    ]
+
+
+def test_push_many_pushes_every_dpid(flow_manager, pusher):
+    dpids = [f"00:00:00:00:00:00:00:0{i}" for i in range(1, 5)]
+    responses = pusher.push_many(
+        {dpid: flow_set([{"priority": i}]) for i, dpid in enumerate(dpids)}
+    )
+    assert {dpid: r.status_code for dpid, r in responses.items()} == dict.fromkeys(
+        dpids, 200
+    )
+    assert sorted(path for _, path, _ in flow_manager.requests) == [
+        f"/flows/{dpid}" for dpid in dpids
+    ]
+
+
+@pytest.mark.parametrize("flow_manager", [2], indirect=True)
+def test_failed_pushes_are_retried(flow_manager, pusher):
+    assert pusher.push(DPID, [{"priority": 1}]).status_code == 200
+    assert len(flow_manager.requests) == 3
+
+
+@pytest.mark.parametrize("flow_manager", [2], indirect=True)
+def test_failed_deletes_are_retried(flow_manager, pusher):
+    assert pusher.delete(DPID, [{"priority": 1}]).status_code == 200
+    assert [method for method, _, _ in flow_manager.requests] == ["DELETE"] * 3
+
+
+@pytest.mark.parametrize("flow_manager", [5], indirect=True)
+def test_retries_give_up_with_the_last_response(flow_manager, pusher):
+    assert pusher.push(DPID, [{"priority": 1}]).status_code == 503
+    assert len(flow_manager.requests) == 4
+
+
+def test_merge():
+    first, second = flow_set([{"priority": 1}]), flow_set([{"priority": 2}])
+    assert merge([first]) is first
+    assert merge([first, second]) == FlowSet([{"priority": 1}, {"priority": 2}], None)
+
+
+def test_a_flow_set_is_sent_as_serialized(flow_manager, pusher):
+    cached = FlowSet([{"priority": 1}], serialize([{"priority": 9}]))
+    assert pusher.submit(DPID, cached).result(5.0).status_code == 200
+    assert flow_manager.requests == [("POST", f"/flows/{DPID}", [{"priority": 9}])]
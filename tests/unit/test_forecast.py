@@ -0,0 +1,91 @@
+"""Tests of the lane forecasts."""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from napps.viniarck.dvel.forecast import Forecaster, cusum, holt  # noqa: E402
+
+
+def test_holt_follows_a_linear_trend():
+    series = np.array([[1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0]])
+    forecast = holt(series, alpha=0.8, beta=0.8, horizon=2.0)
+    assert forecast[0] == pytest.approx(10.0, rel=0.05)
+
+
+def test_cusum_finds_upward_shifts_only():
+    flat = [10.0, 10.1, 9.9, 10.0] * 5
+    up = flat + [20.0] * 20
+    down = flat + [1.0] * 20
+    alarm = cusum(np.array([flat + flat, up, down]), threshold=5.0, drift=0.5)
+    assert alarm.tolist() == [False, True, False]
+
+
+def test_lanes_need_min_samples():
+    forecaster = Forecaster(min_samples=3)
+    forecaster.add("a", 0.0, 10.0, 0.0)
+    forecaster.add("a", 1.0, 10.0, 0.0)
+    assert forecaster.predict() == {}
+    forecaster.add("a", 2.0, 10.0, 0.0)
+    rtt, loss = forecaster.predict()["a"]
+    assert rtt == pytest.approx(10.0)
+    assert loss == pytest.approx(0.0)
+
+
+def test_latest_sample_of_a_step_wins():
+    forecaster = Forecaster(window=4, min_samples=1)
+    forecaster.add("a", 0.2, 10.0, 0.0)
+    forecaster.add("a", 0.8, 12.0, 0.5)
+    assert forecaster.rtt[0, -1] == 12.0
+    assert forecaster.loss[0, -1] == 0.5
+    assert forecaster.count[0] == 1
+
+
+def test_gaps_repeat_the_last_sample():
+    forecaster = Forecaster(window=5, min_samples=1)
+    forecaster.add("a", 0.0, 10.0, 0.0)
+    forecaster.add("a", 3.0, 20.0, 0.1)
+    assert forecaster.rtt[0].tolist() == [10.0, 10.0, 10.0, 10.0, 20.0]
+    assert forecaster.count[0] == 4
+
+
+@pytest.mark.parametrize("gap", [5.0, 6.0, 90.0])
+def test_gap_of_a_window_or_more_starts_over(gap):
+    forecaster = Forecaster(window=5, min_samples=1)
+    for t in range(5):
+        forecaster.add("a", float(t), 10.0, 0.0)
+    forecaster.add("a", 4.0 + gap, 30.0, 0.2)
+    assert forecaster.rtt[0].tolist() == [30.0] * 5
+    assert forecaster.loss[0].tolist() == [0.2] * 5
+    assert forecaster.count[0] == 1
+
+
+def test_upward_shift_is_forecast_at_least_at_its_latest_value():
+    forecaster = Forecaster(window=20, alpha=0.1, beta=0.0, min_samples=20)
+    for t in range(10):
+        forecaster.add("a", float(t), 10.0 + 0.1 * (t % 2), 0.0)
+    for t in range(10, 20):
+        forecaster.add("a", float(t), 30.0, 0.0)
+    rtt, _ = forecaster.predict()["a"]
+    assert rtt >= 30.0
+
+
+def test_remove_keeps_the_other_lanes():
+    forecaster = Forecaster(min_samples=1)
+    forecaster.add("a", 0.0, 10.0, 0.0)
+    forecaster.add("b", 0.0, 20.0, 0.0)
+    forecaster.add("c", 0.0, 30.0, 0.0)
+    forecaster.remove("b")
+    forecaster.remove("missing")
+    assert set(forecaster.predict()) == {"a", "c"}
+    assert forecaster.predict()["c"][0] == pytest.approx(30.0)
+
+
+def test_simulated_flap_longer_than_the_window():
+    simulator = pytest.importorskip("napps.viniarck.dvel.simulator")
+    trace = simulator.Trace(10.0, seed=1).flap(30, 200, 90)
+    lanes = {"a": trace, "b": simulator.Trace(15.0, seed=2)}
+    result = simulator.simulate(
+        lanes, 240.0, rate=20.0, forecast={"step": 1.0, "window": 60}
+    )
+    assert result["switches"] >= 1
@@ -0,0 +1,535 @@
+"""Tests of the NApp lane routing and failover, they need Kytos and of_core."""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+
+import aiohttp
+import pytest
+
+pytest.importorskip("kytos.core")
+pytest.importorskip("napps.kytos.of_core.v0x04.flow")
+
+from napps.viniarck.dvel import main as dvel_main  # noqa: E402
+from napps.viniarck.dvel import retention, settings  # noqa: E402
+from aioinflux import InfluxDBError  # noqa: E402
+from napps.viniarck.dvel.aggregator import StreamAggregator  # noqa: E402
+from napps.viniarck.dvel.fastpath import FastPathError  # noqa: E402
+from napps.viniarck.dvel.paths import Link  # noqa: E402
+
+S1 = "00:00:00:00:00:00:00:01"
+S2 = "00:00:00:00:00:00:00:02"
+S3 = "00:00:00:00:00:00:00:03"
+S4 = "00:00:00:00:00:00:00:04"
+BB2 = Link("bb2", S3, 3, S4, 3)
+# the edges of settings.pairs hang off s3 and s4, linked by three links
+LINKS = [
+    Link("e1", S1, 2, S3, 1),
+    Link("e2", S2, 2, S4, 1),
+    Link("bb1", S3, 2, S4, 2),
+    BB2,
+    Link("bb3", S3, 4, S4, 4),
+]
+
+
+class FakeController(object):
+
+    """Kytos controller without switches."""
+
+    def get_switch_by_dpid(self, dpid):
+        """No switch is connected."""
+        return None
+
+
+class FakeResponse(object):
+
+    """flow_manager response."""
+
+    text = "{}"
+
+    def __init__(self, status_code: int = 200) -> None:
+        """Constructor of FakeResponse."""
+        self.status_code = status_code
+
+
+class FakePusher(object):
+
+    """FlowPusher that keeps what it's asked to do."""
+
+    def __init__(self) -> None:
+        """Constructor of FakePusher."""
+        self.deleted = []
+        self.pushed = []
+        self.submitted = []
+        self.status_code = 200
+
+    def delete(self, dpid, flows):
+        """Keep the deleted flows."""
+        self.deleted.append((dpid, flows))
+
+    def push_many(self, flows):
+        """Keep the pushed flows."""
+        self.pushed.append(flows)
+        return {dpid: FakeResponse(self.status_code) for dpid in flows}
+
+    def submit(self, dpid, flows):
+        """Keep the submitted flows, it returns a done future."""
+        self.submitted.append(dpid)
+        future = Future()
+        future.set_result(FakeResponse(self.status_code))
+        return future
+
+
+class FakeInfluxDB(object):
+
+    """aioinflux client whose queries of some lanes fail."""
+
+    def __init__(self, errors=None, rollups=None) -> None:
+        """Constructor of FakeInfluxDB.
+
+        :errors: exception raised by the query of each failing probe
+        :rollups: mean, stddev, lost and sent of each probe, by default 10 ms
+            and no loss, None leaves a probe without series
+
+        """
+        self.errors = errors or {}
+        self.rollups = rollups or {}
+
+    async def query(self, query):
+        """Rollup of a lane."""
+        probe = query.split("'")[1]
+        if probe in self.errors:
+            raise self.errors[probe]
+        rollup = self.rollups.get(probe, (10.0, 1.0, 0, 100))
+        if rollup is None:
+            return {"results": [{"statement_id": 0}]}
+        return {"results": [{"series": [{"values": [[0, *rollup]]}]}]}
+
+
+class FakeLoop(object):
+
+    """Running event loop that keeps the callbacks it's given."""
+
+    def __init__(self) -> None:
+        """Constructor of FakeLoop."""
+        self.calls = []
+
+    def is_running(self):
+        """It's always running."""
+        return True
+
+    def call_soon_threadsafe(self, func, *args):
+        """Keep a callback."""
+        self.calls.append((func, args))
+
+    def run_in_executor(self, executor, func, *args):
+        """Keep a blocking call."""
+        self.calls.append((func, args))
+
+    def run_pending(self):
+        """Run the callbacks kept so far, and the ones they add."""
+        while self.calls:
+            func, args = self.calls.pop(0)
+            func(*args)
+
+
+@pytest.fixture
+def napp(monkeypatch):
+    """Main set up from the default settings.pairs, without Kytos running."""
+    monkeypatch.setattr(settings, "fast_path", False)
+    monkeypatch.setattr(settings, "forecast", None)
+    monkeypatch.setattr(settings, "path_count", 3)
+    napp = dvel_main.Main.__new__(dvel_main.Main)
+    napp.controller = FakeController()
+    napp.setup()
+    napp.flow_pusher.shutdown()
+    napp.flow_pusher = FakePusher()
+    napp.paths.sync(LINKS)
+    napp.route_pairs()
+    return napp
+
+
+def ports(pair):
+    """Port each lane leaves s3 from, None without hops."""
+    return {
+        index: lane.hops[0].out_port if lane.hops else None
+        for index, lane in pair.lanes.items()
+    }
+
+
+def test_lanes_take_the_paths_in_order(napp):
+    pair = napp.network.pairs["d1-d2"]
+    assert ports(pair) == {1: 2, 2: 3, 3: 4}
+
+
+def test_only_the_lane_of_a_failed_link_moves(napp):
+    pair = napp.network.pairs["d1-d2"]
+    lane1, lane2, lane3 = (pair.lanes[i].hops for i in (1, 2, 3))
+    napp.paths.remove_link("bb2")
+    napp.route_pairs()
+    assert ports(pair) == {1: 2, 2: None, 3: 4}
+    assert pair.lanes[1].hops is lane1
+    assert pair.lanes[3].hops is lane3
+    assert pair.lanes[2].down
+    assert napp.flow_pusher.deleted
+
+    napp.paths.add_link(BB2)
+    napp.route_pairs()
+    assert ports(pair) == {1: 2, 2: 3, 3: 4}
+    assert pair.lanes[1].hops is lane1
+    assert pair.lanes[2].hops == lane2
+    assert pair.lanes[3].hops is lane3
+
+
+def test_routing_is_skipped_when_paths_didnt_change(napp):
+    napp.flow_pusher.deleted.clear()
+    napp.route_pairs()
+    assert napp.flow_pusher.deleted == []
+
+
+def bring_up(napp, pair):
+    """Give every lane of a pair an rtt."""
+    for index, lane in pair.lanes.items():
+        napp._update_lane(lane, 10.0 * index)
+
+
+def test_fail_over_to_the_backup_lane(napp):
+    pair = napp.network.pairs["d1-d2"]
+    bring_up(napp, pair)
+    napp.fail_over(S3, 2)
+    assert pair.lanes[1].failed
+    assert pair.lanes[1].down
+    assert pair.active == 2
+    assert len(napp.flow_pusher.pushed) == 1
+
+
+def test_fail_over_runs_on_the_decision_loop(napp):
+    pair = napp.network.pairs["d1-d2"]
+    bring_up(napp, pair)
+    napp.loop = FakeLoop()
+    napp.fail_over(S3, 2)
+    napp.restore(S3, 2)
+    assert not pair.lanes[1].failed
+    assert pair.active == 1
+    napp.loop.run_pending()
+    assert not pair.lanes[1].failed
+    assert pair.active == 2
+    assert len(napp.flow_pusher.pushed) == 1
+
+
+class FakeEndpoint(object):
+
+    """Interface at one end of a kytos/topology link."""
+
+    def __init__(self, dpid: str, port: int) -> None:
+        """Constructor of FakeEndpoint."""
+        self.switch = type("Switch", (object,), {"dpid": dpid})()
+        self.port_number = port
+
+
+class FakeEvent(object):
+
+    """kytos/topology.link_down event of a Link."""
+
+    def __init__(self, link: Link) -> None:
+        """Constructor of FakeEvent."""
+        topo_link = type("TopoLink", (object,), {})()
+        topo_link.id = link.id
+        topo_link.endpoint_a = FakeEndpoint(link.dpid_a, link.port_a)
+        topo_link.endpoint_b = FakeEndpoint(link.dpid_b, link.port_b)
+        self.content = {"link": topo_link}
+
+
+@pytest.fixture
+def running_loop(napp):
+    """Decision loop running on a thread."""
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    napp.loop = loop
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5.0)
+    loop.close()
+
+
+def wait_until(ready, timeout=5.0):
+    """Wait until ready() is true."""
+    deadline = time.monotonic() + timeout
+    while not ready():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_link_down_fails_over_before_the_lane_is_rerouted(napp, running_loop):
+    pair = napp.network.pairs["d1-d2"]
+    bring_up(napp, pair)
+    lane1 = pair.lanes[1]
+    napp.on_link_down(FakeEvent(LINKS[2]))
+    wait_until(lambda: napp.flow_pusher.pushed and lane1.hops == [])
+    assert pair.active == 2
+    assert lane1.down
+    assert napp.flow_pusher.pushed == [
+        napp.network.host_flows(pair.lanes[2], pair.host_prio)
+    ]
+
+
+def test_changeover_to_a_failed_lane_is_dropped(napp):
+    pair = napp.network.pairs["d1-d2"]
+    bring_up(napp, pair)
+    pair.lanes[3].failed = True
+    body, status = napp._change_lane(pair.lanes[3])
+    assert status == 409
+    assert pair.active == 1
+    assert napp.flow_pusher.pushed == []
+
+
+def read_lanes(napp, client):
+    """Read the lanes from InfluxDB on a new loop."""
+
+    async def read():
+        napp.query_sem = asyncio.Semaphore(settings.query_concurrency)
+        return await napp._read_lanes_influx(client)
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(read())
+    finally:
+        loop.close()
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        InfluxDBError("database not found"),
+        aiohttp.client_exceptions.ServerDisconnectedError(),
+        asyncio.TimeoutError(),
+    ],
+)
+def test_a_failing_lane_query_keeps_its_metrics(napp, error):
+    pair = napp.network.pairs["d1-d2"]
+    bring_up(napp, pair)
+    pairs = read_lanes(napp, FakeInfluxDB({pair.lanes[2].probe: error}))
+    assert pairs == {pair}
+    assert pair.lanes[1].rtt == 10.0
+    assert pair.lanes[2].rtt == 20.0
+    assert pair.lanes[3].rtt == 10.0
+
+
+def test_switches_are_provisioned_on_handshake(napp):
+    assert napp.dpids == [S1, S2]
+    napp.switch_ready(S1)
+    assert not napp.all_ready.is_set()
+    napp.switch_ready(S2)
+    assert napp.all_ready.is_set()
+    assert napp.flow_pusher.submitted == [S1, S2]
+    timeline = napp.timeline
+    assert set(timeline["dpids"]) == {S1, S2}
+    for stages in timeline["dpids"].values():
+        assert stages["handshake"] <= stages["provisioned"]
+    assert timeline["all_provisioned"] == timeline["dpids"][S2]["provisioned"]
+
+
+def test_a_failed_provisioning_holds_the_decision_loop(napp):
+    napp.flow_pusher.status_code = 500
+    napp.switch_ready(S1)
+    napp.flow_pusher.status_code = 200
+    napp.switch_ready(S2)
+    assert not napp.all_ready.is_set()
+    assert "provisioned" not in napp.timeline["dpids"][S1]
+    napp.switch_ready(S1)
+    assert napp.all_ready.is_set()
+
+
+def test_unknown_dpids_arent_provisioned(napp):
+    assert napp.provision_evcs_dpid("00:00:00:00:00:00:00:09") is None
+    assert napp.flow_pusher.submitted == []
+
+
+class FakeTransport(object):
+
+    """Keep the datagrams sent through it."""
+
+    def __init__(self) -> None:
+        """Constructor of FakeTransport."""
+        self.sent = []
+
+    def sendto(self, data: bytes, addr) -> None:
+        """Keep a datagram."""
+        self.sent.append((data, addr))
+
+
+def test_probe_rates_are_sent_to_the_peer_of_each_probe():
+    protocol = dvel_main.IngestProtocol(StreamAggregator())
+    protocol.connection_made(FakeTransport())
+    protocol.datagram_received(b"d3 10.0\nd4 -\n", ("10.0.0.3", 5000))
+    protocol.datagram_received(b"d5 10.0\n", ("10.0.0.5", 5000))
+    assert protocol.wakeup.is_set()
+    protocol.send_rates({"d3": 10.0, "d4": 2.5, "d5": 100.0, "d9": 1.0})
+    assert protocol.transport.sent == [
+        (b"rate d3 10.000\nrate d4 2.500\n", ("10.0.0.3", 5000)),
+        (b"rate d5 100.000\n", ("10.0.0.5", 5000)),
+    ]
+
+
+def test_pushes_and_failovers_are_timed(napp):
+    pair = napp.network.pairs["d1-d2"]
+    bring_up(napp, pair)
+    napp._on_push(S3, 2.0)
+    napp.fail_over(S3, 2)
+    snapshot = napp.timer.snapshot()
+    assert snapshot["flow_push"]["count"] == 1
+    assert snapshot[f"flow_push.{S3}"]["max"] == 2.0
+    assert snapshot["failover"]["count"] == 1
+
+
+class FakeFastPath(object):
+
+    """FastPath that keeps the flows it replaces, or fails."""
+
+    def __init__(self, fail: bool = False) -> None:
+        """Constructor of FakeFastPath."""
+        self.fail = fail
+        self.replaced = []
+
+    def replace(self, new_flows, old_flows):
+        """Keep the flows, it returns a changeover of 1 and 2 ms per dpid."""
+        if self.fail:
+            raise FastPathError("switch 00:00:00:00:00:00:00:03 is not connected")
+        self.replaced.append((new_flows, old_flows))
+        return {dpid: {"install_ms": 1.0, "total_ms": 2.0} for dpid in new_flows}
+
+
+def test_change_lane_over_flow_manager(napp):
+    pair = napp.network.pairs["d1-d2"]
+    body, status = napp._change_lane(pair.lanes[2])
+    assert status == 200
+    assert pair.active == 2
+    assert napp.flow_pusher.pushed == [
+        napp.network.host_flows(pair.lanes[2], pair.host_prio)
+    ]
+
+
+def test_a_rejected_lane_change_keeps_the_lane(napp):
+    pair = napp.network.pairs["d1-d2"]
+    napp.flow_pusher.status_code = 500
+    body, status = napp._change_lane(pair.lanes[2])
+    assert status == 404
+    assert pair.active == 1
+
+
+def test_change_lane_over_the_fast_path(napp):
+    pair = napp.network.pairs["d1-d2"]
+    napp.fast_path = FakeFastPath()
+    prio = pair.host_prio
+    body, status = napp._change_lane(pair.lanes[3])
+    assert status == 200
+    assert pair.active == 3
+    assert pair.host_prio == napp.network.other_priority(prio)
+    assert body["changeover"] == {
+        S3: {"install_ms": 1.0, "total_ms": 2.0},
+        S4: {"install_ms": 1.0, "total_ms": 2.0},
+    }
+    ((new_flows, old_flows),) = napp.fast_path.replaced
+    new = napp.network.host_flows(pair.lanes[3], pair.host_prio)
+    old = napp.network.host_flows(pair.lanes[1], prio)
+    assert new_flows == {dpid: fset.flows for dpid, fset in new.items()}
+    assert old_flows == {dpid: fset.flows for dpid, fset in old.items()}
+    assert napp.flow_pusher.pushed == []
+    assert napp.timer.snapshot()[f"fastpath_total.{S3}"]["max"] == 2.0
+
+
+def test_change_lane_falls_back_to_flow_manager(napp):
+    pair = napp.network.pairs["d1-d2"]
+    napp.fast_path = FakeFastPath(fail=True)
+    prio = pair.host_prio
+    body, status = napp._change_lane(pair.lanes[2])
+    assert status == 200
+    assert pair.active == 2
+    assert pair.host_prio == prio
+    assert len(napp.flow_pusher.pushed) == 1
+
+
+def test_loss_is_read_along_with_the_rtt(napp):
+    pair = napp.network.pairs["d1-d2"]
+    bring_up(napp, pair)
+    lane1, lane2, lane3 = (pair.lanes[i] for i in (1, 2, 3))
+    rollups = {
+        lane1.probe: (12.0, 2.0, 5, 100),
+        lane2.probe: (None, None, 50, 50),
+        lane3.probe: None,
+    }
+    assert read_lanes(napp, FakeInfluxDB(rollups=rollups)) == {pair}
+    assert (lane1.rtt, lane1.jitter, lane1.pkt_loss) == (12.0, 2.0, 0.05)
+    assert not lane1.down
+    assert lane2.down
+    assert lane2.pkt_loss == 1.0
+    assert lane2.rtt == settings.max_rtt
+    assert not lane3.down
+    assert lane3.rtt == 30.0
+
+
+def test_a_lane_without_probes_sent_is_unknown(napp):
+    pair = napp.network.pairs["d1-d2"]
+    bring_up(napp, pair)
+    rollups = {lane.probe: (None, None, 0, 0) for lane in pair.lanes.values()}
+    assert read_lanes(napp, FakeInfluxDB(rollups=rollups)) == set()
+    assert not any(lane.down for lane in pair.lanes.values())
+
+
+class FakeRetentionDB(object):
+
+    """aioinflux client whose policies and continuous query already exist."""
+
+    def __init__(self) -> None:
+        """Constructor of FakeRetentionDB."""
+        self.queries = []
+
+    async def query(self, query):
+        """Keep a statement, creating a policy or dropping the query fails."""
+        self.queries.append(query)
+        if query.startswith(("CREATE RETENTION", "DROP")):
+            raise InfluxDBError("retention policy already exists")
+        return {"results": [{"statement_id": 0}]}
+
+
+def test_retention_is_set_up_past_the_expected_failures(napp, monkeypatch):
+    monkeypatch.setattr(
+        settings, "retention", {"raw": "2d", "rollup": "4w", "interval": "5m"}
+    )
+    client = FakeRetentionDB()
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(napp._setup_retention(client))
+    finally:
+        loop.close()
+    assert client.queries == retention.statements(napp.db_name, "2d", "4w", "5m")
+
+
+def test_pairs_are_created_on_the_decision_loop(napp, running_loop):
+    edges = [
+        {"dpid": S1, "host_port": 5, "uplink_port": 2},
+        {"dpid": S2, "host_port": 5, "uplink_port": 2},
+    ]
+    loops = []
+    add_pair = napp.add_pair
+
+    def record_loop(name, attrs):
+        loops.append(asyncio.get_running_loop())
+        return add_pair(name, attrs)
+
+    napp.add_pair = record_loop
+    bad = {"edges": edges, "lanes": [{"probe": "x1"}, {"probe": "d3"}]}
+    with pytest.raises(ValueError):
+        napp._call_on_loop(napp._create_pair, "bad", bad)
+    assert "bad" not in napp.network.pairs
+    assert "x1" not in napp.network.lanes_by_probe
+    for pair in napp.network.pairs.values():
+        napp.optimizer.decide(pair)
+
+    good = {"edges": edges, "lanes": [{"probe": "x1"}, {"probe": "x2"}]}
+    pair = napp._call_on_loop(napp._create_pair, "good", good)
+    assert napp.network.pairs["good"] is pair
+    assert loops == [running_loop] * 2
+    wait_until(lambda: all(lane.hops for lane in pair.lanes.values()))
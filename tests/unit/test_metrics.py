@@ -0,0 +1,81 @@
+"""Tests of the stage latency histograms."""
+
+import pytest
+
+from napps.viniarck.dvel.metrics import Histogram, StageTimer
+
+
+def test_empty_histogram():
+    assert Histogram().as_dict() == {
+        "count": 0,
+        "mean": None,
+        "min": None,
+        "max": None,
+        "p50": None,
+        "p90": None,
+        "p99": None,
+    }
+
+
+def test_percentiles_are_within_the_resolution():
+    histogram = Histogram(resolution=0.02)
+    for value in range(1, 1001):
+        histogram.add(value / 10.0)
+    summary = histogram.as_dict()
+    assert summary["count"] == 1000
+    assert summary["mean"] == pytest.approx(50.05)
+    assert summary["min"] == 0.1
+    assert summary["max"] == 100.0
+    assert summary["p50"] == pytest.approx(50.0, rel=0.02)
+    assert summary["p99"] == pytest.approx(99.0, rel=0.02)
+
+
+def test_percentiles_are_clamped_to_the_values_seen():
+    histogram = Histogram()
+    histogram.add(5.0)
+    assert histogram.percentile(0) == 5.0
+    assert histogram.percentile(100) == 5.0
+    histogram.add(1e-4)
+    assert histogram.percentile(0) == 1e-4
+
+
+def test_values_out_of_range_fall_in_the_end_buckets():
+    histogram = Histogram(max_value=1e3)
+    histogram.add(1.0)
+    histogram.add(1e9)
+    assert histogram.percentile(100) == pytest.approx(1e3, rel=0.02)
+    assert histogram.max == 1e9
+
+
+def test_stage_timer():
+    timer = StageTimer()
+    with timer.time("changeover"):
+        pass
+    timer.observe("push.s3", 2.0)
+    timer.observe("push.s3", 4.0)
+    snapshot = timer.snapshot()
+    assert set(snapshot) == {"changeover", "push.s3"}
+    assert snapshot["changeover"]["count"] == 1
+    assert snapshot["changeover"]["min"] >= 0.0
+    assert snapshot["push.s3"]["mean"] == 3.0
+    timer.reset()
+    assert timer.snapshot() == {}
+
+
+def test_a_block_that_raises_is_timed():
+    timer = StageTimer()
+    with pytest.raises(RuntimeError):
+        with timer.time("failover"):
+            raise RuntimeError("failed")
+    assert timer.snapshot()["failover"]["count"] == 1
+
+
+def test_points():
+    timer = StageTimer()
+    timer.observe("decide", 1.5)
+    (point,) = timer.points()
+    assert point["measurement"] == "dvel_latency"
+    assert point["tags"] == {"stage": "decide"}
+    assert point["fields"]["p99"] == pytest.approx(1.5)
+    assert all(isinstance(v, float) for v in point["fields"].values())
+    assert point["time"] > 0
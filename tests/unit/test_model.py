@@ -0,0 +1,217 @@
+"""Tests of the DTN pairs, lanes and their flows."""
+
+import pytest
+
+from napps.viniarck.dvel.flowpusher import serialize
+from napps.viniarck.dvel.model import Allocator, Hop, Network
+
+S1 = "00:00:00:00:00:00:00:01"
+S2 = "00:00:00:00:00:00:00:02"
+S3 = "00:00:00:00:00:00:00:03"
+S4 = "00:00:00:00:00:00:00:04"
+
+
+def edges(first=S1, second=S2):
+    """Edges of a pair, the host on port 1 and the uplink on port 2."""
+    return [
+        {"dpid": first, "host_port": 1, "uplink_port": 2},
+        {"dpid": second, "host_port": 1, "uplink_port": 2},
+    ]
+
+
+def lanes(*probes, ports=(2, 3)):
+    """Lanes pinned through s3 and s4, one backbone port each."""
+    return [
+        {
+            "probe": probe,
+            "hops": [[S3, 1, port], [S4, port, 1]],
+            "bandwidth": 100.0,
+        }
+        for probe, port in zip(probes, ports)
+    ]
+
+
+def network():
+    """Network of a d1-d2 pair with two pinned lanes."""
+    net = Network()
+    net.add_pair("d1-d2", edges(), lanes("d3", "d4"))
+    return net
+
+
+def test_flow_sets_carry_their_serialized_flows():
+    net = network()
+    for dpid in (S1, S3):
+        fset = net.static_flows(dpid)
+        assert fset.payload == serialize(fset.flows)
+    fset = net.host_flows(net.lane("d1-d2", 1), net.host_priorities[0])[S3]
+    assert fset.payload == serialize(fset.flows)
+
+
+def test_precompute_caches_every_flow_set():
+    net = network()
+    net.precompute()
+    assert set(net._static) == {S1, S2, S3, S4}
+    assert len(net._host) == 2 * len(net.host_priorities)
+    assert net.static_flows(S3) is net._static[S3]
+    lane = net.lane("d1-d2", 2)
+    assert net.host_flows(lane, 0x8001) is net._host[("d1-d2", 2, 0x8001)]
+
+
+def test_dpid_flows_add_the_host_evc_of_the_active_lane():
+    net = network()
+    pair = net.pairs["d1-d2"]
+    static, host = net.dpid_flows(S3)
+    assert static is net.static_flows(S3)
+    assert host is net.host_flows(pair.lanes[1], pair.host_prio)[S3]
+    assert len(net.dpid_flows(S1)) == 1
+
+
+def test_adding_a_pair_only_drops_the_caches_of_its_dpids():
+    net = network()
+    net.precompute()
+    backbone = net.static_flows(S3)
+    net.add_pair("d5-d6", edges(S1, "00:00:00:00:00:00:00:06"), lanes("d7"))
+    assert S1 not in net._static
+    assert S2 in net._static
+    assert S3 not in net._static
+    assert net.static_flows(S3) is not backbone
+
+
+def test_allocator_reuses_the_lowest_released_number():
+    vlans = Allocator(100, 102, name="VLAN")
+    assert [vlans.allocate() for _ in range(3)] == [100, 101, 102]
+    with pytest.raises(ValueError):
+        vlans.allocate()
+    vlans.release(101)
+    vlans.release(100)
+    assert vlans.allocate() == 100
+    assert vlans.allocate() == 101
+
+
+def test_add_pair_allocates_vlans_and_probe_ports():
+    net = network()
+    pair = net.pairs["d1-d2"]
+    assert [lane.vlan for lane in pair.lanes.values()] == [100, 101]
+    assert pair.host_vlan == 102
+    assert [lane.probe_ports for lane in pair.lanes.values()] == [(3, 3), (4, 4)]
+    assert not pair.dynamic
+    assert net.lanes_by_probe["d4"] is pair.lanes[2]
+    assert net.lanes_by_dpid[S3] == set(pair.lanes.values())
+    assert net.pairs_by_dpid[S1] == {pair}
+    assert net.dpids() == {S1, S2, S3, S4}
+
+
+@pytest.mark.parametrize(
+    "name, pair_edges, pair_lanes",
+    [
+        ("d1-d2", edges(), lanes("d7")),
+        ("d5-d6", edges()[:1], lanes("d7")),
+        ("d5-d6", edges(), lanes("d3")),
+    ],
+)
+def test_invalid_pairs(name, pair_edges, pair_lanes):
+    net = network()
+    with pytest.raises(ValueError):
+        net.add_pair(name, pair_edges, pair_lanes)
+
+
+@pytest.mark.parametrize(
+    "bad_lane, error",
+    [
+        ({"probe": "d3"}, ValueError),
+        ({"probe": "d7"}, ValueError),
+        ({"probe": "d8", "hops": [[S3, 1]]}, TypeError),
+        ({"hops": [[S3, 1, 2]]}, KeyError),
+    ],
+)
+def test_an_invalid_lane_leaves_the_network_untouched(bad_lane, error):
+    net = network()
+    dpids = net.dpids()
+    with pytest.raises(error):
+        net.add_pair("bad", edges(S1, S4), lanes("d7") + [bad_lane])
+    assert "bad" not in net.pairs
+    assert set(net.lanes_by_probe) == {"d3", "d4"}
+    assert net.dpids() == dpids
+    pair = net.add_pair("d5-d6", edges(S1, S4), lanes("d7"))
+    assert pair.lanes[1].vlan == 103
+    assert pair.lanes[1].probe_ports == (5, 3)
+
+
+def test_exhausted_vlans_are_given_back():
+    net = Network(vlan_range=(100, 103))
+    net.add_pair("d1-d2", edges(), lanes("d3"))
+    with pytest.raises(ValueError):
+        net.add_pair("d5-d6", edges(), lanes("d7", "d8"))
+    assert net.add_pair("d5-d6", edges(), lanes("d7")).host_vlan == 103
+
+
+def test_remove_pair_releases_what_it_allocated():
+    net = network()
+    net.remove_pair("d1-d2")
+    assert net.dpids() == set()
+    assert net.lanes_by_probe == {}
+    assert net._host == {}
+    pair = net.add_pair("d5-d6", edges(), lanes("d7", "d8"))
+    assert [lane.vlan for lane in pair.lanes.values()] == [100, 101]
+    assert [lane.probe_ports for lane in pair.lanes.values()] == [(3, 3), (4, 4)]
+
+
+def test_dynamic_pairs_get_their_hops_later():
+    net = Network()
+    pair = net.add_pair("d1-d2", edges(), [{"probe": "d3"}, {"probe": "d4"}])
+    assert pair.dynamic
+    assert net.dpids() == {S1, S2}
+    lane = pair.lanes[1]
+    lane.failed = True
+    assert net.set_hops(lane, [Hop(S3, 1, 2), Hop(S4, 2, 1)]) == {}
+    assert not lane.failed
+    assert net.lanes_by_dpid[S3] == {lane}
+    stale = net.set_hops(lane, [Hop(S3, 1, 5), Hop(S4, 2, 1)])
+    assert set(stale) == {S3}
+    # lane and host EVC flows, both directions
+    assert len(stale[S3]) == 4
+    assert net.lanes_at(S3, 5) == [lane]
+    assert net.lanes_at(S3, 2) == []
+
+
+def test_edge_and_hop_flows():
+    net = network()
+    pair = net.pairs["d1-d2"]
+    flows = net.static_flows(S1).flows
+    # push and pop flows of the two probes and of the host
+    assert len(flows) == 6
+    assert flows[0] == {
+        "match": {"in_port": 3},
+        "actions": [
+            {"action_type": "push_vlan", "tag_type": 1},
+            {"action_type": "set_vlan", "vlan_id": 100},
+            {"action_type": "output", "port": 2},
+        ],
+    }
+    assert flows[-1] == {
+        "match": {"in_port": 2, "dl_vlan": pair.host_vlan},
+        "actions": [{"action_type": "pop_vlan"}, {"action_type": "output", "port": 1}],
+    }
+    host = net.host_flows(pair.lanes[2], 0x8001)
+    assert set(host) == {S3, S4}
+    assert host[S3].flows[0] == {
+        "match": {"in_port": 1, "dl_vlan": pair.host_vlan},
+        "actions": [
+            {"action_type": "set_vlan", "vlan_id": pair.host_vlan},
+            {"action_type": "output", "port": 3},
+        ],
+        "priority": 0x8001,
+    }
+
+
+def test_backup_prefers_the_standby_lane():
+    net = Network()
+    pair = net.add_pair("d1-d2", edges(), lanes("d3", "d4", "d5", ports=(2, 3, 4)))
+    assert pair.backup() is pair.lanes[2]
+    pair.standby = 3
+    assert pair.backup() is pair.lanes[3]
+    pair.lanes[3].down = True
+    assert pair.backup() is pair.lanes[2]
+    pair.lanes[2].down = True
+    assert pair.backup() is None
+    assert net.other_priority(0x8000) == 0x8001
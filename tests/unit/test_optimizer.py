@@ -0,0 +1,142 @@
+"""Tests of the lane optimizer."""
+
+import pytest
+
+from napps.viniarck.dvel.aggregator import StreamAggregator
+from napps.viniarck.dvel.model import Network
+from napps.viniarck.dvel.optimizer import LaneOptimizer
+from napps.viniarck.dvel.scoring import LowestLatency
+
+EDGES = (
+    {"dpid": "00:00:00:00:00:00:00:01", "host_port": 1, "uplink_port": 2},
+    {"dpid": "00:00:00:00:00:00:00:02", "host_port": 1, "uplink_port": 2},
+)
+DAMPING = {"hysteresis": 0.2, "min_dwell": 5.0, "holddown": 0.0}
+
+
+class FakeForecaster(object):
+
+    """Forecaster of fixed rtts and loss rates."""
+
+    def __init__(self, forecasts) -> None:
+        """Constructor of FakeForecaster."""
+        self.forecasts = forecasts
+        self.added = []
+
+    def add(self, key, now, rtt, loss) -> None:
+        """Keep a sample."""
+        self.added.append((key, now, rtt, loss))
+
+    def predict(self):
+        """The fixed forecasts."""
+        return self.forecasts
+
+
+def make_optimizer(forecaster=None):
+    """LaneOptimizer of a pair with three lanes, d3 to d5."""
+    network = Network()
+    pair = network.add_pair(
+        "d1-d2", EDGES, [{"probe": probe} for probe in ("d3", "d4", "d5")]
+    )
+    optimizer = LaneOptimizer(
+        network, LowestLatency(), 1e4, DAMPING, forecaster=forecaster
+    )
+    optimizer.add_pair(pair)
+    return optimizer, pair
+
+
+def measure(optimizer, pair, rtts, now=0.0):
+    """Update the lanes of a pair with rtts, in lane order."""
+    for lane, rtt in zip(pair.lanes.values(), rtts):
+        optimizer.update(lane, rtt, 0.0, 0.0, now)
+
+
+def test_lanes_start_unmeasured():
+    _, pair = make_optimizer()
+    assert [lane.rtt for lane in pair.lanes.values()] == [1e4] * 3
+
+
+def test_decide_moves_to_a_better_lane_past_the_hysteresis():
+    optimizer, pair = make_optimizer()
+    measure(optimizer, pair, [10.0, 9.0, 20.0])
+    assert optimizer.decide(pair, 0.0) is None
+    assert pair.standby == 2
+    measure(optimizer, pair, [10.0, 5.0, 20.0])
+    assert optimizer.decide(pair, 0.0) == 2
+
+
+def test_decide_is_damped_by_the_dwell_time():
+    optimizer, pair = make_optimizer()
+    measure(optimizer, pair, [10.0, 5.0, 20.0])
+    pair.active = optimizer.decide(pair, 0.0)
+    measure(optimizer, pair, [2.0, 5.0, 20.0])
+    assert optimizer.decide(pair, 1.0) is None
+    assert optimizer.decide(pair, 6.0) == 1
+
+
+def test_a_lane_without_rtt_goes_down_once():
+    optimizer, pair = make_optimizer()
+    measure(optimizer, pair, [10.0, 20.0, 30.0])
+    lane = pair.lanes[1]
+    assert optimizer.update(lane, None, now=1.0)
+    assert lane.down
+    assert lane.rtt == 1e4
+    assert lane.pkt_loss == 1.0
+    assert not optimizer.update(lane, None, now=2.0)
+    assert optimizer.rates.lanes["d3"].boost_until > 2.0
+    assert optimizer.decide(pair, 2.0) == 2
+    assert not optimizer.update(lane, 10.0, now=3.0)
+    assert not lane.down
+
+
+def test_failed_lanes_stay_down():
+    optimizer, pair = make_optimizer()
+    lane = pair.lanes[1]
+    lane.failed = True
+    optimizer.update(lane, 10.0)
+    assert lane.down
+
+
+def test_read_stream_only_updates_lanes_with_news():
+    optimizer, pair = make_optimizer()
+    aggregator = StreamAggregator(window=3.0)
+    aggregator.add("d3", 10.0, 0.0)
+    aggregator.add("d4", None, 0.0)
+    aggregator.add("d9", 10.0, 0.0)
+    assert optimizer.read_stream(aggregator, "mean", 0.5) == {pair}
+    assert pair.lanes[1].rtt == 10.0
+    assert pair.lanes[2].down
+    assert pair.lanes[3].rtt == 1e4
+    assert optimizer.read_stream(aggregator, "mean", 1.0) == set()
+
+
+def test_forecasts_only_make_lanes_look_worse():
+    forecaster = FakeForecaster({"d3": (30.0, 0.1), "d4": (5.0, 0.0)})
+    optimizer, pair = make_optimizer(forecaster)
+    measure(optimizer, pair, [10.0, 20.0, 40.0], now=1.0)
+    assert forecaster.added[0] == ("d3", 1.0, 10.0, 0.0)
+    optimizer.forecast()
+    assert optimizer.metrics(pair.lanes[1]).rtt == 30.0
+    assert optimizer.metrics(pair.lanes[1]).loss == 0.1
+    assert optimizer.metrics(pair.lanes[2]).rtt == 20.0
+    assert optimizer.decide(pair, 1.0) == 2
+
+
+def test_force_switch_is_counted_and_starts_the_dwell():
+    optimizer, pair = make_optimizer()
+    measure(optimizer, pair, [10.0, 5.0, 20.0])
+    optimizer.force_switch(pair, 0.0)
+    damper = optimizer.dampers["d1-d2"]
+    assert damper.counters["forced"] == 1
+    assert damper.counters["switches"] == 1
+    assert optimizer.decide(pair, 1.0) is None
+    assert damper.counters["suppressed_dwell"] == 1
+
+
+def test_decide_updates_the_probe_rates():
+    optimizer, pair = make_optimizer()
+    measure(optimizer, pair, [10.0, 10.5, 40.0])
+    optimizer.decide(pair, 0.0)
+    rates = optimizer.rates.rates(0.0)
+    assert rates["d4"] > rates["d5"]
+    assert sum(rates.values()) == pytest.approx(optimizer.rates.budget)
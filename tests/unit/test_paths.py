@@ -0,0 +1,188 @@
+"""Tests of the candidate paths and of the lane path assignment."""
+
+from napps.viniarck.dvel.model import Hop
+from napps.viniarck.dvel.paths import Link, PathCache, Step, assign, hops
+
+S3 = "00:00:00:00:00:00:00:03"
+S4 = "00:00:00:00:00:00:00:04"
+S5 = "00:00:00:00:00:00:00:05"
+
+
+def backbone(k=3):
+    """Three parallel links between s3 and s4, and a longer one over s5."""
+    cache = PathCache(k)
+    cache.sync(
+        [
+            Link("bb1", S3, 2, S4, 2),
+            Link("bb2", S3, 3, S4, 3),
+            Link("bb3", S3, 4, S4, 4),
+            Link("bb4", S3, 5, S5, 1, 2.0),
+            Link("bb5", S5, 2, S4, 5, 2.0),
+        ]
+    )
+    return cache
+
+
+def link_ids(paths):
+    """Link ids of each path."""
+    return [[step.link_id for step in path] for path in paths]
+
+
+def test_k_shortest_link_disjoint_paths():
+    cache = backbone()
+    assert link_ids(cache.paths(S3, S4)) == [["bb1"], ["bb2"], ["bb3"]]
+    assert link_ids(backbone(k=5).paths(S3, S4)) == [
+        ["bb1"],
+        ["bb2"],
+        ["bb3"],
+        ["bb4", "bb5"],
+    ]
+
+
+def test_paths_are_cached():
+    cache = backbone()
+    first = cache.paths(S3, S4)
+    assert cache.paths(S3, S4) is first
+    assert cache.counters["hits"] == 1
+    assert cache.counters["misses"] == 1
+
+
+def test_excluded_dpids():
+    cache = backbone(k=5)
+    assert link_ids(cache.paths(S3, S4, exclude={S5})) == [["bb1"], ["bb2"], ["bb3"]]
+
+
+def test_single_switch_and_unreachable():
+    cache = backbone()
+    assert cache.paths(S3, S3) == [[]]
+    assert cache.paths(S3, "00:00:00:00:00:00:00:09") == []
+
+
+def test_removing_a_link_only_invalidates_its_paths():
+    cache = backbone()
+    cache.paths(S3, S4)
+    cache.paths(S3, S5, exclude={S4})
+    assert cache.remove_link("bb2") == {(S3, S4, frozenset())}
+    assert link_ids(cache.paths(S3, S4)) == [["bb1"], ["bb3"], ["bb4", "bb5"]]
+    assert cache.remove_link("missing") == set()
+
+
+def test_adding_a_longer_link_keeps_full_entries():
+    cache = backbone()
+    cache.paths(S3, S4)
+    assert cache.add_link(Link("bb6", S3, 6, S4, 6, 5.0)) == set()
+    assert cache.add_link(Link("bb6", S3, 6, S4, 6, 5.0)) == set()
+
+
+def test_adding_a_shorter_link_invalidates():
+    cache = backbone()
+    cache.paths(S3, S4)
+    assert cache.add_link(Link("bb6", S3, 6, S4, 6, 0.5)) == {(S3, S4, frozenset())}
+    assert link_ids(cache.paths(S3, S4)) == [["bb6"], ["bb1"], ["bb2"]]
+
+
+def test_adding_a_link_invalidates_entries_short_of_k():
+    cache = backbone(k=5)
+    cache.paths(S3, S4)
+    assert cache.add_link(Link("bb6", S3, 6, S4, 6, 9.0)) == {(S3, S4, frozenset())}
+
+
+def test_sync_applies_the_diff():
+    cache = backbone()
+    cache.paths(S3, S4)
+    links = [link for link in cache.links.values() if link.id != "bb3"]
+    assert cache.sync(links) == {(S3, S4, frozenset())}
+    assert "bb3" not in cache.links
+    assert cache.sync(links) == set()
+
+
+def test_neighbor():
+    cache = backbone()
+    assert cache.neighbor(S3, 2) == (S4, 2)
+    assert cache.neighbor(S4, 5) == (S5, 2)
+    cache.remove_link("bb1")
+    assert cache.neighbor(S3, 2) is None
+
+
+def test_hops_of_a_path():
+    steps = [Step("bb4", S3, 5, S5, 1), Step("bb5", S5, 2, S4, 5)]
+    assert hops(steps, 1, 7) == [Hop(S3, 1, 5), Hop(S5, 1, 2), Hop(S4, 5, 7)]
+    assert hops([], 1, 7) == []
+
+
+def candidates(cache):
+    """Hops of the paths between s3 and s4."""
+    return [hops(path, 1, 1) for path in cache.paths(S3, S4)]
+
+
+def ports(assigned):
+    """Port each lane leaves s3 from, None without hops."""
+    return {i: lane[0].out_port if lane else None for i, lane in assigned.items()}
+
+
+def test_assign_lanes_in_order_first():
+    cache = backbone()
+    assigned = assign({1: [], 2: [], 3: []}, candidates(cache))
+    assert ports(assigned) == {1: 2, 2: 3, 3: 4}
+
+
+def test_assign_keeps_lanes_whose_path_still_exists():
+    cache = backbone()
+    current = assign({1: [], 2: [], 3: []}, candidates(cache))
+    cache.remove_link("bb2")
+    down = assign(current, candidates(cache))
+    assert ports(down) == {1: 2, 2: 5, 3: 4}
+    assert down[1] is current[1]
+    assert down[3] is current[3]
+    cache.add_link(Link("bb2", S3, 3, S4, 3))
+    up = assign(down, candidates(cache))
+    assert ports(up) == {1: 2, 2: 3, 3: 4}
+
+
+def test_assign_leaves_lanes_without_a_path_out():
+    cache = backbone()
+    current = assign({1: [], 2: [], 3: []}, candidates(cache))
+    cache.remove_link("bb4")
+    cache.remove_link("bb2")
+    assert ports(assign(current, candidates(cache))) == {1: 2, 2: None, 3: 4}
+
+
+def test_assign_doesnt_give_a_path_to_two_lanes():
+    path = [Hop(S3, 1, 2), Hop(S4, 2, 1)]
+    assigned = assign({1: path, 2: list(path)}, [path])
+    assert assigned == {1: path, 2: []}
+
+
+def chain_links():
+    """Links of a path from s3 to s4 over s5, shorter than the direct one."""
+    return [Link("s3-s5", S3, 7, S5, 3), Link("s5-s4", S5, 4, S4, 7)]
+
+
+def test_chained_additions_invalidate_longer_paths():
+    cache = PathCache(1)
+    cache.sync([Link("direct", S3, 2, S4, 2, 10.0)])
+    assert link_ids(cache.paths(S3, S4)) == [["direct"]]
+    first, second = chain_links()
+    assert cache.add_link(first) == set()
+    assert cache.add_link(second) == {(S3, S4, frozenset())}
+    assert link_ids(cache.paths(S3, S4)) == [["s3-s5", "s5-s4"]]
+
+
+def test_sync_of_chained_links_invalidates_longer_paths():
+    cache = PathCache(1)
+    direct = Link("direct", S3, 2, S4, 2, 10.0)
+    cache.sync([direct])
+    cache.paths(S3, S4)
+    cache.sync([direct] + chain_links())
+    fresh = PathCache(1)
+    fresh.sync([direct] + chain_links())
+    assert cache.paths(S3, S4) == fresh.paths(S3, S4)
+
+
+def test_added_links_dont_lower_distances_through_excluded_dpids():
+    cache = PathCache(1)
+    cache.sync([Link("direct", S3, 2, S4, 2, 10.0)])
+    cache.paths(S3, S4, exclude={S5})
+    for link in chain_links():
+        assert cache.add_link(link) == set()
+    assert link_ids(cache.paths(S3, S4, exclude={S5})) == [["direct"]]
@@ -0,0 +1,72 @@
+"""Tests of the adaptive probe rates."""
+
+import math
+
+import pytest
+
+from napps.viniarck.dvel.ratecontrol import ProbeRateController, switch_gaps
+
+
+def test_switch_gaps():
+    gaps = switch_gaps({"d3": 10.0, "d4": 9.0, "d5": 20.0}, "d3", hysteresis=0.2)
+    assert gaps["d4"] == pytest.approx(0.08)
+    assert gaps["d5"] == pytest.approx(1.4)
+    assert gaps["d3"] == gaps["d4"]
+
+
+def test_switch_gaps_of_unreachable_lanes():
+    gaps = switch_gaps({"d3": 10.0, "d4": math.inf}, "d3")
+    assert gaps == {"d3": math.inf, "d4": math.inf}
+    assert switch_gaps({"d3": 10.0}, "d3") == {"d3": math.inf}
+
+
+def test_rates_stay_within_the_budget_and_bounds():
+    controller = ProbeRateController(budget=100.0, min_rate=10.0, max_rate=50.0)
+    for lane in ("d3", "d4", "d5"):
+        controller.add(lane)
+    rates = controller.rates(0.0)
+    assert rates == pytest.approx({"d3": 100 / 3, "d4": 100 / 3, "d5": 100 / 3})
+    controller.update("d3", 10.0, 0.0, gap=0.0)
+    rates = controller.rates(0.0)
+    assert sum(rates.values()) == pytest.approx(100.0)
+    assert rates["d3"] > rates["d4"] == pytest.approx(rates["d5"])
+
+
+def test_capped_lanes_leave_the_spare_budget_to_the_others():
+    controller = ProbeRateController(budget=100.0, min_rate=10.0, max_rate=40.0)
+    for lane in ("d3", "d4", "d5"):
+        controller.add(lane)
+    controller.boost("d3", now=0.0)
+    rates = controller.rates(1.0)
+    assert rates["d3"] == 40.0
+    assert rates["d4"] == pytest.approx(30.0)
+    assert rates["d5"] == pytest.approx(30.0)
+
+
+def test_every_lane_gets_its_min_rate():
+    controller = ProbeRateController(budget=15.0, min_rate=10.0)
+    controller.add("d3")
+    controller.add("d4")
+    assert controller.rates(0.0) == {"d3": 7.5, "d4": 7.5}
+
+
+def test_urgency():
+    controller = ProbeRateController(closeness=0.1, boost=8.0, boost_time=5.0)
+    controller.add("d3")
+    state = controller.lanes["d3"]
+    assert controller.urgency(state, 0.0) == 1.0
+    controller.update("d3", 10.0, 5.0, gap=0.1)
+    assert controller.urgency(state, 0.0) == pytest.approx(2.0)
+    controller.boost("d3", now=0.0)
+    assert controller.urgency(state, 4.9) == pytest.approx(10.0)
+    assert controller.urgency(state, 5.0) == pytest.approx(2.0)
+
+
+def test_unknown_lanes_are_ignored():
+    controller = ProbeRateController()
+    controller.update("d3", 10.0, 1.0)
+    controller.boost("d3")
+    controller.add("d4")
+    controller.remove("d4")
+    controller.remove("d4")
+    assert controller.rates() == {}
@@ -0,0 +1,21 @@
+"""Tests of the retention statements."""
+
+from napps.viniarck.dvel import retention
+
+
+def test_statements():
+    statements = retention.statements("dvel", "1d", "52w", "1m")
+    assert statements[:5] == [
+        'CREATE RETENTION POLICY "dvel_raw" ON "dvel" '
+        "DURATION 1d REPLICATION 1 DEFAULT",
+        'ALTER RETENTION POLICY "dvel_raw" ON "dvel" DURATION 1d DEFAULT',
+        'CREATE RETENTION POLICY "dvel_rollup" ON "dvel" '
+        "DURATION 52w REPLICATION 1",
+        'ALTER RETENTION POLICY "dvel_rollup" ON "dvel" DURATION 52w',
+        'DROP CONTINUOUS QUERY "dvel_rollup" ON "dvel"',
+    ]
+    query = statements[5]
+    assert query.startswith('CREATE CONTINUOUS QUERY "dvel_rollup" ON "dvel" BEGIN ')
+    assert 'INTO "dvel_rollup"."rollup" FROM "dvel_raw"."rollup"' in query
+    assert 'max("p99") AS "p99"' in query
+    assert query.endswith("GROUP BY time(1m), * END")
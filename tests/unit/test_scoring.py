@@ -0,0 +1,87 @@
+"""Tests of the lane scoring policies."""
+
+import math
+
+import pytest
+
+from napps.viniarck.dvel.scoring import (
+    LaneMetrics,
+    LowestLatency,
+    MaxThroughput,
+    Weighted,
+    make_policy,
+    select_lane,
+)
+
+
+def test_lowest_latency_inflates_the_rtt_by_the_loss():
+    policy = LowestLatency()
+    assert policy.cost(LaneMetrics(10.0)) == 10.0
+    assert policy.cost(LaneMetrics(10.0, 0.5)) == 20.0
+    assert policy.cost(LaneMetrics(10.0, 1.0)) == math.inf
+
+
+def test_max_throughput_is_capped_by_the_bandwidth():
+    policy = MaxThroughput()
+    assert policy.throughput(LaneMetrics(1.0, 0.0, 0.0, 100.0)) == 100.0
+    assert policy.cost(LaneMetrics(1.0, 0.0, 0.0, 100.0)) == pytest.approx(0.01)
+
+
+def test_max_throughput_is_window_limited():
+    policy = MaxThroughput(window=2 ** 20, rtt_factor=1.0)
+    throughput = policy.throughput(LaneMetrics(100.0, 0.0, 0.0, 1e6))
+    assert throughput == pytest.approx(2 ** 20 * 8 / 0.1 / 1e6)
+
+
+def test_max_throughput_follows_the_mathis_model():
+    policy = MaxThroughput(mss=1460, rtt_factor=1.0)
+    throughput = policy.throughput(LaneMetrics(100.0, 0.01, 0.0, 1e6))
+    assert throughput == pytest.approx(1460 * 8 / 0.1 * math.sqrt(1.5) / 0.1 / 1e6)
+
+
+@pytest.mark.parametrize("bandwidth", [0.0, -1.0])
+def test_max_throughput_of_unknown_bandwidth_is_unbounded(bandwidth):
+    policy = MaxThroughput()
+    unknown = LaneMetrics(10.0, 0.0, 0.0, bandwidth)
+    assert policy.throughput(unknown) == policy.throughput(
+        LaneMetrics(10.0, 0.0, 0.0, math.inf)
+    )
+    assert policy.cost(unknown) < math.inf
+    assert policy.throughput(LaneMetrics(0.0, 0.0, 0.0, bandwidth)) == math.inf
+
+
+def test_max_throughput_prefers_the_lane_with_less_loss():
+    policy = MaxThroughput()
+    clean = policy.cost(LaneMetrics(20.0, 0.0, 0.0, 0.0))
+    lossy = policy.cost(LaneMetrics(10.0, 0.05, 0.0, 0.0))
+    assert clean < lossy
+
+
+def test_weighted_sum():
+    policy = Weighted(rtt=1.0, loss=10.0, jitter=2.0, bandwidth=1.0)
+    metrics = LaneMetrics(10.0, 0.01, 3.0, 500.0)
+    assert policy.cost(metrics) == pytest.approx(10.0 + 10.0 + 6.0 + 2.0)
+
+
+def test_weighted_skips_the_bandwidth_term_when_unknown():
+    policy = Weighted(bandwidth=1.0)
+    assert policy.cost(LaneMetrics(10.0, 0.0, 0.0, 0.0)) == pytest.approx(10.0)
+
+
+def test_make_policy():
+    policy = make_policy("max_throughput", mss=9000)
+    assert isinstance(policy, MaxThroughput)
+    assert policy.mss == 9000
+    with pytest.raises(ValueError):
+        make_policy("cheapest")
+
+
+def test_select_lane_keeps_the_current_lane_within_the_margin():
+    assert select_lane({1: 10.0, 2: 9.0}, 1, margin=0.2) == 1
+    assert select_lane({1: 10.0, 2: 8.0}, 1, margin=0.2) == 2
+    assert select_lane({1: 10.0, 2: 9.0}, 1, margin=0.0) == 2
+
+
+def test_select_lane_without_a_current_lane():
+    assert select_lane({1: 10.0, 2: 9.0}, None) == 2
+    assert select_lane({}, 1) == 1
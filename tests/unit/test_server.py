@@ -0,0 +1,32 @@
+"""Tests of the probe echo server."""
+
+import pytest
+
+try:
+    import server
+except Exception as e:  # sanic doesn't import on every Python
+    pytest.skip(f"server.py can't be imported: {e}", allow_module_level=True)
+
+
+def test_stats_of_no_requests():
+    stats = server.ServerStats().as_dict()
+    assert stats["requests"] == 0
+    assert stats["mean_ms"] == 0.0
+    assert stats["max_ms"] == 0.0
+
+
+def test_stats_mean_and_max():
+    stats = server.ServerStats()
+    for elapsed_ms in (1.0, 3.0, 2.0):
+        stats.add(elapsed_ms)
+    summary = stats.as_dict()
+    assert summary["requests"] == 3
+    assert summary["mean_ms"] == pytest.approx(2.0)
+    assert summary["max_ms"] == 3.0
+
+
+def test_echo_reports_the_server_time():
+    _, response = server.app.test_client.get("/echo")
+    assert response.status == 200
+    assert response.body == server.ECHO_BODY
+    assert float(response.headers[server.SERVER_TIME_HEADER]) >= 0.0
@@ -0,0 +1,73 @@
+"""Tests of the offline simulator."""
+
+import pytest
+
+from napps.viniarck.dvel import settings, simulator
+from napps.viniarck.dvel.simulator import RecordedTrace, Trace
+
+
+def test_trace_truth():
+    trace = Trace(10.0).delay_step(10, 5, 20).flap(30, 10, 2).loss_burst(50, 5, 0.5)
+    assert trace.truth(0.0) == (10.0, 0.0)
+    assert trace.truth(15.0) == (15.0, 0.0)
+    assert trace.truth(31.0) == (10.0, 1.0)
+    assert trace.truth(35.0) == (10.0, 0.0)
+    assert trace.truth(52.0) == (10.0, 0.5)
+
+
+def test_trace_samples_are_sent_at_the_rate():
+    trace = Trace(10.0, noise=0.0, seed=1).flap(1.0, 10.0, 1.0)
+    samples = list(trace.samples(0.0, 2.0, 10.0))
+    assert [t for t, _ in samples] == pytest.approx([n / 10 for n in range(1, 21)])
+    assert [rtt for t, rtt in samples if t < 1.0] == [10.0] * 9
+    assert [rtt for t, rtt in samples if 1.0 <= t < 2.0] == [None] * 10
+
+
+def test_recorded_trace():
+    trace = RecordedTrace([(1.5, None), (0.2, 10.0), (0.7, 20.0), (1.2, 30.0)])
+    assert trace.truth(0.5) == (15.0, 0.0)
+    assert trace.truth(1.0) == (30.0, 0.5)
+    assert trace.truth(5.0) == (settings.max_rtt, 1.0)
+    assert list(trace.samples(0.2, 1.5)) == [(0.7, 20.0), (1.2, 30.0), (1.5, None)]
+    assert trace.end == 1.5
+
+
+def test_load_trace(tmp_path):
+    path = tmp_path / "samples.txt"
+    path.write_text("# time host rtt\n100.0 d3 10.0\n\n100.5 d4 -\n101.0 d3 12.0\n")
+    traces = simulator.load_trace(str(path))
+    assert set(traces) == {"d3", "d4"}
+    assert traces["d3"].records == [(0.0, 10.0), (1.0, 12.0)]
+    assert traces["d4"].records == [(0.5, None)]
+
+
+@pytest.fixture
+def defaults(monkeypatch):
+    """Lowest latency and the default damping."""
+    monkeypatch.setattr(settings, "policy", "lowest_latency")
+    monkeypatch.setattr(settings, "policy_params", {})
+
+
+def test_simulate_follows_a_delay_step(defaults):
+    traces = {
+        "a": Trace(10.0, seed=1).delay_step(20, 20, 60),
+        "b": Trace(15.0, seed=2),
+    }
+    result = simulator.simulate(traces, 90.0, rate=50.0, tick=0.1)
+    assert result["ticks"] == 900
+    assert result["switches"] == 2
+    assert 0.0 < result["suboptimal_seconds"] < 10.0
+    assert result["decision_latency_ms"]["count"] == 900
+
+
+def test_simulate_leaves_a_flapping_lane(defaults):
+    traces = {"a": Trace(10.0, seed=1).flap(10, 100, 30), "b": Trace(15.0, seed=2)}
+    result = simulator.simulate(traces, 60.0, rate=50.0, tick=0.1)
+    assert result["switches"] == 2
+    assert result["suboptimal_seconds"] < 10.0
+
+
+def test_scenarios_are_reproducible():
+    first = simulator.scenarios(0)["mixed"]["a"]
+    second = simulator.scenarios(0)["mixed"]["a"]
+    assert list(first.samples(0, 1, 10)) == list(second.samples(0, 1, 10))
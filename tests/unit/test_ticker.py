@@ -0,0 +1,106 @@
+"""Tests of the probe scheduler."""
+
+import asyncio
+
+import pytest
+
+import ticker
+from ticker import Ticker
+
+
+class FakeClock(object):
+
+    """monotonic_ns and asyncio.sleep stand-ins on a virtual clock.
+
+    Every sleep oversleeps by late ns, and work adds ns before a tick.
+    """
+
+    def __init__(self, late: int = 0) -> None:
+        """Constructor of FakeClock."""
+        self.now = 1_000_000_000
+        self.late = late
+
+    def monotonic_ns(self) -> int:
+        """Time in ns."""
+        return self.now
+
+    async def sleep(self, seconds: float) -> None:
+        """Move the clock forward."""
+        self.now += int(round(seconds * 1e9)) + self.late
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Virtual clock of the ticker module."""
+    fake = FakeClock()
+    monkeypatch.setattr(ticker.time, "monotonic_ns", fake.monotonic_ns)
+    monkeypatch.setattr(ticker.asyncio, "sleep", fake.sleep)
+    return fake
+
+
+def run(coro):
+    """Run a coroutine on a new loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_deadlines_dont_drift_with_the_work_done(clock):
+    async def probe():
+        t = Ticker()
+        times = []
+        for _ in range(5):
+            await t.tick(0.01)
+            times.append(clock.now)
+            clock.now += 3_000_000
+        return times
+
+    times = run(probe())
+    assert [b - a for a, b in zip(times, times[1:])] == [10_000_000] * 4
+
+
+def test_lag_of_late_wakeups(clock):
+    clock.late = 200_000
+
+    async def probe():
+        t = Ticker()
+        lags = [await t.tick(0.01) for _ in range(3)]
+        return t, lags
+
+    t, lags = run(probe())
+    assert lags == [0, 200_000, 200_000]
+    assert t.pop_max_lag() == 200_000
+    assert t.pop_max_lag() == 0
+
+
+def test_missed_deadlines_are_skipped(clock):
+    async def probe():
+        t = Ticker()
+        await t.tick(0.01)
+        clock.now += 35_000_000
+        lag = await t.tick(0.01)
+        return t, lag
+
+    t, lag = run(probe())
+    assert t.skipped == 2
+    assert t.ticks == 2
+    assert lag == 5_000_000
+
+
+def test_period_can_change_between_ticks(clock):
+    async def probe():
+        t = Ticker()
+        times = []
+        for period in (0.01, 0.01, 0.002, 0.002):
+            await t.tick(period)
+            times.append(clock.now)
+        return times
+
+    times = run(probe())
+    assert [b - a for a, b in zip(times, times[1:])] == [
+        10_000_000,
+        2_000_000,
+        2_000_000,
+    ]
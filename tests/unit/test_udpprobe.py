@@ -0,0 +1,181 @@
+"""Tests of the UDP prober and reflector."""
+
+import asyncio
+
+import udpprobe
+from udpprobe import PROBE, SEQ_MOD, UDPProber, UDPReflector
+
+
+class FakeTransport(object):
+
+    """Keep the datagrams sent through it."""
+
+    def __init__(self) -> None:
+        """Constructor of FakeTransport."""
+        self.sent = []
+
+    def sendto(self, data: bytes, addr=None) -> None:
+        """Keep a datagram."""
+        self.sent.append((data, addr))
+
+
+class FakeClock(object):
+
+    """perf_counter_ns stand-in moved by hand."""
+
+    def __init__(self) -> None:
+        """Constructor of FakeClock."""
+        self.now = 0
+
+    def __call__(self) -> int:
+        """Time in ns."""
+        return self.now
+
+
+def make_prober(monkeypatch, **kwargs):
+    """A prober on a fake transport and clock, and the samples it reports."""
+    clock = FakeClock()
+    monkeypatch.setattr(udpprobe.time, "perf_counter_ns", clock)
+    samples = []
+    prober = UDPProber(samples.append, **kwargs)
+    prober.connection_made(FakeTransport())
+    return prober, clock, samples
+
+
+def reply(prober, index):
+    """Echo back the index-th probe sent."""
+    data, _ = prober.transport.sent[index]
+    prober.datagram_received(data, None)
+
+
+def test_rtt_of_a_reply(monkeypatch):
+    prober, clock, samples = make_prober(monkeypatch)
+    prober.send()
+    clock.now += 2_500_000
+    reply(prober, 0)
+    assert samples == [2.5]
+    assert prober.counters["received"] == 1
+
+
+def test_overdue_probes_are_lost_on_the_next_send(monkeypatch):
+    prober, clock, samples = make_prober(monkeypatch, timeout=1.0)
+    prober.send()
+    prober.send()
+    clock.now += 1_000_000_000
+    prober.send()
+    assert samples == [None, None]
+    assert prober.counters["lost"] == 2
+    reply(prober, 0)
+    assert prober.counters["late"] == 1
+    assert samples == [None, None]
+
+
+def test_replies_after_the_timeout_are_late(monkeypatch):
+    prober, clock, samples = make_prober(monkeypatch, timeout=1.0)
+    prober.send()
+    clock.now += 1_000_000
+    prober.send()
+    clock.now += 500_000_000
+    prober.send()
+    reply(prober, 2)
+    clock.now += 500_000_000
+    reply(prober, 1)
+    reply(prober, 0)
+    assert samples == [0.0, None, None]
+    assert prober.counters["received"] == 1
+    assert prober.counters["lost"] == 2
+    assert prober.counters["late"] == 2
+    assert prober.counters["reordered"] == 0
+    assert prober.jitter == 0.0
+
+
+def test_reordered_replies(monkeypatch):
+    prober, clock, samples = make_prober(monkeypatch)
+    for _ in range(3):
+        prober.send()
+    clock.now += 1_000_000
+    reply(prober, 2)
+    reply(prober, 0)
+    reply(prober, 1)
+    assert prober.counters["reordered"] == 2
+    assert prober.counters["received"] == 3
+
+
+def test_sequence_numbers_wrap_around(monkeypatch):
+    prober, clock, samples = make_prober(monkeypatch)
+    prober._seq = SEQ_MOD - 1
+    prober.send()
+    prober.send()
+    assert [PROBE.unpack_from(data)[0] for data, _ in prober.transport.sent] == [
+        SEQ_MOD - 1,
+        0,
+    ]
+    reply(prober, 0)
+    reply(prober, 1)
+    assert prober.counters["reordered"] == 0
+
+
+def test_duplicate_and_garbage_replies(monkeypatch):
+    prober, clock, samples = make_prober(monkeypatch)
+    prober.send()
+    reply(prober, 0)
+    reply(prober, 0)
+    prober.datagram_received(b"x", None)
+    assert prober.counters["received"] == 1
+    assert prober.counters["late"] == 1
+    assert len(samples) == 1
+
+
+def test_jitter_follows_rfc_3550(monkeypatch):
+    prober, clock, samples = make_prober(monkeypatch)
+    for rtt_ns in (1_000_000, 3_000_000):
+        prober.send()
+        clock.now += rtt_ns
+        reply(prober, len(prober.transport.sent) - 1)
+    assert prober.jitter == 2.0 / 16
+
+
+def test_payload_padding(monkeypatch):
+    prober, clock, samples = make_prober(monkeypatch, payload_size=100)
+    prober.send()
+    data, _ = prober.transport.sent[0]
+    assert len(data) == PROBE.size + 100
+
+
+def test_reflector_echoes_probes():
+    reflector = UDPReflector()
+    reflector.connection_made(FakeTransport())
+    reflector.datagram_received(b"probe", ("10.0.0.1", 1234))
+    assert reflector.transport.sent == [(b"probe", ("10.0.0.1", 1234))]
+    assert reflector.reflected == 1
+
+
+def test_prober_and_reflector_over_loopback():
+    async def run():
+        loop = asyncio.get_event_loop()
+        transport, reflector = await loop.create_datagram_endpoint(
+            UDPReflector, local_addr=("127.0.0.1", 0)
+        )
+        port = transport.get_extra_info("sockname")[1]
+        samples = []
+        p_transport, prober = await UDPProber.connect(
+            "127.0.0.1", port, on_sample=samples.append
+        )
+        for _ in range(5):
+            prober.send()
+        for _ in range(100):
+            if len(samples) == 5:
+                break
+            await asyncio.sleep(0.01)
+        p_transport.close()
+        transport.close()
+        return samples, reflector
+
+    loop = asyncio.new_event_loop()
+    try:
+        samples, reflector = loop.run_until_complete(run())
+    finally:
+        loop.close()
+    assert len(samples) == 5
+    assert all(rtt is not None and rtt >= 0.0 for rtt in samples)
+    assert reflector.reflected == 5
@@ -0,0 +1,227 @@
+"""Tests of the buffered InfluxDB writer and of the ingest sender."""
+
+import asyncio
+
+import pytest
+
+from writer import (
+    BLOCK,
+    DROP_NEWEST,
+    DROP_OLDEST,
+    BufferedWriter,
+    IngestSender,
+    to_line,
+)
+
+
+class FakeInfluxDB(object):
+
+    """aioinflux client that keeps the batches it's given."""
+
+    def __init__(self, fail: int = 0) -> None:
+        """Constructor of FakeInfluxDB.
+
+        :fail: number of writes that fail before they succeed
+
+        """
+        self.batches = []
+        self.fail = fail
+
+    async def write(self, data: str) -> None:
+        """Keep a batch of lines."""
+        if self.fail:
+            self.fail -= 1
+            raise ConnectionError("InfluxDB is down")
+        self.batches.append(data.split("\n"))
+
+
+def run(coro):
+    """Run a coroutine on a new loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def point(i):
+    """Line of the i-th point."""
+    return to_line("rtt", {"host": "d3"}, {"value": float(i)}, i)
+
+
+def test_line_protocol():
+    line = to_line(
+        "my rtt",
+        {"host": "d,3", "a": "x=y"},
+        {"value": 1.5, "count": 2, "ok": True, "note": 'say "hi"'},
+        123,
+    )
+    assert line == (
+        r"my\ rtt,a=x\=y,host=d\,3 "
+        r'value=1.5,count=2i,ok=t,note="say \"hi\"" 123'
+    )
+
+
+def test_points_are_stamped_when_written():
+    line = to_line("rtt", {}, {"value": 1.0})
+    assert int(line.rsplit(" ", 1)[1]) > 0
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        BufferedWriter(FakeInfluxDB(), policy="drop_random")
+
+
+def test_flush_in_batches():
+    db = FakeInfluxDB()
+
+    async def write():
+        writer = BufferedWriter(db, batch_size=2)
+        for i in range(5):
+            await writer.write("rtt", {"host": "d3"}, {"value": float(i)}, i)
+        await writer.flush()
+        return writer
+
+    writer = run(write())
+    assert [len(batch) for batch in db.batches] == [2, 2, 1]
+    assert db.batches[0][0] == point(0)
+    assert writer.written == 5
+    assert len(writer) == 0
+
+
+@pytest.mark.parametrize(
+    "policy, kept", [(DROP_OLDEST, [2, 3, 4]), (DROP_NEWEST, [0, 1, 2])]
+)
+def test_full_buffer_drops(policy, kept):
+    db = FakeInfluxDB()
+
+    async def write():
+        writer = BufferedWriter(db, batch_size=1, max_points=3, policy=policy)
+        results = [
+            await writer.write("rtt", {"host": "d3"}, {"value": float(i)}, i)
+            for i in range(5)
+        ]
+        await writer.flush()
+        return writer, results
+
+    writer, results = run(write())
+    assert [batch[0] for batch in db.batches] == [point(i) for i in kept]
+    assert writer.dropped == 2
+    assert results == [True, True, True] + [policy == DROP_OLDEST] * 2
+
+
+def test_full_buffer_blocks_until_flushed():
+    db = FakeInfluxDB()
+
+    async def write():
+        writer = BufferedWriter(db, batch_size=2, max_points=2, policy=BLOCK)
+        for i in range(2):
+            await writer.write("rtt", {"host": "d3"}, {"value": float(i)}, i)
+        blocked = asyncio.ensure_future(
+            writer.write("rtt", {"host": "d3"}, {"value": 2.0}, 2)
+        )
+        await asyncio.sleep(0.01)
+        assert not blocked.done()
+        await writer.flush()
+        await blocked
+        await writer.flush()
+        return writer
+
+    writer = run(write())
+    assert [line for batch in db.batches for line in batch] == [
+        point(i) for i in range(3)
+    ]
+    assert writer.dropped == 0
+
+
+def test_failed_flush_keeps_the_points():
+    db = FakeInfluxDB(fail=1)
+
+    async def write():
+        writer = BufferedWriter(db, batch_size=3, max_points=3)
+        for i in range(3):
+            await writer.write("rtt", {"host": "d3"}, {"value": float(i)}, i)
+        await writer.flush()
+        assert len(writer) == 3
+        await writer.flush()
+        return writer
+
+    writer = run(write())
+    assert db.batches == [[point(i) for i in range(3)]]
+    assert writer.dropped == 0
+
+
+def test_failed_flush_of_a_refilled_buffer_drops_the_oldest():
+    db = FakeInfluxDB(fail=1)
+
+    async def write():
+        writer = BufferedWriter(db, batch_size=2, max_points=2)
+        for i in range(2):
+            await writer.write("rtt", {"host": "d3"}, {"value": float(i)}, i)
+        original = db.write
+
+        async def refill_then_fail(data):
+            await writer.write("rtt", {"host": "d3"}, {"value": 2.0}, 2)
+            await original(data)
+
+        db.write = refill_then_fail
+        await writer.flush()
+        db.write = original
+        await writer.flush()
+        return writer
+
+    writer = run(write())
+    assert [line for batch in db.batches for line in batch] == [point(1), point(2)]
+    assert writer.dropped == 1
+
+
+def test_run_flushes_on_the_interval_and_close_flushes_the_rest():
+    db = FakeInfluxDB()
+
+    async def write():
+        writer = BufferedWriter(db, batch_size=100, flush_interval=0.01)
+        flusher = asyncio.ensure_future(writer.run())
+        await asyncio.sleep(0)
+        await writer.write("rtt", {"host": "d3"}, {"value": 0.0}, 0)
+        await asyncio.sleep(0.05)
+        flushed = list(db.batches)
+        await writer.write("rtt", {"host": "d3"}, {"value": 1.0}, 1)
+        await writer.close()
+        await asyncio.wait_for(flusher, 1.0)
+        return flushed
+
+    flushed = run(write())
+    assert flushed == [[point(0)]]
+    assert db.batches == [[point(0)], [point(1)]]
+
+
+class FakeTransport(object):
+
+    """Keep the datagrams sent through it."""
+
+    def __init__(self) -> None:
+        """Constructor of FakeTransport."""
+        self.sent = []
+
+    def sendto(self, data: bytes, addr=None) -> None:
+        """Keep a datagram."""
+        self.sent.append(data)
+
+
+def test_ingest_sender_lines():
+    sender = IngestSender()
+    sender.send("d3", 1.5)
+    sender.connection_made(FakeTransport())
+    sender.send("d3", 1.23456)
+    sender.send("d3", None)
+    assert sender.transport.sent == [b"d3 1.235\n", b"d3 -\n"]
+
+
+
+def test_ingest_sender_rates():
+    sender = IngestSender()
+    sender.datagram_received(b"rate d3 100", None)
+    rates = []
+    sender.on_rate = lambda host, rate: rates.append((host, rate))
+    sender.datagram_received(b"rate d3 100\nrate d4 x\nhello\nrate d5 2.5\n", None)
+    assert rates == [("d3", 100.0), ("d5", 2.5)]